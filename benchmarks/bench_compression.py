@@ -0,0 +1,77 @@
+"""
+CPU cost and bytes saved by compressing contact list payloads.
+
+Run from the project root::
+
+    python -m benchmarks.bench_compression [--sizes 1 10 100 1000]
+
+Each payload is the JSON of a page of contacts as GET /api/contacts/ returns it. The cached
+column is the cost of a hit in the compressed body cache, for comparison.
+"""
+import argparse
+import datetime
+import json
+import random
+import string
+import time
+
+from src.services.compression import CompressedCache, compress, get_brotli
+
+CODINGS = [("gzip", 1), ("gzip", 6), ("gzip", 9), ("br", 1), ("br", 4), ("br", 11)]
+
+
+def make_contacts(count: int, seed: int = 0):
+    rng = random.Random(seed)
+
+    def word(length):
+        return "".join(rng.choice(string.ascii_lowercase) for _ in range(length)).capitalize()
+
+    contacts = []
+    for i in range(count):
+        name, surname = word(rng.randint(3, 9)), word(rng.randint(4, 12))
+        contacts.append({
+            "name": name,
+            "surname": surname,
+            "email": f"{name.lower()}.{surname.lower()}@example.com",
+            "phone_number": "+380" + "".join(rng.choice(string.digits) for _ in range(9)),
+            "birthday": (datetime.date(1960, 1, 1) + datetime.timedelta(days=rng.randint(0, 20000))).isoformat(),
+            "additional_data": rng.choice(["", "work", "family", "met at the conference in " + word(6)]),
+            "id": i + 1,
+            "created_at": datetime.datetime(2023, 10, 1, 12, 0, rng.randint(0, 59)).isoformat(),
+            "updated_at": datetime.datetime(2023, 11, 1, 12, 0, rng.randint(0, 59)).isoformat(),
+        })
+    return json.dumps(contacts).encode()
+
+
+def timed(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+    options = parser.parse_args()
+    codings = [(encoding, level) for encoding, level in CODINGS if encoding == "gzip" or get_brotli() is not None]
+    cache = CompressedCache(64 * 1024 * 1024)
+
+    print(f"{'contacts':>8} {'coding':>8} {'bytes':>9} {'out':>8} {'ratio':>6} {'us':>9} {'us/KB saved':>11} {'cached us':>9}")
+    for size in options.sizes:
+        body = make_contacts(size)
+        repeat = max(3, 20000 // size)
+        for encoding, level in codings:
+            out = compress(body, encoding, level)
+            cost = timed(lambda: compress(body, encoding, level), repeat)
+            key = ("GET", "/api/contacts/", b"", f'W/"{size}"', encoding, level)
+            cache.put(key, out)
+            cached = timed(lambda: cache.get(key), repeat)
+            saved_kb = (len(body) - len(out)) / 1024
+            per_kb = cost / saved_kb if saved_kb > 0 else float("inf")
+            print(f"{size:>8} {encoding + ':' + str(level):>8} {len(body):>9} {len(out):>8} "
+                  f"{len(out) / len(body):>6.2f} {cost:>9.1f} {per_kb:>11.1f} {cached:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
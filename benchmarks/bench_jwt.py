@@ -0,0 +1,61 @@
+"""
+Sign and verify throughput of access tokens per signing algorithm.
+
+Run from the project root::
+
+    python -m benchmarks.bench_jwt [--seconds 1]
+
+HS256 is the SECRET_KEY path; the others go through KeySet with parsed keys, as Auth uses them.
+"""
+import argparse
+import time
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from jose import jwt
+
+from src.services.keys import KeySet
+
+SECRET = "benchmark-secret-key-of-thirty-two-bytes"
+CLAIMS = {"sub": "user@example.com", "sid": "0" * 32, "jti": "1" * 32, "scope": "access_token",
+          "uid": 42, "confirmed": True, "ver": 1, "iat": 1700000000, "exp": 4100000000}
+
+
+def pem(key) -> bytes:
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                             serialization.NoEncryption())
+
+
+def rate(fn, seconds: float) -> float:
+    count, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for _ in range(100):
+            fn()
+        count += 100
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=1.0)
+    options = parser.parse_args()
+
+    signers = {
+        "HS256": (lambda: jwt.encode(CLAIMS, SECRET, algorithm="HS256"),
+                  lambda token: jwt.decode(token, SECRET, algorithms=["HS256"])),
+    }
+    for algorithm, key in [("ES256", ec.generate_private_key(ec.SECP256R1())),
+                           ("RS256", rsa.generate_private_key(public_exponent=65537, key_size=2048))]:
+        keys = KeySet.from_pem(algorithm, [("bench", pem(key))])
+        signers[algorithm] = (lambda keys=keys: keys.encode(CLAIMS), keys.decode)
+
+    print(f"{'algorithm':>9} {'sign/s':>10} {'verify/s':>10} {'verify us':>10} {'token bytes':>11}")
+    for algorithm, (sign, verify) in signers.items():
+        token = sign()
+        signed = rate(sign, options.seconds)
+        verified = rate(lambda: verify(token), options.seconds)
+        print(f"{algorithm:>9} {signed:>10.0f} {verified:>10.0f} {1e6 / verified:>10.1f} {len(token):>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Per-request overhead of the rate limiter dependency.
+
+Run from the project root::
+
+    python -m benchmarks.bench_limiter [--redis redis://localhost:6379/0]
+
+Without --redis the redis round trip is simulated with a fixed delay, which shows how much of
+it the local lease hides.
+"""
+import argparse
+import asyncio
+import time
+from unittest.mock import MagicMock
+
+from src.services.limiter import LimiterBackend, RateLimiter
+
+
+def make_request(ip: str):
+    request = MagicMock()
+    request.headers = {"X-Forwarded-For": ip}
+    request.scope = {}
+    request.url.path = "/bench"
+    return request
+
+
+async def run(limiter: RateLimiter, requests: int, clients: int) -> float:
+    pool = [make_request(f"10.0.{i // 256}.{i % 256}") for i in range(clients)]
+    start = time.perf_counter()
+    for i in range(requests):
+        await limiter(pool[i % clients])
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+class SimulatedScript:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    async def __call__(self, keys, args):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return [int(args[2]), 0]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--redis", help="redis url, simulated round trips when omitted")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=0.3)
+    options = parser.parse_args()
+    limiter = RateLimiter(times=10 ** 9, seconds=60, per="ip")
+    limiter.lease_size = 100
+
+    LimiterBackend.reset()
+    print(f"in-process window   {await run(limiter, options.requests, options.clients):8.2f} us/request")
+
+    if options.redis:
+        import redis.asyncio as redis
+
+        await LimiterBackend.init(redis.from_url(options.redis))
+        label = "redis"
+    else:
+        redis_mock = MagicMock()
+        redis_mock.register_script.return_value = SimulatedScript(options.latency_ms / 1000)
+        await LimiterBackend.init(redis_mock)
+        label = f"simulated {options.latency_ms}ms"
+
+    limiter.lease_size = 1
+    print(f"{label}, no lease  {await run(limiter, options.requests // 10, options.clients):8.2f} us/request")
+    LimiterBackend._leases.clear()
+    limiter.lease_size = 100
+    print(f"{label}, lease 100 {await run(limiter, options.requests, options.clients):8.2f} us/request")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
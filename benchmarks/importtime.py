@@ -0,0 +1,72 @@
+"""
+Import-time report and budget check for ``import main``.
+
+Run from the project root::
+
+    python -m benchmarks.importtime [--budget-ms 1300] [--runs 5] [--top 15]
+
+The report runs ``python -X importtime -c "import main"`` several times and keeps the fastest
+run. It lists the slowest modules and checks two things. First, the cumulative import time of
+``main`` must be within the budget. Second, none of the integrations that are deliberately
+imported on first use may have been loaded. The exit status is 1 when either check fails.
+The default budget leaves about a fifth of headroom over the measured best of 1030-1130 ms.
+"""
+import argparse
+import subprocess
+import sys
+from collections import defaultdict
+
+DEFERRED = ("cloudinary", "fastapi_mail", "aiosmtplib", "passlib", "PIL", "redis", "psycopg2", "brotli")
+
+
+def measure():
+    proc = subprocess.run(
+        [sys.executable, "-W", "ignore", "-X", "importtime", "-c", "import main"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), len(name) - len(name.lstrip()), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget-ms", type=float, default=1300)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    options = parser.parse_args()
+
+    runs = [measure() for _ in range(options.runs)]
+    rows = min(runs, key=lambda r: next(c for n, _, _, c in r if n == "main"))
+    total_ms = next(c for n, _, _, c in rows if n == "main") / 1000
+
+    by_package = defaultdict(int)
+    for name, _, self_us, _ in rows:
+        by_package[name.split(".")[0]] += self_us
+
+    print(f"import main: {total_ms:.1f} ms (best of {options.runs}, budget {options.budget_ms:.0f} ms)\n")
+    print("slowest top-level packages (self time):")
+    for package, us in sorted(by_package.items(), key=lambda i: -i[1])[: options.top]:
+        print(f"  {us / 1000:8.1f} ms  {package}")
+
+    loaded = sorted({name.split(".")[0] for name, *_ in rows} & set(DEFERRED))
+    failed = False
+    if loaded:
+        print(f"\nFAIL: deferred integrations imported at startup: {', '.join(loaded)}")
+        failed = True
+    if total_ms > options.budget_ms:
+        print(f"\nFAIL: import time {total_ms:.1f} ms is over budget")
+        failed = True
+    if not failed:
+        print("\nOK")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
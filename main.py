@@ -1,51 +1,156 @@
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-import redis.asyncio as redis
-from fastapi_limiter import FastAPILimiter
 from fastapi.middleware.cors import CORSMiddleware
 
-from src.routes import contacts,auth,users
-from src.conf.config import settings
-
-app = FastAPI()
+from src.routes import contacts,auth,users,metrics,admin
+from src.conf.config import Settings, settings
+from src.database.db import dispose_engine, init_engine
+from src.database.deadlines import DeadlineMiddleware, parse_route_timeouts
+from src.database.slow_queries import RequestContextMiddleware
+from src.services.admission import AdmissionMiddleware, parse_route_classes
+from src.services.compression import CompressionMiddleware, parse_route_levels
+from src.services.images import init_images
+from src.services.storage import init_storage
+from src.services.limiter import LimiterBackend
+from src.services.sessions import RefreshTokenStore
+from src.services.revocation import RevocationList
+from src.services.singleflight import SingleFlight
+from src.services.user_cache import UserCache
+from src.services.metrics import MetricsMiddleware
+from src.services.tracing import TracingMiddleware, init_tracing
+from src.services import memprof, profiler
 
-origins = [ 
+origins = [
     "http://localhost:3000"
     ]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-app.include_router(auth.router, prefix='/api')
-app.include_router(contacts.router, prefix='/api')
-app.include_router(users.router, prefix='/api')
 
-@app.on_event("startup")
-async def startup():
+def build_lifespan(config: Settings):
     """
-    The startup function is called when the application starts up.
-    It's a good place to initialize things that are used by the app, such as caches or databases.
-    
-    :return: A coroutine, so it must be awaited
+    The build_lifespan function returns the lifespan handler of an application built with config.
+    Clients are created when the application starts serving, not when the module is imported,
+    and the database engine is left to be created by the first request that needs it.
+    Every service reads config from then on, not the settings of the environment.
+
+    :param config: Settings: The application settings
+    :return: The lifespan context manager
     :doc-author: Trelent
     """
-    r = await redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0, encoding="utf-8",
-                          decode_responses=True)
-    await FastAPILimiter.init(r)
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        import redis.asyncio as redis
+
+        init_engine(config)
+        init_images(config)
+        init_tracing(config)
+        profiler.init_profiler(config)
+
+        r = redis.Redis(host=config.redis_host, port=config.redis_port, db=0, encoding="utf-8",
+                        decode_responses=True)
+        await LimiterBackend.init(r, sync_interval=config.rate_limit_sync_interval)
+        RefreshTokenStore.init(r)
+        SingleFlight.init(r)
+        await RevocationList.init(r, capacity=config.revocation_bloom_capacity)
+        await UserCache.init(r, ttl=config.user_cache_local_ttl, size=config.user_cache_local_size)
+        init_storage(config)
+        if config.profile_continuous_interval > 0:
+            profiler.start_continuous(app, config.profile_continuous_interval)
+        yield
+        profiler.stop_continuous()
+        LimiterBackend.reset()
+        RefreshTokenStore.reset()
+        SingleFlight.reset()
+        await RevocationList.close()
+        await UserCache.close()
+        await r.close()
+        dispose_engine()
+
+    return lifespan
+
 
-@app.get("/")
 def read_root():
     """
     The read_root function returns a dictionary with the key &quot;message&quot; and value &quot;Rest API from Eagle Owl 0.0001&quot;.
-    
-    
+
+
     :return: A dictionary
     :doc-author: Trelent
     """
     return {"message": "Rest API from Eagle Owl 0.0001"}
 
 
+def create_app(config: Settings = settings) -> FastAPI:
+    """
+    The create_app function builds the FastAPI application.
+
+    :param config: Settings: The application settings
+    :return: The application
+    :doc-author: Trelent
+    """
+    app = FastAPI(lifespan=build_lifespan(config))
+
+    if config.db_statement_timeout_ms > 0:
+        # Inside admission, so a request holds its slot until its statements are cancelled.
+        app.add_middleware(
+            DeadlineMiddleware,
+            timeout_ms=config.db_statement_timeout_ms,
+            route_timeouts=parse_route_timeouts(config.db_route_timeouts),
+        )
+    if config.admission_enabled:
+        # Innermost, so metrics and traces count the rejected requests and CORS headers reach them;
+        # no more requests run than the database pool has connections for.
+        capacity = config.db_pool_size + config.db_max_overflow
+        app.add_middleware(
+            AdmissionMiddleware,
+            capacity=capacity,
+            queue_size=int(capacity * config.admission_queue_factor),
+            max_wait=config.admission_max_wait,
+            route_classes=parse_route_classes(config.admission_routes),
+        )
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    if config.compression_enabled:
+        app.add_middleware(
+            CompressionMiddleware,
+            minimum_size=config.compression_minimum_size,
+            level=config.compression_level,
+            brotli_quality=config.compression_brotli_quality,
+            route_levels=parse_route_levels(config.compression_route_levels),
+            cache_bytes=config.compression_cache_bytes,
+        )
+    if config.metrics_enabled:
+        app.add_middleware(MetricsMiddleware)
+    if config.trace_sample_rate > 0:
+        app.add_middleware(TracingMiddleware)
+    if config.profiling_enabled:
+        app.add_middleware(profiler.ProfilerMiddleware)
+    if config.memory_profiling_enabled:
+        app.add_middleware(memprof.MemoryMiddleware)
+    if config.slow_query_threshold_ms > 0:
+        app.add_middleware(RequestContextMiddleware)
+
+    app.include_router(auth.router, prefix='/api')
+    app.include_router(contacts.router, prefix='/api')
+    app.include_router(users.router, prefix='/api')
+    app.include_router(admin.router, prefix='/api')
+    if config.metrics_enabled:
+        app.include_router(metrics.router)
+
+    if config.avatar_storage == "local":
+        from fastapi.staticfiles import StaticFiles
+
+        os.makedirs(config.avatar_local_dir, exist_ok=True)
+        app.mount(config.avatar_local_url, StaticFiles(directory=config.avatar_local_dir), name="avatars")
+
+    app.get("/")(read_root)
+    return app
+
+
+app = create_app()
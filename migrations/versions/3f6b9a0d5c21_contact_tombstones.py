@@ -0,0 +1,40 @@
+"""'contact_tombstones'
+
+Revision ID: 3f6b9a0d5c21
+Revises: 8c1d2e7f4a90
+Create Date: 2026-10-19 11:03:54.871220
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f6b9a0d5c21'
+down_revision: Union[str, None] = '8c1d2e7f4a90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('contacts', sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+    op.create_index('ix_contacts_user_id_version', 'contacts', ['user_id', 'version'], unique=False)
+    op.create_table('contact_tombstones',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('contact_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_contact_tombstones_user_id_version', 'contact_tombstones', ['user_id', 'version'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contact_tombstones_user_id_version', table_name='contact_tombstones')
+    op.drop_table('contact_tombstones')
+    op.drop_index('ix_contacts_user_id_version', table_name='contacts')
+    op.drop_column('contacts', 'version')
@@ -0,0 +1,29 @@
+"""'contacts_updated_at'
+
+Revision ID: 8c1d2e7f4a90
+Revises: 19246dc3dbe9
+Create Date: 2026-10-19 10:12:31.204117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c1d2e7f4a90'
+down_revision: Union[str, None] = '19246dc3dbe9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('contacts', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute('UPDATE contacts SET updated_at = created_at')
+    op.add_column('users', sa.Column('contacts_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'contacts_version')
+    op.drop_column('contacts', 'updated_at')
@@ -8,6 +8,8 @@ class Settings(BaseSettings):
     postgres_db: str = 'POSTGRES_DB'
     secret_key: str = 'SECRET_KEY'
     algorithm: str = 'ALGORITHM'
+    jwt_signing_algorithm: str = 'RS256'
+    jwt_signing_keys: str = ''
     mail_username: str = 'MAIL_USERNAME'
     mail_password: str = 'MAIL_PASSWORD'
     mail_from: str = 'JOHN.DOE@EXAMPLE.COM'
@@ -15,10 +17,54 @@ class Settings(BaseSettings):
     mail_server: str = 'MAIL_SERVER'
     redis_host: str = 'REDIS_HOST'
     redis_port: int = 0
+    rate_limit_sync_interval: float = 1.0
+    revocation_bloom_capacity: int = 100000
+    user_cache_ttl: int = 3600
+    user_cache_local_ttl: float = 60.0
+    user_cache_local_size: int = 10000
+    access_token_claims: bool = False
     cloudinary_name: str = 'CLOUDINARY_NAME'
     cloudinary_api_key: int = 0
     cloudinary_api_secret: str = 'CLOUDINARY_API_SECRET'
+    avatar_storage: str = 'cloudinary'
+    avatar_local_dir: str = 'static/avatars'
+    avatar_local_url: str = '/static/avatars'
+    avatar_upload_concurrency: int = 4
+    avatar_process_workers: int = 2
+    avatar_format: str = 'webp'
+    avatar_max_bytes: int = 5 * 1024 * 1024
+    avatar_max_pixels: int = 4096 * 4096
     pythonpath: str = 'PYTHONPATH'
+    metrics_enabled: bool = True
+    trace_sample_rate: float = 0.0
+    trace_export_path: str = 'traces.jsonl'
+    trace_trust_upstream: bool = False
+    admin_emails: str = ''
+    profiling_enabled: bool = True
+    profile_dir: str = 'profiles'
+    profile_interval: float = 0.001
+    profile_continuous_interval: float = 0.0
+    memory_profiling_enabled: bool = True
+    slow_query_threshold_ms: float = 200.0
+    slow_query_log_size: int = 200
+    slow_query_explain: bool = True
+    compression_enabled: bool = True
+    compression_minimum_size: int = 1024
+    compression_level: int = 6
+    compression_brotli_quality: int = 4
+    compression_route_levels: str = ''
+    # Saves re-compressing unchanged bodies; the endpoint and serialization still run.
+    compression_cache_bytes: int = 16 * 1024 * 1024
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_statement_timeout_ms: int = 5000
+    db_route_timeouts: str = '/api/contacts/search=30000,/api/contacts/birthdays=30000,' \
+                             '/api/contacts/batch=30000,/api/contacts/changes=30000'
+    admission_enabled: bool = True
+    admission_queue_factor: float = 2.0
+    admission_max_wait: float = 1.0
+    admission_routes: str = '/api/contacts/search=expensive,/api/contacts/birthdays=expensive,' \
+                            '/api/contacts/batch=expensive,/api/contacts/changes=expensive'
 
     class Config:
         env_file = ".env"
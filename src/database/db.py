@@ -1,24 +1,223 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, Optional
+
+from fastapi import Request
+from fastapi.routing import APIRoute
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
 from src.conf.config import settings
+from src.database import deadlines, loader
+from src.services.metrics import DB_SESSIONS
 
 SQLALCHEMY_DATABASE_URL = settings.sqlalchemy_database_url
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine: Engine | None = None
+_config = settings
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+event.listen(SessionLocal, "after_begin", deadlines.apply_statement_timeout)
+
+
+def init_engine(config=settings) -> None:
+    """
+    The init_engine function selects the settings the engine is created from on first use.
+    An engine created from other settings is disposed, so the next request builds it from config.
+
+    :param config: The application settings
+    :return: None
+    :doc-author: Trelent
+    """
+    global _config
+    if config is not _config:
+        dispose_engine()
+    _config = config
+
+
+def get_engine() -> Engine:
+    """
+    The get_engine function creates the database engine on first use and binds SessionLocal to it.
+    Nothing connects to the database at import time, so workers and tests start without it.
+
+    :return: The database engine
+    :doc-author: Trelent
+    """
+    global engine
+    if engine is None:
+        engine = create_engine(
+            _config.sqlalchemy_database_url, pool_size=_config.db_pool_size, max_overflow=_config.db_max_overflow
+        )
+        if _config.slow_query_threshold_ms > 0:
+            from src.database import slow_queries
+
+            slow_queries.install(
+                engine,
+                _config.slow_query_threshold_ms,
+                _config.slow_query_log_size,
+                _config.slow_query_explain,
+            )
+        SessionLocal.configure(bind=engine)
+    return engine
+
+
+def dispose_engine() -> None:
+    """
+    The dispose_engine function closes every pooled connection of the engine, if it was created.
+
+    :return: None
+    :doc-author: Trelent
+    """
+    global engine
+    if engine is not None:
+        engine.dispose()
+        engine = None
+
+
+class LazySession:
+    def __init__(self, factory: Callable[[], Session] = None, statement_timeout_ms: int = 0):
+        """
+        The LazySession stands in for the Session of a request and opens it on first use.
+        A request answered from a cache, or rejected before it queries, never builds a session,
+        and the engine and its pool are left alone.
+
+        :param self: Represent the instance of the class
+        :param factory: Callable[[], Session]: Builds the session, SessionLocal by default
+        :param statement_timeout_ms: int: Bounds every statement of the session, 0 for no bound
+        :return: None
+        :doc-author: Trelent
+        """
+        self.factory = factory
+        self.statement_timeout_ms = statement_timeout_ms
+        self.info = {}
+        self._session: Optional[Session] = None
+
+    @property
+    def session(self) -> Session:
+        if self._session is None:
+            if self.factory is None:
+                get_engine()
+            self._session = (self.factory or SessionLocal)()
+            self._session.info["statement_timeout_ms"] = self.statement_timeout_ms
+        return self._session
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    @property
+    def materialized(self) -> bool:
+        return self._session is not None
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.session, name)
+
+    def release(self, failed: bool = False) -> None:
+        """
+        The release function gives the connection of the session back to the pool, before the response is serialized.
+        Rows already loaded stay readable: a clean transaction is committed without expiring them.
+        A session with unflushed changes is left alone unless the request failed, when they are rolled back.
+        Touching the database again afterwards checks out a connection for the new transaction.
+
+        :param self: Represent the instance of the class
+        :param failed: bool: Whether the endpoint raised
+        :return: None
+        :doc-author: Trelent
+        """
+        session = self._session
+        if session is None or not session.in_transaction():
+            return
+        if failed:
+            session.rollback()
+        elif not (session.new or session.dirty or session.deleted):
+            session.expire_on_commit = False
+            try:
+                session.commit()
+            finally:
+                session.expire_on_commit = True
+
+    def close(self) -> None:
+        DB_SESSIONS.labels("used" if self._session is not None else "unused").inc()
+        if self._session is not None:
+            self._session.close()
+
+
+@contextmanager
+def detached_session(db) -> Iterator[LazySession]:
+    """
+    The detached_session function opens a short-lived session like db, for a load shared by concurrent requests.
+    It belongs to no request, so the load outlives a request that goes away while others wait on it.
+    It keeps the statement timeout of db.
+
+    :param db: The session of the request that starts the load
+    :return: The session, closed when the load is done
+    :doc-author: Trelent
+    """
+    if isinstance(db, LazySession):
+        session = LazySession(db.factory, db.statement_timeout_ms)
+    else:
+        session = LazySession(lambda: Session(bind=db.get_bind()))
+    try:
+        yield session
+        session.release()
+    finally:
+        session.close()
+
+
+current_session: ContextVar[Optional[LazySession]] = ContextVar("current_session", default=None)
 
 
 # Dependency
-def get_db():
+async def get_db(request: Request):
     """
     The get_db function opens a new database connection if there is none yet for the current application context.
     It will also create the database tables if they don’t exist yet.
-    
+    The session carries the loaders of the request, which memoize and batch lookups by key.
+    It is a LazySession: nothing is checked out of the pool until the first query, and routes of a
+    SessionRoute router release it as soon as the endpoint returns.
+    Its statements are bounded by the timeout of the route. A client that disconnects cancels the
+    request at its next await, not a statement already running, and the session is rolled back.
+
+    :param request: Request: The request the session is opened for
     :return: A database session
     :doc-author: Trelent
     """
-    db = SessionLocal()
+    db = LazySession()
+    timeout = deadlines.statement_timeout(request.scope)
+    db.statement_timeout_ms = _config.db_statement_timeout_ms if timeout is None else timeout
+    loader.attach(db)
+    # get_db runs in the task of the request, so the endpoint wrapper of SessionRoute sees it.
+    current_session.set(db)
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        loader.detach(db)
+        db.close()
+
+
+def release_after(endpoint: Callable) -> Callable:
+    """
+    The release_after function wraps an endpoint so the session of the request is released when it returns or raises.
+
+    :param endpoint: Callable: The async endpoint
+    :return: The wrapped endpoint, with the same signature
+    :doc-author: Trelent
+    """
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        try:
+            result = await endpoint(*args, **kwargs)
+        except BaseException:
+            db = current_session.get()
+            if db is not None:
+                db.release(failed=True)
+            raise
+        db = current_session.get()
+        if db is not None:
+            db.release()
+        return result
+
+    return wrapper
+
+
+class SessionRoute(APIRoute):
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, release_after(endpoint), **kwargs)
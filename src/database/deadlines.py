@@ -0,0 +1,206 @@
+import asyncio
+import json
+import logging
+from typing import Dict, Optional
+
+from sqlalchemy.exc import OperationalError
+
+from src.services.admission import under
+from src.services.metrics import DB_CANCELLATIONS, route_path
+
+logger = logging.getLogger(__name__)
+
+# SQLSTATE of a statement cancelled by statement_timeout or by a cancel request.
+QUERY_CANCELED = "57014"
+
+SCOPE_KEY = "db.deadline"
+
+
+def parse_route_timeouts(value: str) -> Dict[str, int]:
+    """
+    The parse_route_timeouts function reads settings.db_route_timeouts.
+
+    :param value: str: Comma separated path=milliseconds pairs, e.g. "/api/contacts/search=30000"
+    :return: The statement timeout in milliseconds keyed by path prefix
+    :doc-author: Trelent
+    """
+    timeouts = {}
+    for item in value.split(","):
+        path, _, timeout = item.strip().rpartition("=")
+        if path:
+            timeouts[path.rstrip("/")] = int(timeout)
+    return timeouts
+
+
+def route_timeout(path: str, timeouts: Dict[str, int], default: int) -> int:
+    matches = [prefix for prefix in timeouts if under(path, prefix)]
+    if matches:
+        return timeouts[max(matches, key=len)]
+    return default
+
+
+def apply_statement_timeout(session, transaction, connection) -> None:
+    """
+    The apply_statement_timeout function is the after_begin listener of the request sessions.
+    It bounds every statement of the transaction with the timeout of the route, so a slow query
+    fails instead of holding its pool connection. SET LOCAL ends with the transaction, and the
+    pooled connection goes back without the setting.
+
+    :param session: Session: The session that began a transaction
+    :param transaction: SessionTransaction: The transaction
+    :param connection: Connection: The connection of the transaction
+    :return: None
+    :doc-author: Trelent
+    """
+    timeout = session.info.get("statement_timeout_ms")
+    if timeout and connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout)}")
+
+
+def is_timeout(exc: BaseException) -> bool:
+    """
+    The is_timeout function tells whether an exception is a statement the database cancelled.
+
+    :param exc: BaseException: The exception raised by the endpoint
+    :return: True for a statement cancelled by PostgreSQL
+    :doc-author: Trelent
+    """
+    if not isinstance(exc, OperationalError):
+        return False
+    return getattr(exc.orig, "pgcode", None) == QUERY_CANCELED
+
+
+def has_body(scope) -> bool:
+    for name, value in scope.get("headers", []):
+        if name == b"transfer-encoding" or (name == b"content-length" and value.strip() != b"0"):
+            return True
+    return False
+
+
+def stop_watching(watcher: Optional[asyncio.Future]) -> None:
+    if watcher is not None:
+        watcher.cancel()
+
+
+class Deadline:
+    def __init__(self, timeout_ms: int):
+        """
+        The Deadline carries the statement timeout of a request to get_db, and records whether the client went away.
+
+        :param self: Represent the instance of the class
+        :param timeout_ms: int: The statement timeout of the route
+        :return: None
+        :doc-author: Trelent
+        """
+        self.timeout_ms = timeout_ms
+        self.disconnected = False
+
+
+class DeadlineMiddleware:
+    def __init__(self, app, timeout_ms: int, route_timeouts: Dict[str, int] = None):
+        """
+        The DeadlineMiddleware gives each request the statement timeout of its route, and ends its database work early.
+        A statement that runs out of time is answered 504 instead of 500. A client that disconnects
+        cancels the request task at its next await, which rolls the session back. Statements run
+        synchronously on the event loop, so one already running is bounded by the statement timeout only.
+        The disconnect is watched for only once the request body is read, so uploads are not buffered.
+
+        :param self: Represent the instance of the class
+        :param app: The ASGI application
+        :param timeout_ms: int: The statement timeout of the routes not in route_timeouts
+        :param route_timeouts: Dict[str, int]: The statement timeout keyed by path prefix
+        :return: None
+        :doc-author: Trelent
+        """
+        self.app = app
+        self.timeout_ms = timeout_ms
+        self.route_timeouts = route_timeouts or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        deadline = scope[SCOPE_KEY] = Deadline(route_timeout(scope["path"], self.route_timeouts, self.timeout_ms))
+        task = asyncio.current_task()
+        # One message at most is read ahead of the application, so the body keeps its backpressure.
+        messages: asyncio.Queue = asyncio.Queue(maxsize=1)
+        state = {"started": False, "finished": False, "watcher": None}
+
+        async def watch():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    # Past the response, teardown and background tasks still run.
+                    if not state["finished"]:
+                        deadline.disconnected = True
+                        task.cancel()
+                    await messages.put(message)
+                    return
+                await messages.put(message)
+
+        def start_watching():
+            if state["watcher"] is None:
+                state["watcher"] = asyncio.ensure_future(watch())
+
+        async def receive_wrapper():
+            if state["watcher"] is not None:
+                return await messages.get()
+            message = await receive()
+            if message["type"] == "http.request" and not message.get("more_body", False):
+                # The body is read, only a disconnect can come next: watch for it while the endpoint runs.
+                start_watching()
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                state["finished"] = True
+            await send(message)
+
+        if not has_body(scope):
+            start_watching()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        except asyncio.CancelledError:
+            if not deadline.disconnected:
+                raise
+            if hasattr(task, "uncancel"):
+                task.uncancel()
+            DB_CANCELLATIONS.labels(route_path(scope), "disconnect").inc()
+        except Exception as e:
+            if not is_timeout(e) or state["started"]:
+                raise
+            stop_watching(state["watcher"])
+            DB_CANCELLATIONS.labels(route_path(scope), "timeout").inc()
+            logger.warning("Statement of %s %s timed out after %d ms", scope["method"], scope["path"],
+                           deadline.timeout_ms)
+            await self.timed_out(send)
+        finally:
+            stop_watching(state["watcher"])
+
+    @staticmethod
+    async def timed_out(send) -> None:
+        body = json.dumps({"detail": "Database query timed out"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 504,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def statement_timeout(scope) -> Optional[int]:
+    """
+    The statement_timeout function returns the statement timeout the middleware chose for a request.
+
+    :param scope: The ASGI scope of the request
+    :return: The statement timeout of the request, or None when the middleware is not installed
+    :doc-author: Trelent
+    """
+    deadline = scope.get(SCOPE_KEY)
+    if deadline is None:
+        return None
+    return deadline.timeout_ms
@@ -0,0 +1,126 @@
+import asyncio
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from src.database.models import Contact, User
+
+
+class BatchLoader:
+    def __init__(self, fetch: Callable[[List[Hashable]], Dict[Hashable, Any]]):
+        """
+        The BatchLoader memoizes lookups by key for the lifetime of one session, DataLoader style.
+        Keys asked for in the same turn of the event loop are fetched together, so a fan-out of
+        lookups costs one query, and a key asked for twice costs nothing the second time.
+
+        :param self: Represent the instance of the class
+        :param fetch: Callable[[List[Hashable]], Dict[Hashable, Any]]: Fetches many keys at once; absent keys are None
+        :return: None
+        :doc-author: Trelent
+        """
+        self.fetch = fetch
+        self._cache: Dict[Hashable, asyncio.Future] = {}
+        self._queue: List[Tuple[Hashable, asyncio.Future]] = []
+
+    def load(self, key: Hashable) -> asyncio.Future:
+        future = self._cache.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._cache[key] = loop.create_future()
+            self._queue.append((key, future))
+            if len(self._queue) == 1:
+                loop.call_soon(self._dispatch)
+        return future
+
+    async def load_many(self, keys: Iterable[Hashable]) -> List[Any]:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def prime(self, key: Hashable, value: Any) -> None:
+        """
+        The prime function records a value the caller already has, such as a row it just wrote.
+
+        :param self: Represent the instance of the class
+        :param key: Hashable: The key of the value
+        :param value: Any: The value, None if the key does not exist
+        :return: None
+        :doc-author: Trelent
+        """
+        future = self._cache.get(key)
+        if future is None or future.done():
+            future = self._cache[key] = asyncio.get_running_loop().create_future()
+            future.set_result(value)
+
+    def clear(self, key: Hashable) -> None:
+        self._cache.pop(key, None)
+
+    def _dispatch(self) -> None:
+        queue, self._queue = self._queue, []
+        try:
+            found = self.fetch([key for key, _ in queue])
+        except Exception as e:
+            for key, future in queue:
+                # a failed lookup is not memoized, the next load queries again
+                if self._cache.get(key) is future:
+                    del self._cache[key]
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in queue:
+            if not future.done():
+                future.set_result(found.get(key))
+
+
+class Loaders:
+    def __init__(self, db: Session):
+        """
+        The Loaders are the batch loaders of one session, so of one request.
+
+        :param self: Represent the instance of the class
+        :param db: Session: The session the loaders query with
+        :return: None
+        :doc-author: Trelent
+        """
+        self.db = db
+        self.users_by_email = BatchLoader(self._fetch_users)
+        self.contacts = BatchLoader(self._fetch_contacts)
+
+    def _fetch_users(self, emails: List[str]) -> Dict[str, User]:
+        return {user.email: user for user in self.db.query(User).filter(User.email.in_(emails)).all()}
+
+    def _fetch_contacts(self, keys: List[tuple]) -> Dict[tuple, Contact]:
+        # keys are (user_id, contact_id), so a contact is only found by its owner
+        user_ids = {user_id for user_id, _ in keys}
+        contact_ids = {contact_id for _, contact_id in keys}
+        contacts = self.db.query(Contact).filter(Contact.user_id.in_(user_ids), Contact.id.in_(contact_ids)).all()
+        return {(contact.user_id, contact.id): contact for contact in contacts}
+
+
+def attach(db: Session) -> Loaders:
+    """
+    The attach function gives a request session its loaders.
+    Only get_db attaches them: its session lives for one request, so the memoized rows never outlive it.
+
+    :param db: Session: The request session
+    :return: The loaders
+    :doc-author: Trelent
+    """
+    db.info["loaders"] = Loaders(db)
+    return db.info["loaders"]
+
+
+def detach(db: Session) -> None:
+    db.info.pop("loaders", None)
+
+
+def loaders(db: Session) -> Optional[Loaders]:
+    """
+    The loaders function returns the loaders of a request session.
+
+    :param db: Session: The session
+    :return: The loaders, or None for a session that get_db did not open, which then queries directly
+    :doc-author: Trelent
+    """
+    info = getattr(db, "info", None)
+    if not isinstance(info, dict):
+        return None
+    return info.get("loaders")
@@ -1,8 +1,9 @@
-from sqlalchemy import Column, Integer, String, Boolean, func, Table
+from sqlalchemy import Column, Integer, String, Boolean, func, Table, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.schema import ForeignKey
 from sqlalchemy.sql.sqltypes import DateTime, Date
 from sqlalchemy.ext.declarative import declarative_base
+from datetime import datetime
 
 Base = declarative_base()
 
@@ -16,9 +17,24 @@ class Contact(Base):
     birthday = Column(Date)  # Add birthday field
     additional_data = Column(String(255))  # Add optional additional data field
     created_at = Column('created_at', DateTime, default=func.now())
+    # Set by the application rather than the database: sqlite's now() has one second resolution and the ETag needs more
+    updated_at = Column('updated_at', DateTime, default=datetime.now, onupdate=datetime.now)
+    version = Column(Integer, nullable=False, default=0, server_default='0')  # contacts_version of the owner at the last write
     user_id = Column('user_id', ForeignKey('users.id', ondelete='CASCADE'), default=None)
     user = relationship('User', backref="notes")
 
+    __table_args__ = (Index('ix_contacts_user_id_version', 'user_id', 'version'),)
+
+class ContactTombstone(Base):
+    __tablename__ = "contact_tombstones"
+    id = Column(Integer, primary_key=True)
+    contact_id = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False)  # contacts_version of the owner at the deletion
+    deleted_at = Column(DateTime, default=datetime.now)
+    user_id = Column('user_id', ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+
+    __table_args__ = (Index('ix_contact_tombstones_user_id_version', 'user_id', 'version'),)
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True)
@@ -28,4 +44,5 @@ class User(Base):
     created_at = Column('crated_at', DateTime, default=func.now())
     avatar = Column(String(255), nullable=True)
     refresh_token = Column(String(255), nullable=True)
-    confirmed = Column(Boolean, default=False)
\ No newline at end of file
+    confirmed = Column(Boolean, default=False)
+    contacts_version = Column(Integer, nullable=False, default=0, server_default='0')  # bumped on every contact write
\ No newline at end of file
@@ -0,0 +1,191 @@
+import json
+import logging
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Deque, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from src.services.metrics import route_path
+
+logger = logging.getLogger(__name__)
+
+_request_scope: ContextVar[Optional[dict]] = ContextVar("request_scope", default=None)
+_explain_pool: Optional[ThreadPoolExecutor] = None
+
+slow_queries: Deque[Dict] = deque(maxlen=200)
+
+# Seconds before the same statement is explained again; its plan rarely changes in between.
+EXPLAIN_INTERVAL = 60.0
+
+
+def redact(parameters):
+    """
+    The redact function replaces every bound value by its type, so no user data reaches the log.
+
+    :param parameters: The parameters of the statement, a mapping or a sequence, or a list of them
+    :return: The redacted parameters
+    :doc-author: Trelent
+    """
+    if isinstance(parameters, dict):
+        return {key: f"<{type(value).__name__}>" for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return {"executemany": len(parameters), "first": redact(parameters[0])}
+        return [f"<{type(value).__name__}>" for value in parameters]
+    return None
+
+
+def repository_function() -> Optional[str]:
+    """
+    The repository_function function finds the repository function that issued the statement.
+
+    :return: The module and name of the innermost src.repository function on the stack
+    :doc-author: Trelent
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("src.repository"):
+            return f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+def current_route() -> Optional[str]:
+    scope = _request_scope.get()
+    if scope is None:
+        return None
+    return f"{scope['method']} {route_path(scope)}"
+
+
+def capture_plan(engine: Engine, record: Dict, statement: str, parameters, slot: threading.Semaphore = None) -> None:
+    """
+    The capture_plan function runs EXPLAIN for a slow statement on its own connection and stores the plan in record.
+    The statement is planned but not executed. The EXPLAIN itself is marked with the slow_query_explain
+    execution option, so it is not recorded; the mark ends with the statement, not with the connection.
+
+    :param engine: Engine: The engine the statement ran on
+    :param record: Dict: The slow query record
+    :param statement: str: The SQL statement
+    :param parameters: The original parameters of the statement
+    :param slot: threading.Semaphore: Released once the plan is captured
+    :return: None
+    :doc-author: Trelent
+    """
+    prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN (ANALYZE off) "
+    try:
+        with engine.connect() as conn:
+            rows = conn.exec_driver_sql(
+                prefix + statement, parameters or (), execution_options={"slow_query_explain": True}
+            ).fetchall()
+        record["plan"] = [" ".join(str(column) for column in row) for row in rows]
+    except Exception as e:
+        record["plan_error"] = str(e)
+    finally:
+        if slot is not None:
+            slot.release()
+
+
+def install(engine: Engine, threshold_ms: float, buffer_size: int = 200, explain: bool = True) -> None:
+    """
+    The install function adds the slow query listeners to engine.
+    Every statement slower than threshold_ms is logged with its redacted parameters, the route and
+    repository function that issued it, and kept in the slow_queries ring buffer. The EXPLAIN plan
+    of slow SELECT statements is captured in a background thread and added to the record. Only one
+    EXPLAIN runs at a time, so it never holds more than one extra pool connection, and a statement
+    is explained at most once per EXPLAIN_INTERVAL.
+
+    :param engine: Engine: The engine to instrument
+    :param threshold_ms: float: The duration above which a statement is slow
+    :param buffer_size: int: How many slow statements are kept
+    :param explain: bool: Capture the plans of slow SELECT statements
+    :return: None
+    :doc-author: Trelent
+    """
+    global slow_queries, _explain_pool
+    slow_queries = deque(slow_queries, maxlen=buffer_size)
+    if explain and _explain_pool is None:
+        _explain_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="explain")
+    threshold = threshold_ms / 1000
+    explain_slot = threading.BoundedSemaphore(1)
+    explained: Dict[str, float] = {}
+
+    def should_explain(statement: str) -> bool:
+        now = time.monotonic()
+        last = explained.get(statement)
+        if last is not None and now - last < EXPLAIN_INTERVAL:
+            return False
+        if not explain_slot.acquire(blocking=False):
+            return False
+        for key in [key for key, at in explained.items() if now - at >= EXPLAIN_INTERVAL]:
+            del explained[key]
+        explained[statement] = now
+        return True
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        if elapsed < threshold or context.execution_options.get("slow_query_explain"):
+            return
+        record = {
+            "at": datetime.utcnow().isoformat(),
+            "duration_ms": round(elapsed * 1000, 3),
+            "statement": statement,
+            "parameters": redact(parameters),
+            "route": current_route(),
+            "repository": repository_function(),
+        }
+        slow_queries.append(record)
+        logger.warning("slow query %s", json.dumps(record))
+        if explain and not executemany and statement.lstrip()[:6].upper() == "SELECT" and should_explain(statement):
+            _explain_pool.submit(capture_plan, engine, record, statement, parameters, explain_slot)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+
+def recent(limit: int = 50) -> List[Dict]:
+    """
+    The recent function returns the latest slow statements, newest first.
+
+    :param limit: int: How many statements to return
+    :return: The slow query records
+    :doc-author: Trelent
+    """
+    return list(reversed(slow_queries))[:limit]
+
+
+class RequestContextMiddleware:
+    def __init__(self, app):
+        """
+        The RequestContextMiddleware makes the ASGI scope of the request visible to the engine listeners.
+
+        :param self: Represent the instance of the class
+        :param app: The ASGI application
+        :return: None
+        :doc-author: Trelent
+        """
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = _request_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_scope.reset(token)
@@ -1,12 +1,84 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
-from typing import List, Optional
-from src.database.models import Contact, User
-from src.schemas import ContactCreate, ContactUpdate
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy import and_, delete, insert, update
+from typing import List, Optional, Tuple
+from src.database.loader import loaders
+from src.database.models import Contact, ContactTombstone, User
+from src.schemas import ContactCreate, ContactUpdate, ContactOperation
 from datetime import datetime
+from src.services.tracing import traced
 
 
-async def get_contacts(skip: int, limit: int, user: User, db: Session) -> List[Contact]:
+def only_fields(query, fields: Optional[List[str]]):
+    """
+    The only_fields function restricts a contact query to the given columns, so the others are not read.
+    The primary key is always loaded.
+
+    :param query: The query of Contact
+    :param fields: Optional[List[str]]: The column names, None for every column
+    :return: The query
+    :doc-author: Trelent
+    """
+    if not fields:
+        return query
+    return query.options(load_only(*(getattr(Contact, field) for field in fields)))
+
+
+def bump_contacts_version(user: User, db: Session) -> int:
+    """
+    The bump_contacts_version function moves the contacts version of the user, which invalidates the ETags of its contact lists.
+    The increment runs in the database, in the transaction of the write, so concurrent writes never reuse a version.
+    The row lock it takes also orders the writes of one user, which is what makes versions usable as sync tokens.
+
+    :param user: User: The owner of the contacts
+    :param db: Session: Access the database
+    :return: The new contacts version
+    :doc-author: Trelent
+    """
+    return db.execute(
+        update(User)
+        .where(User.id == user.id)
+        .values(contacts_version=User.contacts_version + 1)
+        .returning(User.contacts_version)
+        .execution_options(synchronize_session=False)
+    ).scalar_one()
+
+
+@traced()
+async def get_contacts_version(user: User, db: Session) -> int:
+    """
+    The get_contacts_version function returns the contacts version of the user, read from the database.
+    The cached user may be older than its contacts, so its copy of the version is not used.
+
+    :param user: User: The owner of the contacts
+    :param db: Session: Access the database
+    :return: The contacts version
+    :doc-author: Trelent
+    """
+    return db.query(User.contacts_version).filter(User.id == user.id).scalar() or 0
+
+
+@traced()
+async def get_contact_updated_at(contact_id: int, user: User, db: Session) -> Optional[tuple]:
+    """
+    The get_contact_updated_at function reads only the last write time of a contact, enough to build its ETag.
+
+    :param contact_id: int: The id of the contact
+    :param user: User: The owner of the contact
+    :param db: Session: Access the database
+    :return: A (updated_at,) row, or None if the contact does not exist
+    :doc-author: Trelent
+    """
+    return (
+        db.query(Contact.updated_at)
+        .filter(and_(Contact.id == contact_id, Contact.user_id == user.id))
+        .first()
+    )
+
+
+@traced()
+async def get_contacts(
+    skip: int, limit: int, user: User, db: Session, fields: Optional[List[str]] = None
+) -> List[Contact]:
     """
     The get_contacts function returns a list of contacts for the user.
         
@@ -15,11 +87,12 @@ async def get_contacts(skip: int, limit: int, user: User, db: Session) -> List[C
     :param limit: int: Limit the number of contacts returned
     :param user: User: Filter the contacts by user_id
     :param db: Session: Pass the database session to the function
+    :param fields: Optional[List[str]]: Load only these columns
     :return: A list of contacts
     :doc-author: Trelent
     """
     return (
-        db.query(Contact)
+        only_fields(db.query(Contact), fields)
         .filter(Contact.user_id == user.id)
         .offset(skip)
         .limit(limit)
@@ -27,23 +100,67 @@ async def get_contacts(skip: int, limit: int, user: User, db: Session) -> List[C
     )
 
 
-async def get_contact(contact_id: int, user: User, db: Session) -> Optional[Contact]:
+@traced()
+async def get_contact(
+    contact_id: int, user: User, db: Session, fields: Optional[List[str]] = None
+) -> Optional[Contact]:
     """
     The get_contact function returns a contact from the database.
     
     :param contact_id: int: Specify the id of the contact we want to get
     :param user: User: Get the user id from the database
     :param db: Session: Pass the database session to the function
+    :param fields: Optional[List[str]]: Load only these columns
     :return: A contact object
     :doc-author: Trelent
     """
+    request_loaders = loaders(db)
+    if request_loaders is not None and not fields:
+        return await request_loaders.contacts.load((user.id, contact_id))
     return (
-        db.query(Contact)
+        only_fields(db.query(Contact), fields)
         .filter(and_(Contact.id == contact_id, Contact.user_id == user.id))
         .first()
     )
 
 
+@traced()
+async def get_contacts_by_ids(
+    contact_ids: List[int], user: User, db: Session, fields: Optional[List[str]] = None
+) -> List[Contact]:
+    """
+    The get_contacts_by_ids function returns the contacts of the user with the given ids, in one query.
+    Contacts the request has already loaded are not queried again.
+
+    :param contact_ids: List[int]: The ids of the contacts
+    :param user: User: The owner of the contacts
+    :param db: Session: Access the database
+    :param fields: Optional[List[str]]: Load only these columns
+    :return: The contacts found, in no particular order
+    :doc-author: Trelent
+    """
+    request_loaders = loaders(db)
+    if request_loaders is not None and not fields:
+        contacts = await request_loaders.contacts.load_many((user.id, contact_id) for contact_id in contact_ids)
+        return [contact for contact in contacts if contact is not None]
+    found = []
+    missing = []
+    for contact_id in contact_ids:
+        contact = db.identity_map.get(Session.identity_key(Contact, contact_id))
+        if contact is not None and contact.user_id == user.id:
+            found.append(contact)
+        else:
+            missing.append(contact_id)
+    if missing:
+        found.extend(
+            only_fields(db.query(Contact), fields)
+            .filter(and_(Contact.user_id == user.id, Contact.id.in_(missing)))
+            .all()
+        )
+    return found
+
+
+@traced()
 async def create_contact(contact: ContactCreate, user: User, db: Session) -> Contact:
     """
     The create_contact function creates a new contact in the database.
@@ -59,12 +176,14 @@ async def create_contact(contact: ContactCreate, user: User, db: Session) -> Con
     :doc-author: Trelent
     """
     db_contact = Contact(name=contact.name, user_id=user.id)
+    db_contact.version = bump_contacts_version(user, db)
     db.add(db_contact)
     db.commit()
     db.refresh(db_contact)
     return db_contact
 
 
+@traced()
 async def update_contact(
     contact_id: int, contact: ContactUpdate, user: User, db: Session
 ) -> Optional[Contact]:
@@ -86,11 +205,13 @@ async def update_contact(
     if db_contact:
         for key, value in contact.dict().items():
             setattr(db_contact, key, value)
+        db_contact.version = bump_contacts_version(user, db)
         db.commit()
         db.refresh(db_contact)
     return db_contact
 
 
+@traced()
 async def delete_contact(contact_id: int, user: User, db: Session) -> Optional[Contact]:
     """
     The delete_contact function deletes a contact from the database.
@@ -115,12 +236,19 @@ async def delete_contact(contact_id: int, user: User, db: Session) -> Optional[C
     )
     if db_contact:
         db.delete(db_contact)
+        version = bump_contacts_version(user, db)
+        db.add(ContactTombstone(contact_id=db_contact.id, user_id=user.id, version=version))
         db.commit()
+        request_loaders = loaders(db)
+        if request_loaders is not None:
+            request_loaders.contacts.prime((user.id, contact_id), None)
     return db_contact
 
 
+@traced()
 async def search_contacts(
-    db: Session, user: User, name: str = None, surname: str = None, email: str = None
+    db: Session, user: User, name: str = None, surname: str = None, email: str = None,
+    fields: Optional[List[str]] = None
 ) -> List[Contact]:
     """
     The search_contacts function searches for contacts in the database.
@@ -135,22 +263,24 @@ async def search_contacts(
     :param name: str: Search for contacts by name
     :param surname: str: Filter the contacts by surname
     :param email: str: Filter the contacts by email
+    :param fields: Optional[List[str]]: Load only these columns
     :return: A list of contacts
     :doc-author: Trelent
     """
-    query = db.query(Contact)
+    query = only_fields(db.query(Contact), fields)
     if name:
         query = query.filter(and_(Contact.name.ilike(f"%{name}%"), Contact.user_id == user.id))
     if surname:
         query = query.filter(and_(Contact.surname.ilike(f"%{surname}%", Contact.user_id == user.id)))
     if email:
         query = query.filter(and_(Contact.email.ilike(f"%{email}%", Contact.user_id == user.id)))
-    contacts = await query.all()
+    contacts = query.all()
     return contacts
 
 
+@traced()
 async def get_contacts_with_birthdays(
-    start_date: datetime, end_date: datetime, user: User, db: Session
+    start_date: datetime, end_date: datetime, user: User, db: Session, fields: Optional[List[str]] = None
 ) -> List[Contact]:
     """
     The get_contacts_with_birthdays function returns a list of contacts with birthdays between the start_date and end_date.
@@ -164,12 +294,115 @@ async def get_contacts_with_birthdays(
     :param end_date: datetime: Specify the end date of the range
     :param user: User: Get the user's contacts
     :param db: Session: Connect to the database
+    :param fields: Optional[List[str]]: Load only these columns
     :return: A list of contacts with birthdays between the start and end dates
     :doc-author: Trelent
     """
     contacts = (
-        db.query(Contact)
+        only_fields(db.query(Contact), fields)
         .filter(and_(Contact.birthday.between(start_date.date(), end_date.date()), Contact.user_id == user.id))
         .all()
     )
     return contacts
+
+
+@traced()
+async def get_changes(since: Optional[int], user: User, db: Session) -> Tuple[List[Contact], List[int], int]:
+    """
+    The get_changes function returns what changed in the contacts of the user after the version since.
+    Without since every contact is returned, which is the initial sync of a client.
+    The version is read first: a write committed while the changes are read has a higher version
+    and is returned again by the next sync, so the client may see a change twice but never misses one.
+
+    :param since: Optional[int]: The contacts version the client is at, from its last sync token
+    :param user: User: The owner of the contacts
+    :param db: Session: Access the database
+    :return: The created or updated contacts, the ids of the deleted contacts and the current version
+    :doc-author: Trelent
+    """
+    version = await get_contacts_version(user, db)
+    contacts = db.query(Contact).filter(Contact.user_id == user.id)
+    if since is None:
+        return contacts.order_by(Contact.id).all(), [], version
+    changed = contacts.filter(Contact.version > since).order_by(Contact.version, Contact.id).all()
+    deleted = [
+        contact_id for contact_id, in
+        db.query(ContactTombstone.contact_id)
+        .filter(and_(ContactTombstone.user_id == user.id, ContactTombstone.version > since))
+        .order_by(ContactTombstone.version)
+    ]
+    return changed, deleted, version
+
+
+@traced()
+async def apply_operations(operations: List[ContactOperation], user: User, db: Session) -> Tuple[List[dict], int]:
+    """
+    The apply_operations function runs an ordered list of create, update and delete operations in one transaction.
+    The operations are first replayed against the ids that exist, so the outcome is the one of running
+    them one by one: the last update of a contact wins, and an update or delete of a contact that does
+    not exist, or was deleted earlier in the list, is reported with status 404 and skipped.
+    The surviving writes then go to the database as at most one statement per kind: one INSERT of
+    every created contact, one UPDATE by primary key, one DELETE and one INSERT of tombstones.
+    The whole batch takes one contacts version.
+
+    :param operations: List[ContactOperation]: The operations, in order
+    :param user: User: The owner of the contacts
+    :param db: Session: Access the database
+    :return: The result of each operation, in order, and the contacts version after the batch
+    :doc-author: Trelent
+    """
+    referenced = {operation.id for operation in operations if operation.op != "create"}
+    live = set()
+    if referenced:
+        live = {
+            contact_id for contact_id, in
+            db.query(Contact.id).filter(and_(Contact.user_id == user.id, Contact.id.in_(referenced)))
+        }
+
+    results = []
+    creates = []
+    updates = {}
+    deletes = []
+    for operation in operations:
+        if operation.op == "create":
+            results.append({"op": "create", "id": None, "status": 201})
+            creates.append((len(results) - 1, operation.data.model_dump()))
+        elif operation.id not in live:
+            results.append({"op": operation.op, "id": operation.id, "status": 404})
+        elif operation.op == "update":
+            updates[operation.id] = operation.data.model_dump()
+            results.append({"op": "update", "id": operation.id, "status": 200})
+        else:
+            live.discard(operation.id)
+            updates.pop(operation.id, None)
+            deletes.append(operation.id)
+            results.append({"op": "delete", "id": operation.id, "status": 200})
+
+    if not (creates or updates or deletes):
+        return results, await get_contacts_version(user, db)
+
+    version = bump_contacts_version(user, db)
+    now = datetime.now()
+    if creates:
+        new_ids = db.scalars(
+            insert(Contact).returning(Contact.id, sort_by_parameter_order=True),
+            [dict(values, user_id=user.id, version=version, updated_at=now) for _, values in creates],
+        ).all()
+        for (position, _), contact_id in zip(creates, new_ids):
+            results[position]["id"] = contact_id
+    if updates:
+        db.execute(
+            update(Contact),
+            [dict(values, id=contact_id, version=version, updated_at=now) for contact_id, values in updates.items()],
+        )
+    if deletes:
+        db.execute(
+            delete(Contact).where(Contact.id.in_(deletes)).execution_options(synchronize_session=False)
+        )
+        db.execute(
+            insert(ContactTombstone),
+            [{"contact_id": contact_id, "user_id": user.id, "version": version, "deleted_at": now}
+             for contact_id in deletes],
+        )
+    db.commit()
+    return results, version
@@ -1,10 +1,14 @@
 from libgravatar import Gravatar
 from sqlalchemy.orm import Session
 
+from src.database.loader import loaders
 from src.database.models import User
 from src.schemas import UserModel
+from src.services.tracing import traced
+from src.services.user_cache import UserCache
 
 
+@traced()
 async def get_user_by_email(email: str, db: Session) -> User:
     """
     The get_user_by_email function returns a user object from the database based on the email address provided.
@@ -19,9 +23,13 @@ async def get_user_by_email(email: str, db: Session) -> User:
     :return: The first user with the specified email address
     :doc-author: Trelent
     """
+    request_loaders = loaders(db)
+    if request_loaders is not None:
+        return await request_loaders.users_by_email.load(email)
     return db.query(User).filter(User.email == email).first()
 
 
+@traced()
 async def create_user(body: UserModel, db: Session) -> User:
     """
     The create_user function creates a new user in the database.
@@ -46,9 +54,13 @@ async def create_user(body: UserModel, db: Session) -> User:
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    request_loaders = loaders(db)
+    if request_loaders is not None:
+        request_loaders.users_by_email.prime(new_user.email, new_user)
     return new_user
 
 
+@traced()
 async def update_token(user: User, token: str | None, db: Session) -> None:
     """
     The update_token function updates the refresh token for a user.
@@ -61,7 +73,9 @@ async def update_token(user: User, token: str | None, db: Session) -> None:
     """
     user.refresh_token = token
     db.commit()
+    await UserCache.invalidate(user.email)
     
+@traced()
 async def confirmed_email(email: str, db: Session) -> None:
     """
     The confirmed_email function sets the confirmed field of a user to True.
@@ -74,7 +88,9 @@ async def confirmed_email(email: str, db: Session) -> None:
     user = await get_user_by_email(email, db)
     user.confirmed = True
     db.commit()
+    await UserCache.invalidate(email)
     
+@traced()
 async def update_avatar(email, url: str, db: Session) -> User:
     """
     The update_avatar function updates the avatar of a user.
@@ -93,4 +109,5 @@ async def update_avatar(email, url: str, db: Session) -> User:
     user = await get_user_by_email(email, db)
     user.avatar = url
     db.commit()
+    await UserCache.invalidate(email)
     return user
\ No newline at end of file
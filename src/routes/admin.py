@@ -0,0 +1,175 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+
+from src.conf.config import settings
+from src.database import slow_queries
+from src.database.models import User
+from src.services import memprof, profiler
+from src.services.auth import auth_service
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+
+def get_admin_user(current_user: User = Depends(auth_service.get_principal)):
+    """
+    The get_admin_user function is a dependency that only lets through the users listed in settings.admin_emails.
+
+    :param current_user: User: Get the current user
+    :return: The current user
+    :doc-author: Trelent
+    """
+    admins = {email.strip() for email in settings.admin_emails.split(",") if email.strip()}
+    if current_user.email not in admins:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
+
+
+@router.post("/profiling/token")
+async def create_profile_token(
+    path: str = Query(description="Request path to profile"),
+    ttl: int = Query(300, ge=1, le=3600),
+    admin: User = Depends(get_admin_user),
+):
+    """
+    The create_profile_token function signs a token that enables profiling of requests to path.
+    Send it in the X-Profile header; the response carries the id of the stored profile in X-Profile-Id.
+
+    :param path: str: The request path to profile
+    :param ttl: int: How many seconds the token is valid
+    :param admin: User: The admin user
+    :return: The token and the header to send it in
+    :doc-author: Trelent
+    """
+    return {"header": "X-Profile", "token": profiler.sign_profile_token(path, ttl), "expires_in": ttl}
+
+
+@router.get("/profiling/continuous", response_class=PlainTextResponse)
+async def read_continuous_profile(
+    route: str = Query(None, description='Route as "METHOD /path", all routes when omitted'),
+    admin: User = Depends(get_admin_user),
+):
+    """
+    The read_continuous_profile function returns the stacks aggregated by the continuous profiler in folded format.
+
+    :param route: str: Restrict the profile to one route
+    :param admin: User: The admin user
+    :return: The folded stacks
+    :doc-author: Trelent
+    """
+    continuous = profiler.get_continuous()
+    if continuous is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Continuous profiling is disabled")
+    return continuous.report(route)
+
+
+@router.get("/profiling/{profile_id}", response_class=PlainTextResponse)
+async def read_profile(profile_id: str, admin: User = Depends(get_admin_user)):
+    """
+    The read_profile function returns the stored profile of one request in folded format.
+
+    :param profile_id: str: The id from the X-Profile-Id response header
+    :param admin: User: The admin user
+    :return: The folded stacks
+    :doc-author: Trelent
+    """
+    path = profiler.profile_path(profile_id)
+    if not profile_id.isalnum() or not path.exists():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    return path.read_text()
+
+
+@router.post("/memory/start")
+async def start_memory_tracing(frames: int = Query(25, ge=1, le=100), admin: User = Depends(get_admin_user)):
+    """
+    The start_memory_tracing function starts tracemalloc in this worker.
+    While it runs, every request is slower and the peak allocation of each route is recorded.
+
+    :param frames: int: The traceback depth kept per allocation
+    :param admin: User: The admin user
+    :return: The tracing status
+    :doc-author: Trelent
+    """
+    memprof.start(frames)
+    return memprof.status()
+
+
+@router.post("/memory/stop")
+async def stop_memory_tracing(admin: User = Depends(get_admin_user)):
+    """
+    The stop_memory_tracing function stops tracemalloc and drops the snapshots.
+
+    :param admin: User: The admin user
+    :return: The tracing status
+    :doc-author: Trelent
+    """
+    memprof.stop()
+    return memprof.status()
+
+
+@router.get("/memory")
+async def read_memory_status(admin: User = Depends(get_admin_user)):
+    """
+    The read_memory_status function returns the traced memory, the snapshot ids and the peak allocation per route.
+
+    :param admin: User: The admin user
+    :return: The tracing status and the route peaks
+    :doc-author: Trelent
+    """
+    return {**memprof.status(), "routes": memprof.route_peaks}
+
+
+@router.post("/memory/snapshots")
+async def take_memory_snapshot(admin: User = Depends(get_admin_user)):
+    """
+    The take_memory_snapshot function stores a snapshot of the traced allocations.
+
+    :param admin: User: The admin user
+    :return: The id of the snapshot
+    :doc-author: Trelent
+    """
+    try:
+        return {"id": memprof.take_snapshot()}
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+
+@router.get("/memory/snapshots/{old_id}/diff/{new_id}")
+async def diff_memory_snapshots(
+    old_id: int,
+    new_id: int,
+    group_by: str = Query("lineno", pattern="^(lineno|filename)$"),
+    limit: int = Query(25, ge=1, le=500),
+    admin: User = Depends(get_admin_user),
+):
+    """
+    The diff_memory_snapshots function compares two snapshots.
+    It returns the top growth grouped by file or line, and the growth attributed to the user cache,
+    the ORM identity maps, serialization and the repositories.
+
+    :param old_id: int: The earlier snapshot
+    :param new_id: int: The later snapshot
+    :param group_by: str: Group by "lineno" or "filename"
+    :param limit: int: How many top differences to return
+    :param admin: User: The admin user
+    :return: The differences
+    :doc-author: Trelent
+    """
+    old, new = memprof.get_snapshot(old_id), memprof.get_snapshot(new_id)
+    if old is None or new is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot not found")
+    return memprof.diff(old, new, group_by, limit)
+
+
+@router.get("/slow-queries")
+async def read_slow_queries(limit: int = Query(50, ge=1, le=1000), admin: User = Depends(get_admin_user)):
+    """
+    The read_slow_queries function returns the latest statements slower than settings.slow_query_threshold_ms.
+    Each record carries the redacted parameters, the route and repository function that issued
+    the statement and, for SELECT statements, its EXPLAIN plan once it has been captured.
+
+    :param limit: int: How many statements to return
+    :param admin: User: The admin user
+    :return: The slow query records, newest first
+    :doc-author: Trelent
+    """
+    return slow_queries.recent(limit)
@@ -1,22 +1,27 @@
 from typing import List
 
-from fastapi import APIRouter, HTTPException, Depends, status, Security, BackgroundTasks, Request
+from fastapi import APIRouter, HTTPException, Depends, status, Security, BackgroundTasks, Request, Response
 from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials, HTTPBearer
 from sqlalchemy.orm import Session
 
-from src.database.db import get_db
-from src.schemas import UserModel, UserResponse, TokenModel, RequestEmail
+from src.database.db import SessionRoute, get_db
+from src.schemas import UserModel, UserResponse, TokenModel, RequestEmail, SessionResponse
+from src.database.models import User
 from src.repository import users as repository_users
-from src.services.auth import auth_service
+from src.services.auth import auth_service, IDENTITY_CLAIMS
 from src.services.email import send_email
-from fastapi_limiter.depends import RateLimiter
+from src.services.metrics import EMAIL_QUEUE
+from src.services.limiter import RateLimiter
+from src.services.sessions import RefreshTokenStore, REUSED, ROTATED
+from src.services.revocation import RevocationList
+import time
 
-router = APIRouter(prefix='/auth', tags=["auth"])
+router = APIRouter(prefix='/auth', tags=["auth"], route_class=SessionRoute)
 security = HTTPBearer()
 
 
 @router.post("/signup", response_model=UserResponse, description='No more than 10 requests per minute',
-            dependencies=[Depends(RateLimiter(times=10, seconds=60))],status_code=status.HTTP_201_CREATED)
+            dependencies=[Depends(RateLimiter(times=10, seconds=60, per="ip"))],status_code=status.HTTP_201_CREATED)
 async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Request, db: Session = Depends(get_db)):
     """
     The signup function creates a new user in the database.
@@ -35,15 +40,18 @@ async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Re
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Account already exists")
     body.password = auth_service.get_password_hash(body.password)
     new_user = await repository_users.create_user(body, db)
+    EMAIL_QUEUE.inc()
     background_tasks.add_task(send_email, new_user.email, new_user.username, request.base_url)
     return {"user": new_user, "detail": "User successfully created. Check your email for confirmation."}
 
 
-@router.post("/login", response_model=TokenModel  ,description='No more than 10 requests per minute', dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+@router.post("/login", response_model=TokenModel  ,description='No more than 10 requests per minute', dependencies=[Depends(RateLimiter(times=10, seconds=60, per="ip"))])
+async def login(request: Request, body: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """
     The login function is used to authenticate a user.
+    Every login opens a new session for the device, named by the X-Device-Name header or the user agent.
     
+    :param request: Request: Get the device name from the headers
     :param body: OAuth2PasswordRequestForm: Get the username and password from the request body
     :param db: Session: Get the database session
     :return: A dictionary with the access_token, refresh_token and token_type
@@ -57,12 +65,16 @@ async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depen
     if not auth_service.verify_password(body.password, user.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password")
     # Generate JWT
-    access_token = await auth_service.create_access_token(data={"sub": user.email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": user.email})
-    await repository_users.update_token(user, refresh_token, db)
+    device = request.headers.get("X-Device-Name") or request.headers.get("User-Agent", "unknown")
+    sid, jti = await RefreshTokenStore.create(user.email, device[:100])
+    identity = auth_service.identity_claims(user)
+    access_token = await auth_service.create_access_token(data={"sub": user.email, "sid": sid, **identity})
+    refresh_token = await auth_service.create_refresh_token(
+        data={"sub": user.email, "sid": sid, "jti": jti, **identity}
+    )
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
-@router.post('/request_email',description='No more than 10 requests per minute', dependencies=[Depends(RateLimiter(times=10, seconds=60))])
+@router.post('/request_email',description='No more than 10 requests per minute', dependencies=[Depends(RateLimiter(times=10, seconds=60, per="ip"))])
 async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, request: Request,
                         db: Session = Depends(get_db)):
     """
@@ -85,6 +97,7 @@ async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, r
     if user.confirmed:
         return {"message": "Your email is already confirmed"}
     if user:
+        EMAIL_QUEUE.inc()
         background_tasks.add_task(send_email, user.email, user.username, request.base_url)
     return {"message": "Check your email for confirmation."}
 
@@ -114,26 +127,108 @@ async def confirmed_email(token: str, db: Session = Depends(get_db)):
     return {"message": "Email confirmed"}
 
 
-@router.get('/refresh_token', response_model=TokenModel ,description='No more than 10 requests per minute', dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security), db: Session = Depends(get_db)):
+@router.get('/refresh_token', response_model=TokenModel ,description='No more than 10 requests per minute', dependencies=[Depends(RateLimiter(times=10, seconds=60, per="ip"))])
+async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security)):
     """
     The refresh_token function is used to refresh the access token.
     It takes in a refresh token and returns an access_token, a new refresh_token, and the type of token (bearer).
+    The refresh token is rotated atomically in the session store: it can be used once, and using it a
+    second time revokes the whole session, its access tokens included, since one of the two holders must have stolen it.
     
     
     :param credentials: HTTPAuthorizationCredentials: Get the token from the request header
-    :param db: Session: Pass the database session to the function
     :return: A dictionary with the access_token, refresh_token and token type
     :doc-author: Trelent
     """
-    token = credentials.credentials
-    email = await auth_service.decode_refresh_token(token)
-    user = await repository_users.get_user_by_email(email, db)
-    if user.refresh_token != token:
-        await repository_users.update_token(user, None, db)
+    payload = await auth_service.decode_refresh_claims(credentials.credentials)
+    email, sid, jti = payload["sub"], payload.get("sid"), payload.get("jti")
+    if sid is None or jti is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+    result, new_jti = await RefreshTokenStore.rotate(email, sid, jti)
+    if result == REUSED:
+        # The access tokens already issued to the session die with it.
+        await RevocationList.revoke(sid)
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token reused, session revoked")
+    if result != ROTATED:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
 
-    access_token = await auth_service.create_access_token(data={"sub": email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": email})
-    await repository_users.update_token(user, refresh_token, db)
-    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
\ No newline at end of file
+    # The identity claims were issued at login and travel with the session.
+    identity = {claim: payload[claim] for claim in IDENTITY_CLAIMS if claim in payload}
+    access_token = await auth_service.create_access_token(data={"sub": email, "sid": sid, **identity})
+    refresh_token = await auth_service.create_refresh_token(data={"sub": email, "sid": sid, "jti": new_jti, **identity})
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+
+@router.get('/jwks.json')
+async def jwks(response: Response):
+    """
+    The jwks function publishes the public keys that verify our tokens.
+    Other services cache them and check tokens locally; a retired key stays listed until the
+    tokens it signed have expired.
+
+    :param response: Response: Set the caching headers
+    :return: The JSON Web Key Set
+    :doc-author: Trelent
+    """
+    if auth_service.key_set is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tokens are not signed with public keys")
+    response.headers["Cache-Control"] = "public, max-age=300"
+    return auth_service.key_set.jwks()
+
+
+@router.get('/sessions', response_model=List[SessionResponse])
+async def read_sessions(current_user: User = Depends(auth_service.get_principal)):
+    """
+    The read_sessions function lists the devices the current user is logged in on.
+
+    :param current_user: User: Get the current user
+    :return: The sessions of the user
+    :doc-author: Trelent
+    """
+    return await RefreshTokenStore.sessions(current_user.email)
+
+
+@router.delete('/sessions/{session_id}', status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_session(session_id: str, current_user: User = Depends(auth_service.get_principal)):
+    """
+    The revoke_session function logs one device out: the refresh token of the session stops working.
+
+    :param session_id: str: The id of the session, from read_sessions
+    :param current_user: User: Get the current user
+    :return: None
+    :doc-author: Trelent
+    """
+    if not await RefreshTokenStore.revoke(current_user.email, session_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found")
+    await RevocationList.revoke(session_id)
+
+
+@router.delete('/sessions', status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_sessions(current_user: User = Depends(auth_service.get_principal)):
+    """
+    The revoke_sessions function logs the current user out of every device.
+
+    :param current_user: User: Get the current user
+    :return: None
+    :doc-author: Trelent
+    """
+    for session_id in await RefreshTokenStore.revoke_all(current_user.email):
+        await RevocationList.revoke(session_id)
+
+
+@router.post('/logout', status_code=status.HTTP_204_NO_CONTENT)
+async def logout(credentials: HTTPAuthorizationCredentials = Security(security)):
+    """
+    The logout function revokes the presented access token at once, instead of when it expires,
+    and ends the session it was issued for.
+
+    :param credentials: HTTPAuthorizationCredentials: Get the access token from the request header
+    :return: None
+    :doc-author: Trelent
+    """
+    payload = await auth_service.decode_access_claims(credentials.credentials)
+    if payload.get("jti"):
+        await RevocationList.revoke(payload["jti"], payload["exp"] - time.time())
+    if payload.get("sid"):
+        await RefreshTokenStore.revoke(payload["sub"], payload["sid"])
+        await RevocationList.revoke(payload["sid"])
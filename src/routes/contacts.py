@@ -1,24 +1,31 @@
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, HTTPException, Depends, status, Query
+from fastapi import APIRouter, HTTPException, Depends, status, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 
-from src.database.db import get_db
-from src.schemas import ContactModel, ContactResponse, ContactCreate, ContactUpdate
+from src.database.db import LazySession, SessionRoute, detached_session, get_db
+from src.schemas import ContactModel, ContactResponse, ContactCreate, ContactUpdate, ContactChanges, \
+    ContactBatchGet, ContactBatch, ContactOperations, ContactOperationResults
 from src.repository import contacts as repository_contacts
-from src.services.auth import Auth  # Import your Auth service here
+from src.services.auth import Auth, auth_service  # Import your Auth service here
+from src.services.etag import contact_etag, contacts_list_etag, etag_matches, fieldset_tag, not_modified, set_etag
+from src.services.limiter import RateLimiter
+from src.services.singleflight import SingleFlight
 from src.database.models import User
 from datetime import datetime, timedelta
 
-router = APIRouter(prefix="/contacts", tags=["contacts"])
+router = APIRouter(prefix="/contacts", tags=["contacts"], route_class=SessionRoute)
 
 
 # Add the Auth service as a dependency
-def get_current_user(auth: Auth = Depends(Auth.get_current_user)):
+def get_current_user(auth: Auth = Depends(auth_service.get_principal)):
     """
     The get_current_user function is a dependency that will be injected into the
         function below. It will return the current user object, or None if no user
         is logged in.
+        With identity claims in the token, it is a Principal and costs no lookup.
 
     :param auth: Auth: Get the current user
     :return: An auth object
@@ -27,11 +34,63 @@ def get_current_user(auth: Auth = Depends(Auth.get_current_user)):
     return auth
 
 
-@router.get("/", response_model=List[ContactResponse])
+CONTACT_FIELDS = tuple(ContactResponse.model_fields)
+
+contacts_flight = SingleFlight("contacts")
+
+
+def get_fields(
+    fields: str = Query(None, description=f"Comma separated fields to return, from {', '.join(CONTACT_FIELDS)}")
+) -> Optional[List[str]]:
+    """
+    The get_fields function is a dependency that reads the sparse fieldset of the request.
+    The fields are checked against ContactResponse; id is always returned.
+
+    :param fields: str: The fields query parameter
+    :return: The requested fields, or None for every field
+    :doc-author: Trelent
+    """
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in CONTACT_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown fields: {', '.join(unknown)}"
+        )
+    return ["id"] + [field for field in dict.fromkeys(requested) if field != "id"]
+
+
+def partial_response(content, fields: List[str], etag: str = None) -> JSONResponse:
+    """
+    The partial_response function serializes only the requested fields of one contact or a list of contacts.
+    The response model would reject the partial contacts, so the response is built here.
+
+    :param content: A contact or a list of contacts
+    :param fields: List[str]: The fields to serialize
+    :param etag: str: The ETag of the response, if any
+    :return: The response
+    :doc-author: Trelent
+    """
+    if isinstance(content, list):
+        data = [{field: getattr(contact, field) for field in fields} for contact in content]
+    else:
+        data = {field: getattr(content, field) for field in fields}
+    response = JSONResponse(content=jsonable_encoder(data))
+    if etag is not None:
+        set_etag(response, etag)
+    return response
+
+
+@router.get("/", response_model=List[ContactResponse], description='No more than 100 requests per minute',
+             dependencies=[Depends(RateLimiter(times=100, seconds=60))])
 async def get_contacts(
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
     skip: int = 0,
     limit: int = 100,
+    fields: Optional[List[str]] = Depends(get_fields),
     db: Session = Depends(get_db),
 ):
     """
@@ -39,46 +98,179 @@ async def get_contacts(
         The function takes in three parameters: skip, limit and db.
         Skip is used to determine how many contacts to skip before returning results.
         Limit is used to determine how many contacts should be returned after skipping the specified number of records (skip).
+        The page carries a weak ETag built from the contacts version of the user; when it matches
+        If-None-Match the contacts are neither fetched nor serialized and 304 is returned.
 
 
+    :param request: Request: Read the If-None-Match header
+    :param response: Response: Set the ETag header
     :param current_user: User: Get the current user from the database
     :param skip: int: Skip the first n contacts
     :param limit: int: Limit the number of contacts returned
+    :param fields: Optional[List[str]]: Return only these fields
     :param db: Session: Access the database
     :param : Get the current user from the database
     :return: A list of contacts
     :doc-author: Trelent
     """
-    contacts = await repository_contacts.get_contacts(skip, limit, current_user, db)
-    return contacts
+    version = await repository_contacts.get_contacts_version(current_user, db)
+    etag = contacts_list_etag(current_user.id, version, skip, limit, *([fieldset_tag(fields)] if fields else []))
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    if isinstance(db, LazySession):
+        # The load checks out a connection of its own: the version read must not hold a second one meanwhile.
+        db.release()
+
+    async def load():
+        with detached_session(db) as flight_db:
+            contacts = await repository_contacts.get_contacts(skip, limit, current_user, flight_db, fields)
+            return jsonable_encoder([{field: getattr(contact, field) for field in fields or CONTACT_FIELDS}
+                                     for contact in contacts])
+
+    # Identical concurrent reads of one version of a page share a single query, on a session of its
+    # own: the disconnect of the request that started it must not cancel it for the others.
+    data = await contacts_flight.do(etag, load)
+    if fields:
+        response = JSONResponse(content=data)
+        set_etag(response, etag)
+        return response
+    set_etag(response, etag)
+    return data
+
+
+@router.post("/batch-get", response_model=ContactBatch, description='No more than 100 requests per minute',
+             dependencies=[Depends(RateLimiter(times=100, seconds=60))])
+async def batch_get_contacts(
+    body: ContactBatchGet,
+    current_user: User = Depends(get_current_user),
+    fields: Optional[List[str]] = Depends(get_fields),
+    db: Session = Depends(get_db),
+):
+    """
+    The batch_get_contacts function returns many contacts by id with a single query.
+    The contacts come back in the order of the ids, each once; ids that do not exist or belong to
+    another user are listed in missing.
+
+    :param body: ContactBatchGet: The ids, at most 100
+    :param current_user: User: Get the current user
+    :param fields: Optional[List[str]]: Return only these fields
+    :param db: Session: Pass the database session to the repository layer
+    :return: The contacts and the missing ids
+    :doc-author: Trelent
+    """
+    contact_ids = list(dict.fromkeys(body.ids))
+    by_id = {
+        contact.id: contact
+        for contact in await repository_contacts.get_contacts_by_ids(contact_ids, current_user, db, fields)
+    }
+    contacts = [by_id[contact_id] for contact_id in contact_ids if contact_id in by_id]
+    missing = [contact_id for contact_id in contact_ids if contact_id not in by_id]
+    if fields:
+        return JSONResponse(content=jsonable_encoder({
+            "contacts": [{field: getattr(contact, field) for field in fields} for contact in contacts],
+            "missing": missing,
+        }))
+    return {"contacts": contacts, "missing": missing}
 
 
-@router.get("/{contact_id}", response_model=ContactResponse)
+@router.post("/batch", response_model=ContactOperationResults, description='No more than 30 requests per minute',
+             dependencies=[Depends(RateLimiter(times=30, seconds=60))])
+async def batch_contacts(
+    body: ContactOperations,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    The batch_contacts function applies up to 500 create, update and delete operations in one transaction.
+    Each operation gets a result in the order they were sent: 201 with the new id for creates,
+    200 for updates and deletes, 404 for updates and deletes of contacts that do not exist.
+
+    :param body: ContactOperations: The operations, in order
+    :param current_user: User: Get the current user
+    :param db: Session: Pass the database session to the repository layer
+    :return: The results and the sync token after the batch
+    :doc-author: Trelent
+    """
+    results, version = await repository_contacts.apply_operations(body.operations, current_user, db)
+    return {"results": results, "token": str(version)}
+
+
+# Declared before /{contact_id}, which would otherwise capture the path
+@router.get("/changes", response_model=ContactChanges, description='No more than 100 requests per minute',
+             dependencies=[Depends(RateLimiter(times=100, seconds=60))])
+async def get_contact_changes(
+    since: str = Query(None, description="The token returned by the previous sync"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    The get_contact_changes function returns the contacts created or updated since the sync token,
+    and the ids of the contacts deleted since then. Without a token it returns every contact.
+    The returned token is passed as since on the next sync.
+
+    :param since: str: The token returned by the previous sync
+    :param current_user: User: Get the current user
+    :param db: Session: Pass the database session to the repository layer
+    :return: The changed contacts, the deleted ids and the next token
+    :doc-author: Trelent
+    """
+    if since is not None and not since.isdigit():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid sync token")
+    changed, deleted, version = await repository_contacts.get_changes(
+        int(since) if since is not None else None, current_user, db
+    )
+    return {"changed": changed, "deleted": deleted, "token": str(version)}
+
+
+@router.get("/{contact_id}", response_model=ContactResponse, description='No more than 100 requests per minute',
+             dependencies=[Depends(RateLimiter(times=100, seconds=60))])
 async def get_contact(
     contact_id: int,
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
+    fields: Optional[List[str]] = Depends(get_fields),
     db: Session = Depends(get_db),
 ):
     """
     The get_contact function returns a contact by its id.
+        The contact carries a strong ETag built from its updated_at. A conditional request reads
+        only updated_at first and answers 304 without loading the row when the ETag matches.
 
     :param contact_id: int: Specify the contact id that is passed in the url
+    :param request: Request: Read the If-None-Match header
+    :param response: Response: Set the ETag header
     :param current_user: User: Get the current user from the database
+    :param fields: Optional[List[str]]: Return only these fields
     :param db: Session: Pass the database session to the repository layer
     :return: A contact with the given id, if it exists
     :doc-author: Trelent
     """
-    contact = await repository_contacts.get_contact(contact_id, current_user, db)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        row = await repository_contacts.get_contact_updated_at(contact_id, current_user, db)
+        if row is not None and etag_matches(if_none_match, contact_etag(contact_id, row.updated_at, fields)):
+            return not_modified(contact_etag(contact_id, row.updated_at, fields))
+    # updated_at is loaded as well, for the ETag
+    contact = await repository_contacts.get_contact(
+        contact_id, current_user, db, fields and fields + ["updated_at"]
+    )
     if contact is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found"
         )
+    etag = contact_etag(contact.id, contact.updated_at, fields)
+    if fields:
+        return partial_response(contact, fields, etag)
+    set_etag(response, etag)
     return contact
 
 
-@router.post("/", response_model=ContactResponse)
+@router.post("/", response_model=ContactResponse, description='No more than 30 requests per minute',
+             dependencies=[Depends(RateLimiter(times=30, seconds=60))])
 async def create_contact(
     body: ContactCreate,
+    response: Response,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
@@ -87,18 +279,23 @@ async def create_contact(
 
 
     :param body: ContactCreate: Pass the data from the request body to create_contact function
+    :param response: Response: Set the ETag header of the new contact
     :param current_user: User: Get the current user
     :param db: Session: Pass the database session to the repository layer
     :return: A contact object, which is the same as the body of a request
     :doc-author: Trelent
     """
-    return await repository_contacts.create_contact(body, current_user, db)
+    contact = await repository_contacts.create_contact(body, current_user, db)
+    set_etag(response, contact_etag(contact.id, contact.updated_at))
+    return contact
 
 
-@router.put("/{contact_id}", response_model=ContactResponse)
+@router.put("/{contact_id}", response_model=ContactResponse, description='No more than 30 requests per minute',
+             dependencies=[Depends(RateLimiter(times=30, seconds=60))])
 async def update_contact(
     contact_id: int,
     body: ContactUpdate,
+    response: Response,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
@@ -112,6 +309,7 @@ async def update_contact(
 
     :param contact_id: int: Specify the contact to update
     :param body: ContactUpdate: Get the data from the request body
+    :param response: Response: Set the new ETag header of the contact
     :param current_user: User: Get the current user
     :param db: Session: Pass the database session to the repository layer
     :return: A contact object
@@ -124,10 +322,12 @@ async def update_contact(
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found"
         )
+    set_etag(response, contact_etag(contact.id, contact.updated_at))
     return contact
 
 
-@router.delete("/{contact_id}", response_model=ContactResponse)
+@router.delete("/{contact_id}", response_model=ContactResponse, description='No more than 30 requests per minute',
+             dependencies=[Depends(RateLimiter(times=30, seconds=60))])
 async def delete_contact(
     contact_id: int,
     current_user: User = Depends(get_current_user),
@@ -154,12 +354,14 @@ async def delete_contact(
     return contact
 
 
-@router.get("/search/", response_model=List[ContactResponse])
+@router.get("/search/", response_model=List[ContactResponse], description='No more than 20 requests per minute',
+             dependencies=[Depends(RateLimiter(times=20, seconds=60))])
 async def search_contacts(
     name: str = Query(None, description="Search by name"),
     surname: str = Query(None, description="Search by surname"),
     email: str = Query(None, description="Search by email"),
     current_user: User = Depends(get_current_user),
+    fields: Optional[List[str]] = Depends(get_fields),
     db: Session = Depends(get_db),
 ):
     """
@@ -174,26 +376,33 @@ async def search_contacts(
     :param email: str: Search contacts by email
     :param description: Document the endpoint
     :param current_user: User: Get the current user from the database
+    :param fields: Optional[List[str]]: Return only these fields
     :param db: Session: Pass the database session to the repository layer
     :param : Search for a contact by name, surname or email
     :return: A list of contacts
     :doc-author: Trelent
     """
     contacts = await repository_contacts.search_contacts(
-        db, current_user, name, surname, email
+        db, current_user, name, surname, email, fields
     )
+    if fields:
+        return partial_response(contacts, fields)
     return contacts
 
 
-@router.get("/birthdays/", response_model=List[ContactResponse])
+@router.get("/birthdays/", response_model=List[ContactResponse], description='No more than 20 requests per minute',
+             dependencies=[Depends(RateLimiter(times=20, seconds=60))])
 async def get_contacts_with_birthdays(
-    current_user: User = Depends(get_current_user), db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user),
+    fields: Optional[List[str]] = Depends(get_fields),
+    db: Session = Depends(get_db),
 ):
     """
     The get_contacts_with_birthdays function returns a list of contacts with birthdays in the next week.
 
 
     :param current_user: User: Get the current user
+    :param fields: Optional[List[str]]: Return only these fields
     :param db: Session: Get the database session
     :return: A list of contacts with birthdays in the next 7 days
     :doc-author: Trelent
@@ -201,6 +410,8 @@ async def get_contacts_with_birthdays(
     today = datetime.now()
     next_week = today + timedelta(days=7)
     contacts = await repository_contacts.get_contacts_with_birthdays(
-        today, next_week, current_user, db
+        today, next_week, current_user, db, fields
     )
+    if fields:
+        return partial_response(contacts, fields)
     return contacts
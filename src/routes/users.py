@@ -1,19 +1,23 @@
+import asyncio
+import io
+
 from fastapi import APIRouter, Depends, status, UploadFile, File
 from sqlalchemy.orm import Session
-import cloudinary
-import cloudinary.uploader
 
-from src.database.db import get_db
+from src.database.db import SessionRoute, get_db
 from src.database.models import User
 from src.repository import users as repository_users
 from src.services.auth import auth_service
+from src.services import images, storage
+from src.services.limiter import RateLimiter
 from src.conf.config import settings
 from src.schemas import UserDb
 
-router = APIRouter(prefix="/users", tags=["users"])
+router = APIRouter(prefix="/users", tags=["users"], route_class=SessionRoute)
 
 
-@router.get("/me/", response_model=UserDb)
+@router.get("/me/", response_model=UserDb, description='No more than 60 requests per minute',
+            dependencies=[Depends(RateLimiter(times=60, seconds=60))])
 async def read_users_me(current_user: User = Depends(auth_service.get_current_user)):
     """
     The read_users_me function returns the current user's information.
@@ -32,7 +36,8 @@ async def read_users_me(current_user: User = Depends(auth_service.get_current_us
     return current_user
 
 
-@router.patch("/avatar", response_model=UserDb)
+@router.patch("/avatar", response_model=UserDb, description='No more than 5 requests per minute',
+              dependencies=[Depends(RateLimiter(times=5, seconds=60))])
 async def update_avatar_user(
     file: UploadFile = File(),
     current_user: User = Depends(auth_service.get_current_user),
@@ -51,18 +56,22 @@ async def update_avatar_user(
     :return: A user object, but it returns the old avatar url
     :doc-author: Trelent
     """
-    cloudinary.config(
-        cloud_name=settings.cloudinary_name,
-        api_key=settings.cloudinary_api_key,
-        api_secret=settings.cloudinary_api_secret,
-        secure=True,
-    )
+    data = await images.read_upload(file, settings.avatar_max_bytes)
+    digest = images.content_hash(data)
+    if images.is_current_avatar(current_user.avatar, digest):
+        return current_user
 
-    r = cloudinary.uploader.upload(
-        file.file, public_id=f"NotesApp/{current_user.username}", overwrite=True
-    )
-    src_url = cloudinary.CloudinaryImage(f"NotesApp/{current_user.username}").build_url(
-        width=250, height=250, crop="fill", version=r.get("version")
+    avatar = await images.process_avatar(data)
+    urls = await asyncio.gather(
+        *(
+            storage.upload_avatar(
+                io.BytesIO(body),
+                images.avatar_public_id(current_user.username, digest, size),
+                avatar.fmt,
+            )
+            for size, body in avatar.renditions.items()
+        )
     )
+    src_url = dict(zip(avatar.renditions, urls))[images.AVATAR_SIZES[0]]
     user = await repository_users.update_avatar(current_user.email, src_url, db)
     return user
@@ -1,5 +1,6 @@
-from pydantic import BaseModel, EmailStr, HttpUrl, Field
+from pydantic import BaseModel, EmailStr, HttpUrl, Field, model_validator
 from datetime import date,datetime
+from typing import List, Literal, Optional
 
 class ContactModel(BaseModel):
     name: str
@@ -24,10 +25,48 @@ class ContactResponse(ContactModel):
     birthday: date
     additional_data: str
     created_at: datetime
+    updated_at: Optional[datetime] = None
 
     class Config:
         orm_mode = True
 
+class ContactBatchGet(BaseModel):
+    ids: List[int] = Field(min_length=1, max_length=100)
+
+class ContactBatch(BaseModel):
+    contacts: List[ContactResponse]
+    missing: List[int]
+
+class ContactOperation(BaseModel):
+    op: Literal["create", "update", "delete"]
+    id: Optional[int] = None
+    data: Optional[ContactModel] = None
+
+    @model_validator(mode="after")
+    def check_arguments(self):
+        if self.op != "create" and self.id is None:
+            raise ValueError(f"{self.op} needs an id")
+        if self.op != "delete" and self.data is None:
+            raise ValueError(f"{self.op} needs data")
+        return self
+
+class ContactOperations(BaseModel):
+    operations: List[ContactOperation] = Field(min_length=1, max_length=500)
+
+class ContactOperationResult(BaseModel):
+    op: str
+    id: Optional[int]
+    status: int
+
+class ContactOperationResults(BaseModel):
+    results: List[ContactOperationResult]
+    token: str
+
+class ContactChanges(BaseModel):
+    changed: List[ContactResponse]
+    deleted: List[int]
+    token: str
+
 class UserModel(BaseModel):
     username: str = Field(min_length=5, max_length=16)
     email: str
@@ -55,5 +94,11 @@ class TokenModel(BaseModel):
     refresh_token: str
     token_type: str = "bearer"
     
+class SessionResponse(BaseModel):
+    id: str
+    device: str
+    created: int
+    last_used: int
+
 class RequestEmail(BaseModel):
     email: EmailStr
\ No newline at end of file
@@ -0,0 +1,226 @@
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+from src.services.metrics import ADMISSION
+
+READ, WRITE, EXPENSIVE = "read", "write", "expensive"
+
+# Lower runs first. Reads are mostly answered from the user cache and an indexed query, so they
+# get the pool before writes, and both before searches and batches.
+PRIORITY = {READ: 0, WRITE: 1, EXPENSIVE: 2}
+
+# Share of the capacity each class may hold at once, so expensive work cannot take every slot.
+SHARES = {READ: 1.0, WRITE: 0.5, EXPENSIVE: 0.25}
+
+# Seconds a request of each class may wait for a slot, as a multiple of admission_max_wait.
+WAIT_FACTORS = {READ: 1.0, WRITE: 1.0, EXPENSIVE: 0.5}
+
+EXEMPT_PREFIXES = ("/metrics", "/api/admin", "/docs", "/redoc", "/openapi.json")
+
+
+def parse_route_classes(value: str) -> Dict[str, str]:
+    """
+    The parse_route_classes function reads settings.admission_routes.
+
+    :param value: str: Comma separated path=class pairs, e.g. "/api/contacts/search=expensive"
+    :return: The class keyed by path prefix
+    :doc-author: Trelent
+    """
+    classes = {}
+    for item in value.split(","):
+        path, _, kind = item.strip().rpartition("=")
+        if path:
+            if kind not in PRIORITY:
+                raise ValueError(f"Unknown admission class {kind} for {path}")
+            classes[path.rstrip("/")] = kind
+    return classes
+
+
+def under(path: str, prefix: str) -> bool:
+    return path == prefix or path.startswith(prefix + "/")
+
+
+def classify(method: str, path: str, classes: Dict[str, str]) -> Optional[str]:
+    """
+    The classify function returns the admission class of a request, or None if it is never queued.
+    The longest configured prefix wins; other requests are reads if they are GET or HEAD, and writes otherwise.
+
+    :param method: str: The HTTP method
+    :param path: str: The path of the request
+    :param classes: Dict[str, str]: The classes keyed by path prefix
+    :return: The class, or None for exempt paths
+    :doc-author: Trelent
+    """
+    if path == "/" or any(under(path, prefix) for prefix in EXEMPT_PREFIXES):
+        return None
+    matches = [prefix for prefix in classes if under(path, prefix)]
+    if matches:
+        return classes[max(matches, key=len)]
+    return READ if method in ("GET", "HEAD") else WRITE
+
+
+class Rejected(Exception):
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, capacity: int, queue_size: int, max_wait: float):
+        """
+        The AdmissionController bounds the requests a worker runs at once, and the requests waiting to run.
+        A request that cannot start at once waits in a priority queue; if the queue is full, or the
+        expected wait is longer than the request may wait, it is rejected at once instead.
+
+        :param self: Represent the instance of the class
+        :param capacity: int: How many requests run at once
+        :param queue_size: int: How many requests may wait
+        :param max_wait: float: Seconds a read may wait for a slot
+        :return: None
+        :doc-author: Trelent
+        """
+        self.capacity = max(1, capacity)
+        self.queue_size = queue_size
+        self.limits = {kind: max(1, math.floor(self.capacity * share)) for kind, share in SHARES.items()}
+        self.max_wait = {kind: max_wait * factor for kind, factor in WAIT_FACTORS.items()}
+        self.active = {kind: 0 for kind in PRIORITY}
+        self.running = 0
+        # Smoothed seconds a request of each class holds its slot, to estimate waits.
+        self.service_time = {kind: 0.05 for kind in PRIORITY}
+        self._waiters: List[Tuple[int, int, str, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    def _fits(self, kind: str) -> bool:
+        return self.running < self.capacity and self.active[kind] < self.limits[kind]
+
+    def _take(self, kind: str) -> None:
+        self.running += 1
+        self.active[kind] += 1
+
+    def waiting(self) -> int:
+        return sum(1 for *_, future in self._waiters if not future.done())
+
+    def expected_wait(self, kind: str) -> float:
+        ahead = sum(1 for priority, _, _, future in self._waiters
+                    if priority <= PRIORITY[kind] and not future.done())
+        return (ahead + 1) * self.service_time[kind] / self.limits[kind]
+
+    async def acquire(self, kind: str) -> None:
+        """
+        The acquire function takes a slot for a request of the class, waiting for one if needed.
+
+        :param self: Represent the instance of the class
+        :param kind: str: The admission class of the request
+        :return: None
+        :raises Rejected: When the request should be answered 503 at once
+        :doc-author: Trelent
+        """
+        if self._fits(kind) and not any(priority <= PRIORITY[kind] and not future.done()
+                                        for priority, _, _, future in self._waiters):
+            self._take(kind)
+            ADMISSION.labels(kind, "admitted").inc()
+            return
+        expected = self.expected_wait(kind)
+        if self.waiting() >= self.queue_size or expected > self.max_wait[kind]:
+            ADMISSION.labels(kind, "rejected").inc()
+            raise Rejected(expected)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (PRIORITY[kind], next(self._sequence), kind, future))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait[kind])
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # The slot was granted as the wait ended; give it back.
+                self.release(kind, 0)
+            else:
+                future.cancel()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            ADMISSION.labels(kind, "timeout").inc()
+            raise Rejected(self.expected_wait(kind))
+        ADMISSION.labels(kind, "queued").inc()
+
+    def release(self, kind: str, elapsed: float) -> None:
+        """
+        The release function frees the slot of a finished request and starts the waiters that now fit.
+
+        :param self: Represent the instance of the class
+        :param kind: str: The admission class of the request
+        :param elapsed: float: Seconds the request held its slot
+        :return: None
+        :doc-author: Trelent
+        """
+        self.running -= 1
+        self.active[kind] -= 1
+        if elapsed > 0:
+            self.service_time[kind] += 0.1 * (elapsed - self.service_time[kind])
+        blocked = []
+        while self._waiters and self.running < self.capacity:
+            waiter = heapq.heappop(self._waiters)
+            _, _, waiting_kind, future = waiter
+            if future.done():
+                continue
+            if self.active[waiting_kind] >= self.limits[waiting_kind]:
+                blocked.append(waiter)
+                continue
+            self._take(waiting_kind)
+            future.set_result(True)
+        for waiter in blocked:
+            heapq.heappush(self._waiters, waiter)
+
+
+class AdmissionMiddleware:
+    def __init__(self, app, capacity: int, queue_size: int, max_wait: float = 1.0,
+                 route_classes: Optional[Dict[str, str]] = None):
+        """
+        The AdmissionMiddleware sheds load before it reaches the routes.
+        Past the capacity of the worker, requests queue by priority for a bounded time; when the queue
+        is full or a request would wait too long, it is answered 503 with a Retry-After at once,
+        instead of waiting behind a slow database until the client gives up.
+
+        :param self: Represent the instance of the class
+        :param app: The ASGI application
+        :param capacity: int: How many requests run at once, the connections of the database pool
+        :param queue_size: int: How many requests may wait
+        :param max_wait: float: Seconds a read may wait for a slot
+        :param route_classes: Optional[Dict[str, str]]: The admission class keyed by path prefix
+        :return: None
+        :doc-author: Trelent
+        """
+        self.app = app
+        self.controller = AdmissionController(capacity, queue_size, max_wait)
+        self.route_classes = route_classes or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        kind = classify(scope["method"], scope["path"], self.route_classes)
+        if kind is None:
+            return await self.app(scope, receive, send)
+        try:
+            await self.controller.acquire(kind)
+        except Rejected as e:
+            return await self.reject(send, e.retry_after)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(kind, time.perf_counter() - start)
+
+    @staticmethod
+    async def reject(send, retry_after: float) -> None:
+        body = json.dumps({"detail": "Server is busy, retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
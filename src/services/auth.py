@@ -1,25 +1,165 @@
-from typing import Optional
+from typing import Optional, Tuple
 
 from jose import JWTError, jwt
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, Request, status, Depends
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 import pickle
-import redis
+import uuid
 
-from src.database.db import get_db
+from src.database.db import detached_session, get_db
+from src.database.loader import loaders
+from src.database.models import User
 from src.repository import users as repository_users
 from src.conf.config import settings
+from src.services.keys import KeySet
+from src.services.metrics import BCRYPT_LATENCY, REDIS_LATENCY, USER_CACHE
+from src.services.revocation import RevocationList
+from src.services.singleflight import SingleFlight
+from src.services.tracing import span
+from src.services.user_cache import STORE_LUA, UserCache, user_key, version_key
+
+
+# Bumped whenever the identity claims change meaning; tokens of another version resolve the full user.
+CLAIMS_VERSION = 1
+IDENTITY_CLAIMS = ("uid", "confirmed", "ver")
+
+user_flight = SingleFlight("user")
+
+
+class Principal:
+    def __init__(self, id: int, email: str, confirmed: bool, db: Session):
+        """
+        The Principal is the caller as the access token describes it.
+        The repositories only read user.id, so it stands in for a User; any other attribute loads
+        the full User from the database, once.
+
+        :param self: Represent the instance of the class
+        :param id: int: The id of the user
+        :param email: str: The email of the user
+        :param confirmed: bool: Whether the email of the user was confirmed
+        :param db: Session: Load the full user on demand
+        :return: None
+        :doc-author: Trelent
+        """
+        self.id = id
+        self.email = email
+        self.confirmed = confirmed
+        self._db = db
+        self._user = None
+
+    @property
+    def user(self) -> User:
+        if self._user is None:
+            self._user = self._db.query(User).filter(User.id == self.id).first()
+            if self._user is None:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+        return self._user
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.user, name)
 
 
 class Auth:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
     SECRET_KEY = settings.secret_key
     ALGORITHM = settings.algorithm
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
-    r = redis.Redis(host="localhost", port=6379, db=0)
+    _pwd_context = None
+    _r = None
+    _store_user = None
+    _key_set = None
+
+    @property
+    def pwd_context(self):
+        """
+        The pwd_context property builds the bcrypt context on first use.
+        passlib is only needed on signup and login, so it is not imported at startup.
+
+        :param self: Represent the instance of the class
+        :return: The passlib CryptContext
+        :doc-author: Trelent
+        """
+        if self._pwd_context is None:
+            from passlib.context import CryptContext
+
+            self._pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        return self._pwd_context
+
+    @property
+    def key_set(self) -> Optional[KeySet]:
+        """
+        The key_set property loads the asymmetric signing keys on first use.
+        Without settings.jwt_signing_keys tokens are signed with SECRET_KEY and ALGORITHM.
+
+        :param self: Represent the instance of the class
+        :return: The key set, or None for HMAC signing
+        :doc-author: Trelent
+        """
+        if self._key_set is None and settings.jwt_signing_keys:
+            self._key_set = KeySet.from_files(settings.jwt_signing_algorithm, settings.jwt_signing_keys)
+        return self._key_set
+
+    @key_set.setter
+    def key_set(self, key_set: Optional[KeySet]):
+        self._key_set = key_set
+
+    def encode(self, claims: dict) -> str:
+        if self.key_set is not None:
+            return self.key_set.encode(claims)
+        return jwt.encode(claims, self.SECRET_KEY, algorithm=self.ALGORITHM)
+
+    def decode(self, token: str) -> dict:
+        if self.key_set is not None:
+            return self.key_set.decode(token)
+        return jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+
+    def decode_once(self, token: str, state=None) -> dict:
+        """
+        The decode_once function decodes the token of a request once, for the rate limiter and authentication alike.
+        The claims are kept on the request state next to the token they were decoded from.
+
+        :param self: Represent the instance of the class
+        :param token: str: The token to decode
+        :param state: The request state, or None to always decode
+        :return: The claims of the token
+        :doc-author: Trelent
+        """
+        decoded = getattr(state, "decoded_token", None)
+        if isinstance(decoded, tuple) and decoded[0] == token:
+            return decoded[1]
+        payload = self.decode(token)
+        if state is not None:
+            state.decoded_token = (token, payload)
+        return payload
+
+    @property
+    def r(self):
+        """
+        The r property connects the user cache to redis on first use.
+
+        :param self: Represent the instance of the class
+        :return: The redis client of the user cache
+        :doc-author: Trelent
+        """
+        if self._r is None:
+            import redis
+
+            self._r = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0)
+        return self._r
+
+    @r.setter
+    def r(self, client):
+        self._r = client
+        self._store_user = None
+
+    @property
+    def store_user(self):
+        if self._store_user is None:
+            self._store_user = self.r.register_script(STORE_LUA)
+        return self._store_user
 
     def verify_password(self, plain_password, hashed_password):
         """
@@ -33,7 +173,8 @@ class Auth:
         :return: True if the password is correct
         :doc-author: Trelent
         """
-        return self.pwd_context.verify(plain_password, hashed_password)
+        with span("bcrypt.verify"), BCRYPT_LATENCY.labels("verify").time():
+            return self.pwd_context.verify(plain_password, hashed_password)
 
     def get_password_hash(self, password: str):
         """
@@ -45,7 +186,8 @@ class Auth:
         :return: A hash of the password
         :doc-author: Trelent
         """
-        return self.pwd_context.hash(password)
+        with span("bcrypt.hash"), BCRYPT_LATENCY.labels("hash").time():
+            return self.pwd_context.hash(password)
 
     def create_email_token(self, data: dict):
         """
@@ -62,7 +204,7 @@ class Auth:
         to_encode = data.copy()
         expire = datetime.utcnow() + timedelta(days=7)
         to_encode.update({"iat": datetime.utcnow(), "exp": expire})
-        token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
+        token = self.encode(to_encode)
         return token
 
     async def get_email_from_token(self, token: str):
@@ -76,7 +218,7 @@ class Auth:
         :doc-author: Trelent
         """
         try:
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+            payload = self.decode(token)
             email = payload["sub"]
             return email
         except JWTError as e:
@@ -106,11 +248,9 @@ class Auth:
         else:
             expire = datetime.utcnow() + timedelta(minutes=15)
         to_encode.update(
-            {"iat": datetime.utcnow(), "exp": expire, "scope": "access_token"}
-        )
-        encoded_access_token = jwt.encode(
-            to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM
+            {"iat": datetime.utcnow(), "exp": expire, "scope": "access_token", "jti": uuid.uuid4().hex}
         )
+        encoded_access_token = self.encode(to_encode)
         return encoded_access_token
 
     # define a function to generate a new refresh token
@@ -137,9 +277,7 @@ class Auth:
         to_encode.update(
             {"iat": datetime.utcnow(), "exp": expire, "scope": "refresh_token"}
         )
-        encoded_refresh_token = jwt.encode(
-            to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM
-        )
+        encoded_refresh_token = self.encode(to_encode)
         return encoded_refresh_token
 
     async def decode_refresh_token(self, refresh_token: str):
@@ -154,13 +292,23 @@ class Auth:
         :return: The email of the user who is trying to log in
         :doc-author: Trelent
         """
+        payload = await self.decode_refresh_claims(refresh_token)
+        return payload["sub"]
+
+    async def decode_refresh_claims(self, refresh_token: str):
+        """
+        The decode_refresh_claims function checks the refresh token and returns all of its claims.
+            Besides the email in sub, they name the session (sid) and the token within it (jti).
+
+        :param self: Represent the instance of the class
+        :param refresh_token: str: Pass the refresh token to the function
+        :return: The claims of the token
+        :doc-author: Trelent
+        """
         try:
-            payload = jwt.decode(
-                refresh_token, self.SECRET_KEY, algorithms=[self.ALGORITHM]
-            )
+            payload = self.decode(refresh_token)
             if payload["scope"] == "refresh_token":
-                email = payload["sub"]
-                return email
+                return payload
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid scope for token",
@@ -171,8 +319,69 @@ class Auth:
                 detail="Could not validate credentials",
             )
 
+    async def decode_access_claims(self, access_token: str):
+        """
+        The decode_access_claims function checks the access token and returns all of its claims.
+
+        :param self: Represent the instance of the class
+        :param access_token: str: The access token
+        :return: The claims of the token
+        :doc-author: Trelent
+        """
+        try:
+            payload = self.decode(access_token)
+        except JWTError:
+            payload = {}
+        if payload.get("scope") != "access_token":
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+            )
+        return payload
+
+    def identity_claims(self, user: User) -> dict:
+        """
+        The identity_claims function returns the claims that let an access token stand in for the user.
+        They are only issued when settings.access_token_claims is on.
+
+        :param self: Represent the instance of the class
+        :param user: User: The user the token is issued to
+        :return: The id, confirmed and version claims, or an empty dict
+        :doc-author: Trelent
+        """
+        if not settings.access_token_claims:
+            return {}
+        return {"uid": user.id, "confirmed": user.confirmed, "ver": CLAIMS_VERSION}
+
+    async def verify_access_token(self, token: str, state=None) -> dict:
+        """
+        The verify_access_token function checks the signature, scope and revocation of an access token.
+
+        :param self: Represent the instance of the class
+        :param token: str: The access token
+        :param state: The request state, which may hold the claims the rate limiter decoded
+        :return: The claims of the token
+        :doc-author: Trelent
+        """
+        credentials_exception = HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+        try:
+            # Decode JWT
+            with span("auth.decode"):
+                payload = self.decode_once(token, state)
+        except JWTError:
+            raise credentials_exception
+        if payload.get("scope") != "access_token" or payload.get("sub") is None:
+            raise credentials_exception
+        if await RevocationList.is_revoked(payload.get("jti"), payload.get("sid")):
+            raise credentials_exception
+        return payload
+
     async def get_current_user(
-        self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
+        self, request: Request, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
     ):
         """
         The get_current_user function is a dependency that will be used in the UserController class.
@@ -180,38 +389,100 @@ class Auth:
 
 
         :param self: Represent the instance of a class
+        :param request: Request: The request, whose token may already be decoded
         :param token: str: Get the token from the authorization header
         :param db: Session: Pass the database session to the function
         :return: A user object
         :doc-author: Trelent
         """
-        credentials_exception = HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+        payload = await self.verify_access_token(token, request.state)
+        return await self.load_user(payload["sub"], db)
 
-        try:
-            # Decode JWT
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            if payload["scope"] == "access_token":
-                email = payload["sub"]
-                if email is None:
-                    raise credentials_exception
-            else:
-                raise credentials_exception
-        except JWTError as e:
-            raise credentials_exception
-        user = self.r.get(f"user:{email}")
-        if user is None:
-            user = await repository_users.get_user_by_email(email, db)
-            if user is None:
-                raise credentials_exception
-            self.r.set(f"user:{email}", pickle.dumps(user))
-            self.r.expire(f"user:{email}", 900)
+    async def get_principal(
+        self, request: Request, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
+    ):
+        """
+        The get_principal function is a dependency for routes that only need to know who is calling.
+        A token with identity claims is enough to build the Principal, with no cache or database lookup;
+        other tokens resolve the full user as get_current_user does.
+
+        :param self: Represent the instance of a class
+        :param request: Request: The request, whose token may already be decoded
+        :param token: str: Get the token from the authorization header
+        :param db: Session: Load the full user if the route needs it
+        :return: A Principal, or a User for tokens without identity claims
+        :doc-author: Trelent
+        """
+        payload = await self.verify_access_token(token, request.state)
+        if payload.get("ver") == CLAIMS_VERSION and "uid" in payload:
+            return Principal(payload["uid"], payload["sub"], payload.get("confirmed", False), db)
+        return await self.load_user(payload["sub"], db)
+
+    async def load_user(self, email: str, db: Session) -> User:
+        """
+        The load_user function returns the user from the local tier, redis, or the database, in that order.
+
+        :param self: Represent the instance of a class
+        :param email: str: The email of the user
+        :param db: Session: Pass the database session to the function
+        :return: A user object
+        :doc-author: Trelent
+        """
+        cached = UserCache.get(email)
+        if cached is not None:
+            USER_CACHE.labels("local_hit").inc()
         else:
-            user = pickle.loads(user)
+            cached = await self._shared_user(email, db)
+        user = pickle.loads(cached)
+        request_loaders = loaders(db)
+        if request_loaders is not None:
+            # The cached user joins the request session, so looking it up again by email is no query.
+            user = db.merge(user, load=False)
+            request_loaders.users_by_email.prime(email, user)
         return user
 
+    async def _shared_user(self, email: str, db: Session) -> bytes:
+        version = UserCache.version(email)
+        with span("user_cache.get") as cache_span, REDIS_LATENCY.labels("get").time():
+            cached = self.r.get(user_key(email))
+            if cache_span is not None:
+                cache_span.set_attribute("cache.hit", cached is not None)
+        if cached is None:
+            USER_CACHE.labels("miss").inc()
+            # Concurrent misses for one user share a single database read.
+            cached = await user_flight.do(
+                email, lambda: self._fill_user(email, db, version), lambda: self._probe_user(email)
+            )
+        else:
+            USER_CACHE.labels("hit").inc()
+            UserCache.put(email, cached, version)
+        return cached
+
+    async def _probe_user(self, email: str) -> Optional[bytes]:
+        with REDIS_LATENCY.labels("get").time():
+            return self.r.get(user_key(email))
+
+    async def _fill_user(self, email: str, db: Session, version: Tuple[int, int]) -> bytes:
+        with REDIS_LATENCY.labels("get").time():
+            shared_version = self.r.get(version_key(email)) or b"0"
+        # The read is shared by every request waiting on user_flight, so it runs on a session of its
+        # own, which the disconnect of the request that started it does not cancel.
+        with detached_session(db) as flight_db:
+            user = await repository_users.get_user_by_email(email, flight_db)
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        cached = pickle.dumps(user)
+        # An invalidation of the user during the read means it may already be stale: neither tier keeps it.
+        if UserCache.put(email, cached, version):
+            with REDIS_LATENCY.labels("set").time():
+                self.store_user(
+                    keys=[user_key(email), version_key(email)], args=[shared_version, cached, settings.user_cache_ttl]
+                )
+        return cached
+
 
 auth_service = Auth()
@@ -0,0 +1,243 @@
+import gzip
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from src.services.metrics import COMPRESSION_BYTES, COMPRESSION_CACHE, route_path
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/xml")
+
+_brotli = False  # not looked up yet
+
+
+def get_brotli():
+    """
+    The get_brotli function returns the brotli module, or None when it is not installed.
+    brotli is optional; without it only gzip is offered.
+
+    :return: The brotli module or None
+    :doc-author: Trelent
+    """
+    global _brotli
+    if _brotli is False:
+        try:
+            import brotli
+        except ImportError:
+            brotli = None
+        _brotli = brotli
+    return _brotli
+
+
+def parse_route_levels(value: str) -> Dict[str, int]:
+    """
+    The parse_route_levels function reads settings.compression_route_levels.
+
+    :param value: str: Comma separated path=level pairs, e.g. "/api/contacts/=9,/api/contacts/changes=4"
+    :return: The compression level keyed by route path template
+    :doc-author: Trelent
+    """
+    levels = {}
+    for item in value.split(","):
+        path, _, level = item.strip().rpartition("=")
+        if path:
+            levels[path] = int(level)
+    return levels
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    The choose_encoding function picks the content coding for a request from its Accept-Encoding header.
+    brotli is preferred when the client accepts it and the module is installed, then gzip.
+
+    :param accept_encoding: str: The Accept-Encoding header
+    :return: "br", "gzip" or None
+    :doc-author: Trelent
+    """
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    if accepted.get("br", 0) > 0 and get_brotli() is not None:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str, level: int) -> bytes:
+    """
+    The compress function compresses a whole body.
+    The level is the gzip level (capped at 9) or the brotli quality.
+
+    :param body: bytes: The body
+    :param encoding: str: "br" or "gzip"
+    :param level: int: The compression level
+    :return: The compressed body
+    :doc-author: Trelent
+    """
+    if encoding == "br":
+        return get_brotli().compress(body, quality=level)
+    return gzip.compress(body, compresslevel=min(level, 9), mtime=0)
+
+
+class StreamCompressor:
+    def __init__(self, encoding: str, level: int):
+        """
+        The StreamCompressor compresses a body that arrives in chunks.
+
+        :param self: Represent the instance of the class
+        :param encoding: str: "br" or "gzip"
+        :param level: int: The compression level
+        :return: None
+        :doc-author: Trelent
+        """
+        if encoding == "br":
+            self._compressor = get_brotli().Compressor(quality=level)
+            self._compress, self._finish = self._compressor.process, self._compressor.finish
+        else:
+            self._compressor = zlib.compressobj(min(level, 9), zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._compress, self._finish = self._compressor.compress, self._compressor.flush
+
+    def compress(self, chunk: bytes, last: bool) -> bytes:
+        data = self._compress(chunk)
+        return data + self._finish() if last else data
+
+
+class CompressedCache:
+    def __init__(self, max_bytes: int):
+        """
+        The CompressedCache keeps compressed bodies of responses that carry an ETag, least recently used first out.
+        Equal ETags on the same URL mean equal bodies, so a hit is sent without compressing again.
+        It saves the compression step only: the endpoint still runs and serializes the body, because
+        only the endpoint knows whether an ETag is still current. Requests whose If-None-Match matches
+        are answered 304 by the routes before they query or serialize, which this cache does not replace.
+
+        :param self: Represent the instance of the class
+        :param max_bytes: int: The total size of the bodies kept
+        :return: None
+        :doc-author: Trelent
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[Tuple, bytes]" = OrderedDict()
+
+    def get(self, key: Tuple) -> Optional[bytes]:
+        body = self._entries.get(key)
+        if body is not None:
+            self._entries.move_to_end(key)
+        return body
+
+    def put(self, key: Tuple, body: bytes) -> None:
+        if len(body) > self.max_bytes or key in self._entries:
+            return
+        self._entries[key] = body
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+
+def compressible(status: int, headers: Headers) -> bool:
+    if status < 200 or status in (204, 304) or "content-encoding" in headers:
+        return False
+    content_type = headers.get("content-type", "")
+    return content_type.startswith(COMPRESSIBLE_TYPES) or "+json" in content_type or "+xml" in content_type
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1024, level: int = 6, brotli_quality: int = 4,
+                 route_levels: Optional[Dict[str, int]] = None, cache_bytes: int = 16 * 1024 * 1024):
+        """
+        The CompressionMiddleware compresses responses with brotli or gzip, as the client accepts.
+        Bodies under minimum_size are sent as they are: for them the headers and CPU cost more than
+        the bytes saved. Routes listed in route_levels use their own level for both codings.
+        Compressed bodies of responses with an ETag are cached to skip compressing them again, see CompressedCache.
+
+        :param self: Represent the instance of the class
+        :param app: The ASGI application
+        :param minimum_size: int: The smallest body that is compressed
+        :param level: int: The default gzip level
+        :param brotli_quality: int: The default brotli quality
+        :param route_levels: Optional[Dict[str, int]]: Levels keyed by route path template
+        :param cache_bytes: int: The size of the compressed body cache, 0 disables it
+        :return: None
+        :doc-author: Trelent
+        """
+        self.app = app
+        self.minimum_size = minimum_size
+        self.levels = {"gzip": level, "br": brotli_quality}
+        self.route_levels = route_levels or {}
+        self.cache = CompressedCache(cache_bytes) if cache_bytes > 0 else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        passthrough = False
+        streamer: Optional[StreamCompressor] = None
+
+        async def send_wrapper(message):
+            nonlocal start, passthrough, streamer
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                return await send(message)
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if streamer is not None:
+                data = streamer.compress(body, not more_body)
+                COMPRESSION_BYTES.labels(encoding, "identity").inc(len(body))
+                COMPRESSION_BYTES.labels(encoding, "compressed").inc(len(data))
+                return await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+            headers = MutableHeaders(raw=start["headers"])
+            if not compressible(start["status"], headers) or (not more_body and len(body) < self.minimum_size):
+                passthrough = True
+                await send(start)
+                return await send(message)
+
+            level = self.route_levels.get(route_path(scope), self.levels[encoding])
+            headers["Content-Encoding"] = encoding
+            headers.add_vary_header("Accept-Encoding")
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                # the compressed body is a different representation, so the strong ETag no longer holds
+                headers["ETag"] = f"W/{etag}"
+
+            if more_body:
+                streamer = StreamCompressor(encoding, level)
+                del headers["Content-Length"]
+                await send(start)
+                return await send_wrapper(message)
+
+            key = None
+            data = None
+            if etag and self.cache is not None:
+                key = (scope["method"], scope["path"], scope["query_string"], etag, encoding, level)
+                data = self.cache.get(key)
+                COMPRESSION_CACHE.labels("hit" if data is not None else "miss").inc()
+            if data is None:
+                data = compress(body, encoding, level)
+                if key is not None:
+                    self.cache.put(key, data)
+            COMPRESSION_BYTES.labels(encoding, "identity").inc(len(body))
+            COMPRESSION_BYTES.labels(encoding, "compressed").inc(len(data))
+            headers["Content-Length"] = str(len(data))
+            await send(start)
+            await send({"type": "http.response.body", "body": data})
+
+        await self.app(scope, receive, send_wrapper)
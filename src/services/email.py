@@ -1,27 +1,42 @@
+from functools import lru_cache
 from pathlib import Path
 
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from fastapi_mail.errors import ConnectionErrors
 from pydantic import EmailStr
 from src.conf.config import settings
 
 from src.services.auth import auth_service
+from src.services.metrics import EMAIL_QUEUE
+from src.services.tracing import traced
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.mail_username,
-    MAIL_PASSWORD=settings.mail_password,
-    MAIL_FROM=settings.mail_from,
-    MAIL_PORT=settings.mail_port,
-    MAIL_SERVER=settings.mail_server,
-    MAIL_FROM_NAME="Eagle Owl",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=Path(__file__).parent / "templates",
-)
 
+@lru_cache
+def get_mail_config():
+    """
+    The get_mail_config function builds the fastapi_mail connection config on first use.
+    fastapi_mail is imported here rather than at module level, since it is heavy and only
+    needed when a message is actually sent.
+
+    :return: The connection config of the mail server
+    :doc-author: Trelent
+    """
+    from fastapi_mail import ConnectionConfig
 
+    return ConnectionConfig(
+        MAIL_USERNAME=settings.mail_username,
+        MAIL_PASSWORD=settings.mail_password,
+        MAIL_FROM=settings.mail_from,
+        MAIL_PORT=settings.mail_port,
+        MAIL_SERVER=settings.mail_server,
+        MAIL_FROM_NAME="Eagle Owl",
+        MAIL_STARTTLS=False,
+        MAIL_SSL_TLS=True,
+        USE_CREDENTIALS=True,
+        VALIDATE_CERTS=True,
+        TEMPLATE_FOLDER=Path(__file__).parent / "templates",
+    )
+
+
+@traced()
 async def send_email(email: EmailStr, username: str, host: str):
     """
     The send_email function sends an email to the user with a link to confirm their email address.
@@ -38,6 +53,9 @@ async def send_email(email: EmailStr, username: str, host: str):
 
     :return: A coroutine object
     """
+    from fastapi_mail import FastMail, MessageSchema, MessageType
+    from fastapi_mail.errors import ConnectionErrors
+
     try:
         token_verification = auth_service.create_email_token({"sub": email})
         message = MessageSchema(
@@ -51,7 +69,9 @@ async def send_email(email: EmailStr, username: str, host: str):
             subtype=MessageType.html,
         )
 
-        fm = FastMail(conf)
+        fm = FastMail(get_mail_config())
         await fm.send_message(message, template_name="email_template.html")
     except ConnectionErrors as err:
         print(err)
+    finally:
+        EMAIL_QUEUE.dec()
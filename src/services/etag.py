@@ -0,0 +1,86 @@
+import zlib
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import Response, status
+
+# Responses are per user, so shared caches must not store them, and clients revalidate every time.
+CACHE_CONTROL = "private, no-cache"
+
+
+def contact_etag(contact_id: int, updated_at: Optional[datetime], fields: Optional[List[str]] = None) -> str:
+    """
+    The contact_etag function returns the strong ETag of one contact.
+    It changes whenever the contact is written, since every write moves updated_at.
+    A sparse fieldset is a different representation and gets its own ETag.
+
+    :param contact_id: int: The id of the contact
+    :param updated_at: Optional[datetime]: When the contact was last written
+    :param fields: Optional[List[str]]: The fields of the representation, None for all
+    :return: The quoted ETag
+    :doc-author: Trelent
+    """
+    stamp = int(updated_at.timestamp() * 1_000_000) if updated_at is not None else 0
+    if fields:
+        return f'"c{contact_id}-{stamp:x}-{fieldset_tag(fields)}"'
+    return f'"c{contact_id}-{stamp:x}"'
+
+
+def fieldset_tag(fields: List[str]) -> str:
+    return f"{zlib.crc32(','.join(fields).encode()):08x}"
+
+
+def contacts_list_etag(user_id: int, version: int, *params) -> str:
+    """
+    The contacts_list_etag function returns the weak ETag of a page of the contacts of a user.
+    The page is identified by the query parameters that select it; the version of the contacts
+    of the user changes on every write to any of them.
+
+    :param user_id: int: The owner of the contacts
+    :param version: int: The contacts version of the user
+    :param params: The query parameters of the page
+    :return: The quoted weak ETag
+    :doc-author: Trelent
+    """
+    suffix = "".join(f"-{param}" for param in params)
+    return f'W/"u{user_id}-v{version}{suffix}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    The etag_matches function evaluates an If-None-Match header against the current ETag.
+    If-None-Match uses the weak comparison, so W/ prefixes are ignored on both sides.
+
+    :param if_none_match: Optional[str]: The If-None-Match header of the request
+    :param etag: str: The current ETag of the resource
+    :return: True if the client already has the current representation
+    :doc-author: Trelent
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    current = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == current:
+            return True
+    return False
+
+
+def not_modified(etag: str) -> Response:
+    """
+    The not_modified function returns the empty 304 response for a representation the client already has.
+
+    :param etag: str: The current ETag of the resource
+    :return: The 304 response
+    :doc-author: Trelent
+    """
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def set_etag(response: Response, etag: str) -> None:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
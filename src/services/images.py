@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, NamedTuple, Optional
+
+from fastapi import HTTPException, UploadFile, status
+
+from src.conf.config import settings
+from src.services.tracing import traced
+
+AVATAR_SIZES = (250, 64)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_config = settings
+
+
+class ProcessedAvatar(NamedTuple):
+    digest: str
+    fmt: str
+    renditions: Dict[int, bytes]
+
+
+async def read_upload(file: UploadFile, max_bytes: int) -> bytes:
+    """
+    The read_upload function reads an uploaded file into memory, refusing files larger than max_bytes.
+    The file is read in chunks, so an oversized upload is rejected without being buffered whole.
+
+    :param file: UploadFile: The uploaded file
+    :param max_bytes: int: The largest accepted file size
+    :return: The content of the file
+    :doc-author: Trelent
+    """
+    buffer = bytearray()
+    while chunk := await file.read(64 * 1024):
+        buffer += chunk
+        if len(buffer) > max_bytes:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="Avatar file is too large",
+            )
+    return bytes(buffer)
+
+
+def init_images(config=settings) -> None:
+    """
+    The init_images function selects the settings avatars are processed with.
+    The worker pool of other settings is shut down and created again from config on first use.
+
+    :param config: The application settings
+    :return: None
+    :doc-author: Trelent
+    """
+    global _config, _executor
+    if config is not _config and _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+    _config = config
+
+
+def content_hash(data: bytes) -> str:
+    """
+    The content_hash function returns the short content hash used to name stored avatars.
+
+    :param data: bytes: The raw uploaded image
+    :return: The first 16 hex digits of the sha256 of the data
+    :doc-author: Trelent
+    """
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def avatar_public_id(username: str, digest: str, size: int) -> str:
+    """
+    The avatar_public_id function builds the storage id of one avatar rendition.
+
+    :param username: str: The owner of the avatar
+    :param digest: str: The content hash of the avatar
+    :param size: int: The edge of the rendition in pixels
+    :return: The storage id
+    :doc-author: Trelent
+    """
+    return f"NotesApp/{username}/{digest}_{size}"
+
+
+def is_current_avatar(avatar: Optional[str], digest: str) -> bool:
+    """
+    The is_current_avatar function checks whether the user's avatar URL already points at this content.
+
+    :param avatar: Optional[str]: The current avatar URL of the user
+    :param digest: str: The content hash of the uploaded image
+    :return: True if the image is already the user's avatar
+    :doc-author: Trelent
+    """
+    return bool(avatar) and f"/{digest}_" in avatar
+
+
+def process_image(data: bytes, max_pixels: int, fmt: str) -> ProcessedAvatar:
+    """
+    The process_image function decodes the image once and renders every size in AVATAR_SIZES.
+    The dimensions are checked from the header before the pixels are decoded, so a
+    decompression bomb is rejected without allocating it.
+
+    :param data: bytes: The raw uploaded image
+    :param max_pixels: int: The largest accepted width * height
+    :param fmt: str: The output format, webp or jpeg
+    :return: The content hash and the encoded renditions
+    :doc-author: Trelent
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        img = Image.open(io.BytesIO(data))
+    except UnidentifiedImageError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid image")
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+        # Pillow's own limit, met before ours when MAX_IMAGE_PIXELS is below avatar_max_pixels.
+        img = None
+    if img is None or img.width * img.height > max_pixels:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Avatar dimensions are too large",
+        )
+    # JPEG can be decoded directly at a reduced scale
+    img.draft("RGB", (max(AVATAR_SIZES), max(AVATAR_SIZES)))
+    try:
+        img = ImageOps.exif_transpose(img).convert("RGB")
+    except OSError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid image")
+
+    renditions = {}
+    for size in sorted(AVATAR_SIZES, reverse=True):
+        img = ImageOps.fit(img, (size, size), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, format=fmt.upper(), quality=85)
+        renditions[size] = out.getvalue()
+    return ProcessedAvatar(content_hash(data), fmt, renditions)
+
+
+@traced()
+async def process_avatar(data: bytes) -> ProcessedAvatar:
+    """
+    The process_avatar function runs process_image in the avatar worker pool.
+
+    :param data: bytes: The raw uploaded image
+    :return: The content hash and the encoded renditions
+    :doc-author: Trelent
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=_config.avatar_process_workers, thread_name_prefix="avatar"
+        )
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor, process_image, data, _config.avatar_max_pixels, _config.avatar_format
+    )
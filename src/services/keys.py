@@ -0,0 +1,122 @@
+from typing import Dict, List, Optional, Tuple
+
+from jose import JWTError, jwk, jwt
+
+# python-jose signs with ES256 and RS256 through the cryptography backend; it has no EdDSA.
+ASYMMETRIC_ALGORITHMS = ("ES256", "ES384", "ES512", "RS256", "RS384", "RS512")
+
+
+def parse_key_files(value: str) -> List[Tuple[str, str]]:
+    """
+    The parse_key_files function reads the jwt_signing_keys setting.
+    It is a comma separated list of kid=path pairs, newest first.
+
+    :param value: str: The setting, for example "2024-06=keys/2024-06.pem, 2024-01=keys/2024-01.pem"
+    :return: The kid and path of each key
+    :doc-author: Trelent
+    """
+    keys = []
+    for item in value.split(","):
+        if "=" in item:
+            kid, path = item.split("=", 1)
+            keys.append((kid.strip(), path.strip()))
+    return keys
+
+
+class KeySet:
+    def __init__(self, algorithm: str, private_key=None, kid: Optional[str] = None, public_keys: Dict = None):
+        """
+        The KeySet signs tokens with its newest private key and verifies them with any of its public keys.
+        The keys are parsed once, so a verification is a dict lookup by kid and a signature check.
+        A verifier built with from_jwks holds no private key and never calls the issuer.
+
+        :param self: Represent the instance of the class
+        :param algorithm: str: The JWS algorithm of every key
+        :param private_key: The parsed key that signs new tokens, None to only verify
+        :param kid: Optional[str]: The id of the signing key
+        :param public_keys: Dict: The parsed public keys by kid
+        :return: None
+        :doc-author: Trelent
+        """
+        if algorithm not in ASYMMETRIC_ALGORITHMS:
+            raise ValueError(f"Unsupported signing algorithm {algorithm}, use one of {', '.join(ASYMMETRIC_ALGORITHMS)}")
+        self.algorithm = algorithm
+        self.private_key = private_key
+        self.kid = kid
+        self.public_keys = public_keys or {}
+
+    @classmethod
+    def from_pem(cls, algorithm: str, keys: List[Tuple[str, bytes]]) -> "KeySet":
+        """
+        The from_pem function builds the key set of the issuer.
+        The first key signs; the others are retired keys still trusted until the tokens they signed expire.
+        Rotating is prepending a new key and dropping the last one after a refresh token lifetime.
+
+        :param cls: Represent the class
+        :param algorithm: str: The JWS algorithm of every key
+        :param keys: List[Tuple[str, bytes]]: The kid and PEM private key of each key, newest first
+        :return: The key set
+        :doc-author: Trelent
+        """
+        if not keys:
+            raise ValueError("At least one signing key is required")
+        private_keys = [(kid, jwk.construct(pem, algorithm)) for kid, pem in keys]
+        public_keys = {kid: key.public_key() for kid, key in private_keys}
+        kid, private_key = private_keys[0]
+        return cls(algorithm, private_key, kid, public_keys)
+
+    @classmethod
+    def from_files(cls, algorithm: str, value: str) -> "KeySet":
+        keys = []
+        for kid, path in parse_key_files(value):
+            with open(path, "rb") as f:
+                keys.append((kid, f.read()))
+        return cls.from_pem(algorithm, keys)
+
+    @classmethod
+    def from_jwks(cls, document: Dict) -> "KeySet":
+        """
+        The from_jwks function builds a verify-only key set from the document served at /api/auth/jwks.json.
+
+        :param cls: Represent the class
+        :param document: Dict: The JWKS document
+        :return: The key set
+        :doc-author: Trelent
+        """
+        keys = document.get("keys", [])
+        if not keys:
+            raise ValueError("The key set is empty")
+        algorithm = keys[0]["alg"]
+        return cls(algorithm, public_keys={key["kid"]: jwk.construct(key, algorithm) for key in keys})
+
+    def jwks(self) -> Dict:
+        """
+        The jwks function returns the public keys as a JSON Web Key Set.
+
+        :param self: Represent the instance of the class
+        :return: The JWKS document
+        :doc-author: Trelent
+        """
+        keys = []
+        for kid, key in self.public_keys.items():
+            keys.append({**key.to_dict(), "kid": kid, "use": "sig"})
+        return {"keys": keys}
+
+    def encode(self, claims: Dict) -> str:
+        if self.private_key is None:
+            raise ValueError("This key set can only verify")
+        return jwt.encode(claims, self.private_key, algorithm=self.algorithm, headers={"kid": self.kid})
+
+    def decode(self, token: str) -> Dict:
+        """
+        The decode function verifies a token with the public key named by its kid header.
+
+        :param self: Represent the instance of the class
+        :param token: str: The token
+        :return: The claims of the token
+        :doc-author: Trelent
+        """
+        key = self.public_keys.get(jwt.get_unverified_header(token).get("kid"))
+        if key is None:
+            raise JWTError("Unknown signing key")
+        return jwt.decode(token, key, algorithms=[self.algorithm])
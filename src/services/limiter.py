@@ -0,0 +1,312 @@
+import logging
+import math
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from fastapi import HTTPException, Request, status
+from jose import JWTError
+
+from src.services.auth import auth_service
+from src.services.metrics import REDIS_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Sliding window log. First returns the unused requests ARGV[6]..ARGV[7] of the expired lease ARGV[5],
+# then grants up to ARGV[3] of the remaining requests in the window at once as the lease ARGV[4],
+# and answers {granted, milliseconds until the oldest request leaves the window}.
+SLIDING_WINDOW_LUA = """
+local key = KEYS[1]
+local window = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+if ARGV[5] ~= '' then
+    for i = tonumber(ARGV[6]), tonumber(ARGV[7]) do
+        redis.call('ZREM', key, ARGV[5] .. ':' .. i)
+    end
+end
+redis.call('ZREMRANGEBYSCORE', key, 0, now - window)
+local used = redis.call('ZCARD', key)
+local granted = math.min(requested, limit - used)
+if granted > 0 then
+    for i = 1, granted do
+        redis.call('ZADD', key, now, ARGV[4] .. ':' .. i)
+    end
+    redis.call('PEXPIRE', key, window)
+    return {granted, 0}
+end
+local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+local retry = window
+if oldest[2] then
+    retry = tonumber(oldest[2]) + window - now
+end
+return {0, retry}
+"""
+
+
+class _Lease:
+    __slots__ = ("id", "granted", "tokens", "expires_at", "blocked_until")
+
+    def __init__(self):
+        self.id = ""
+        self.granted = 0
+        self.tokens = 0
+        self.expires_at = 0.0
+        self.blocked_until = 0.0
+
+
+MAX_TRACKED_KEYS = 10000
+
+
+def evict_lru(table: OrderedDict) -> None:
+    # Evicts a tenth of the table at once, so a flood of new keys does not rescan it on every request.
+    while len(table) >= MAX_TRACKED_KEYS * 0.9:
+        table.popitem(last=False)
+
+
+class LimiterBackend:
+    redis = None
+    script = None
+    sync_interval: float = 1.0
+    # Seconds of the longest window of any limiter, past which a local window counts nothing.
+    longest_window: float = 0.0
+    # Both tables are kept in least recently used order, so eviction drops idle keys first.
+    _leases: "OrderedDict[str, _Lease]" = OrderedDict()
+    _windows: "OrderedDict[str, deque]" = OrderedDict()
+
+    @classmethod
+    async def init(cls, redis, sync_interval: float = 1.0):
+        """
+        The init function registers the redis client and the sliding window script.
+
+        :param cls: Represent the class
+        :param redis: The async redis client
+        :param sync_interval: float: How long a worker may spend its local tokens before syncing with redis
+        :return: None
+        :doc-author: Trelent
+        """
+        cls.redis = redis
+        cls.script = redis.register_script(SLIDING_WINDOW_LUA)
+        cls.sync_interval = sync_interval
+        cls._leases = OrderedDict()
+        cls._windows = OrderedDict()
+
+    @classmethod
+    def prune(cls, now: float):
+        """
+        The prune function forgets the leases that can no longer grant or block requests.
+        If the table is still full, the least recently used leases are dropped, never every lease at once.
+
+        :param cls: Represent the class
+        :param now: float: The current monotonic time
+        :return: None
+        :doc-author: Trelent
+        """
+        for key in [key for key, lease in cls._leases.items()
+                    if lease.blocked_until <= now and not (lease.tokens and lease.expires_at > now)]:
+            del cls._leases[key]
+        evict_lru(cls._leases)
+
+    @classmethod
+    def prune_windows(cls, now: float):
+        """
+        The prune_windows function forgets the local windows that no longer count any request.
+        If the table is still full, the least recently used windows are dropped, never every window at once.
+
+        :param cls: Represent the class
+        :param now: float: The current monotonic time
+        :return: None
+        :doc-author: Trelent
+        """
+        horizon = now - cls.longest_window
+        for key in [key for key, window in cls._windows.items() if not window or window[-1] <= horizon]:
+            del cls._windows[key]
+        evict_lru(cls._windows)
+
+    @classmethod
+    def reset(cls):
+        """
+        The reset function drops redis and every local counter.
+
+        :param cls: Represent the class
+        :return: None
+        :doc-author: Trelent
+        """
+        cls.redis = None
+        cls.script = None
+        cls._leases = OrderedDict()
+        cls._windows = OrderedDict()
+
+
+class RateLimiter:
+    def __init__(self, times: int, seconds: int, per: str = "user"):
+        """
+        The RateLimiter dependency allows times requests per seconds for each user or client ip.
+        Requests are counted per route, keyed by the token subject when per is "user" and the
+        request carries a valid access token, otherwise by the client ip.
+
+        Each worker leases a batch of requests from the shared redis window and spends it locally,
+        so most requests never leave the process. Leased requests are counted in redis up front,
+        which keeps the limit strict across workers; the requests a lease did not spend are
+        given back to the window with the next sync of the key.
+
+        :param self: Represent the instance of the class
+        :param times: int: How many requests are allowed in the window
+        :param seconds: int: The length of the window
+        :param per: str: Key the limit by "user" or by "ip"
+        :return: None
+        :doc-author: Trelent
+        """
+        self.times = times
+        self.window_ms = seconds * 1000
+        self.per = per
+        self.lease_size = max(1, times // 10)
+        LimiterBackend.longest_window = max(LimiterBackend.longest_window, seconds)
+
+    def identify(self, request: Request) -> str:
+        """
+        The identify function returns the identity the request is counted against.
+        The token is verified by the auth service, with the same keys as authentication,
+        and only an access token counts as a user. The claims stay on the request state,
+        so authentication does not decode the token again.
+
+        :param self: Represent the instance of the class
+        :param request: Request: The incoming request
+        :return: A user or ip identity
+        :doc-author: Trelent
+        """
+        if self.per == "user":
+            authorization = request.headers.get("Authorization", "")
+            scheme, _, token = authorization.partition(" ")
+            if scheme.lower() == "bearer" and token:
+                try:
+                    payload = auth_service.decode_once(token, request.state)
+                    if payload.get("scope") == "access_token":
+                        return f"user:{payload['sub']}"
+                except (JWTError, KeyError):
+                    pass
+        forwarded = request.headers.get("X-Forwarded-For")
+        if forwarded:
+            return f"ip:{forwarded.split(',')[0].strip()}"
+        return f"ip:{request.client.host if request.client else 'unknown'}"
+
+    def key(self, request: Request) -> str:
+        """
+        The key function builds the counter key of the request from its route and identity.
+
+        :param self: Represent the instance of the class
+        :param request: Request: The incoming request
+        :return: The counter key
+        :doc-author: Trelent
+        """
+        endpoint = request.scope.get("endpoint")
+        route = f"{endpoint.__module__}.{endpoint.__name__}" if endpoint else request.url.path
+        return f"rate:{route}:{self.identify(request)}"
+
+    async def _acquire_redis(self, key: str, lease: _Lease, now: float) -> float:
+        """
+        The _acquire_redis function refills the local lease from redis, and gives back the
+        requests the expired lease did not spend.
+
+        :param self: Represent the instance of the class
+        :param key: str: The counter key
+        :param lease: _Lease: The local lease of the key
+        :param now: float: The current monotonic time
+        :return: 0 if a request was granted, otherwise the seconds to wait
+        :doc-author: Trelent
+        """
+        lease_id = uuid.uuid4().hex
+        # The spent requests of a lease are its first members, the unused ones its last.
+        unused = (lease.id, lease.granted - lease.tokens + 1, lease.granted) if lease.tokens > 0 else ("", 0, 0)
+        with REDIS_LATENCY.labels("rate_limit").time():
+            granted, retry_ms = await LimiterBackend.script(
+                keys=[key],
+                args=[self.window_ms, self.times, self.lease_size, lease_id, *unused],
+            )
+        granted = int(granted)
+        lease.tokens = 0
+        if granted == 0:
+            lease.blocked_until = now + int(retry_ms) / 1000
+            return int(retry_ms) / 1000
+        lease.id = lease_id
+        lease.granted = granted
+        lease.tokens = granted - 1
+        lease.expires_at = now + LimiterBackend.sync_interval
+        return 0
+
+    def _acquire_local(self, key: str, now: float) -> float:
+        """
+        The _acquire_local function counts the request in an in-process sliding window.
+        It is used when redis is not configured or not reachable.
+
+        :param self: Represent the instance of the class
+        :param key: str: The counter key
+        :param now: float: The current monotonic time
+        :return: 0 if the request was granted, otherwise the seconds to wait
+        :doc-author: Trelent
+        """
+        horizon = now - self.window_ms / 1000
+        window = LimiterBackend._windows.get(key)
+        if window is None:
+            if len(LimiterBackend._windows) >= MAX_TRACKED_KEYS:
+                LimiterBackend.prune_windows(now)
+            window = LimiterBackend._windows[key] = deque()
+        else:
+            LimiterBackend._windows.move_to_end(key)
+        while window and window[0] <= horizon:
+            window.popleft()
+        if len(window) >= self.times:
+            return window[0] - horizon
+        window.append(now)
+        return 0
+
+    async def acquire(self, key: str) -> float:
+        """
+        The acquire function takes one request from the limit of key.
+
+        :param self: Represent the instance of the class
+        :param key: str: The counter key
+        :return: 0 if the request was granted, otherwise the seconds to wait
+        :doc-author: Trelent
+        """
+        now = time.monotonic()
+        if LimiterBackend.redis is None:
+            return self._acquire_local(key, now)
+
+        lease = LimiterBackend._leases.get(key)
+        if lease is None:
+            if len(LimiterBackend._leases) >= MAX_TRACKED_KEYS:
+                LimiterBackend.prune(now)
+            lease = LimiterBackend._leases[key] = _Lease()
+        else:
+            LimiterBackend._leases.move_to_end(key)
+        if now < lease.blocked_until:
+            return lease.blocked_until - now
+        if lease.tokens > 0 and now < lease.expires_at:
+            lease.tokens -= 1
+            return 0
+        try:
+            return await self._acquire_redis(key, lease, now)
+        except Exception as e:
+            logger.warning("Rate limiter falls back to local counting: %s", e)
+            return self._acquire_local(key, now)
+
+    async def __call__(self, request: Request):
+        """
+        The __call__ function rejects the request with 429 once the limit is exhausted.
+
+        :param self: Represent the instance of the class
+        :param request: Request: The incoming request
+        :return: None
+        :doc-author: Trelent
+        """
+        retry_after = await self.acquire(self.key(request))
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too Many Requests",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
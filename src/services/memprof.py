@@ -0,0 +1,167 @@
+import itertools
+import tracemalloc
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from src.services.metrics import route_path
+
+# Allocation sites are attributed to the first component whose path fragment appears in their traceback.
+COMPONENTS = OrderedDict([
+    ("user_cache", ("src/services/auth.py",)),
+    ("orm_identity_map", ("sqlalchemy/orm/identity.py", "sqlalchemy/orm/state.py", "sqlalchemy/orm/loading.py")),
+    ("serialization", ("fastapi/encoders.py", "fastapi/routing.py", "pydantic/", "json/")),
+    ("repository", ("src/repository/",)),
+])
+
+MAX_SNAPSHOTS = 8
+
+_snapshots: "OrderedDict[int, tracemalloc.Snapshot]" = OrderedDict()
+_ids = itertools.count(1)
+route_peaks: Dict[str, Dict[str, int]] = {}
+
+_filters = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def start(frames: int = 25) -> None:
+    """
+    The start function starts tracing allocations, keeping frames frames of traceback per allocation.
+
+    :param frames: int: The traceback depth, deeper is slower but attributes better
+    :return: None
+    :doc-author: Trelent
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    route_peaks.clear()
+
+
+def stop() -> None:
+    """
+    The stop function stops tracing and drops the snapshots.
+
+    :return: None
+    :doc-author: Trelent
+    """
+    tracemalloc.stop()
+    _snapshots.clear()
+
+
+def status() -> Dict:
+    """
+    The status function reports whether allocations are traced and how much memory is traced.
+
+    :return: A dict with tracing, current, peak and the snapshot ids
+    :doc-author: Trelent
+    """
+    current, peak = tracemalloc.get_traced_memory()
+    return {"tracing": tracemalloc.is_tracing(), "current": current, "peak": peak, "snapshots": list(_snapshots)}
+
+
+def take_snapshot() -> int:
+    """
+    The take_snapshot function stores a snapshot of the traced allocations.
+    Only the last MAX_SNAPSHOTS snapshots are kept.
+
+    :return: The id of the snapshot
+    :doc-author: Trelent
+    """
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc is not tracing")
+    snapshot_id = next(_ids)
+    _snapshots[snapshot_id] = tracemalloc.take_snapshot().filter_traces(_filters)
+    while len(_snapshots) > MAX_SNAPSHOTS:
+        _snapshots.popitem(last=False)
+    return snapshot_id
+
+
+def get_snapshot(snapshot_id: int) -> Optional[tracemalloc.Snapshot]:
+    return _snapshots.get(snapshot_id)
+
+
+def component_of(traceback: tracemalloc.Traceback) -> str:
+    """
+    The component_of function attributes an allocation to one of COMPONENTS.
+
+    :param traceback: tracemalloc.Traceback: The traceback of the allocation
+    :return: The component name, or "other"
+    :doc-author: Trelent
+    """
+    filenames = [frame.filename.replace("\\", "/") for frame in traceback]
+    for component, fragments in COMPONENTS.items():
+        if any(fragment in filename for filename in filenames for fragment in fragments):
+            return component
+    return "other"
+
+
+def diff(old: tracemalloc.Snapshot, new: tracemalloc.Snapshot, group_by: str = "lineno",
+         limit: int = 25) -> Dict:
+    """
+    The diff function compares two snapshots.
+    The top differences are grouped by group_by ("filename" or "lineno"), and the growth of
+    every component in COMPONENTS is summed over the full tracebacks.
+
+    :param old: tracemalloc.Snapshot: The earlier snapshot
+    :param new: tracemalloc.Snapshot: The later snapshot
+    :param group_by: str: Group the top differences by "filename" or "lineno"
+    :param limit: int: How many top differences to return
+    :return: A dict with the top differences and the growth per component
+    :doc-author: Trelent
+    """
+    stats: List[Dict] = []
+    for stat in new.compare_to(old, group_by)[:limit]:
+        frame = stat.traceback[0]
+        stats.append({
+            "file": frame.filename,
+            "line": frame.lineno if group_by == "lineno" else None,
+            "size_diff": stat.size_diff,
+            "count_diff": stat.count_diff,
+            "size": stat.size,
+            "count": stat.count,
+        })
+
+    components: Dict[str, int] = {name: 0 for name in list(COMPONENTS) + ["other"]}
+    for stat in new.compare_to(old, "traceback"):
+        components[component_of(stat.traceback)] += stat.size_diff
+    return {"stats": stats, "components": components}
+
+
+def record_route_peak(route: str, peak: int) -> None:
+    entry = route_peaks.get(route)
+    if entry is None:
+        entry = route_peaks.setdefault(route, {"requests": 0, "max_peak": 0, "last_peak": 0})
+    entry["requests"] += 1
+    entry["last_peak"] = peak
+    if peak > entry["max_peak"]:
+        entry["max_peak"] = peak
+
+
+class MemoryMiddleware:
+    def __init__(self, app):
+        """
+        The MemoryMiddleware records the peak of traced memory above its starting level for each route.
+        It only measures while tracemalloc is tracing. The peak counter is global, so requests that
+        overlap inflate each other's numbers; the figures are exact only for requests served alone.
+
+        :param self: Represent the instance of the class
+        :param app: The ASGI application
+        :return: None
+        :doc-author: Trelent
+        """
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracemalloc.is_tracing():
+            return await self.app(scope, receive, send)
+        start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if tracemalloc.is_tracing():
+                _, peak = tracemalloc.get_traced_memory()
+                record_route_peak(f"{scope['method']} {route_path(scope)}", max(peak - start, 0))
@@ -0,0 +1,370 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import get_ident
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+_registry: List["Metric"] = []
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Sharded:
+    """
+    Per-thread accumulators. Every thread writes only to its own shard, so recording needs no
+    lock; a scrape sums the shards.
+    """
+
+    __slots__ = ("_shards", "_width")
+
+    def __init__(self, width: int):
+        self._shards: Dict[int, list] = {}
+        self._width = width
+
+    def shard(self) -> list:
+        shard = self._shards.get(get_ident())
+        if shard is None:
+            shard = self._shards.setdefault(get_ident(), [0.0] * self._width)
+        return shard
+
+    def totals(self) -> list:
+        totals = [0.0] * self._width
+        for shard in list(self._shards.values()):
+            for i, value in enumerate(shard):
+                totals[i] += value
+        return totals
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        """
+        The Metric class is the base of the counters, gauges and histograms in the registry.
+
+        :param self: Represent the instance of the class
+        :param name: str: The metric name
+        :param documentation: str: The HELP text of the metric
+        :param labelnames: Sequence[str]: The names of the labels of the metric
+        :return: None
+        :doc-author: Trelent
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        _registry.append(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """
+        The labels function returns the child of the metric for the given label values.
+
+        :param self: Represent the instance of the class
+        :param values: The label values, in the order of labelnames
+        :return: The child metric
+        :doc-author: Trelent
+        """
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    @property
+    def family(self) -> str:
+        # The name the HELP and TYPE lines give, and every sample starts with.
+        return self.name
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.family} {self.documentation}", f"# TYPE {self.family} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.family}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class _CounterChild(_Sharded):
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount: float = 1) -> None:
+        self.shard()[0] += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.shard()[0] -= amount
+
+    def value(self) -> float:
+        return self.totals()[0]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    @property
+    def family(self) -> str:
+        # The text format names a counter by its sample, with the _total suffix.
+        return f"{self.name}_total"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self._children[()].inc(amount)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield "", _format_labels(self.labelnames, values), child.value()
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        """
+        The Gauge class is a value that goes up and down.
+        A gauge built with a function reads its values from it on every scrape instead.
+
+        :param self: Represent the instance of the class
+        :param name: str: The metric name
+        :param documentation: str: The HELP text of the metric
+        :param labelnames: Sequence[str]: The names of the labels of the metric
+        :param function: Returns the current values keyed by label values
+        :return: None
+        :doc-author: Trelent
+        """
+        self.function = function
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self._children[()].inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self._children[()].dec(amount)
+
+    def samples(self):
+        if self.function is not None:
+            items = self.function().items()
+        else:
+            items = ((values, child.value()) for values, child in list(self._children.items()))
+        for values, value in items:
+            yield "", _format_labels(self.labelnames, values), value
+
+
+class _HistogramChild(_Sharded):
+    __slots__ = ("_upper",)
+
+    def __init__(self, upper: Tuple[float, ...]):
+        # one slot per bucket, one for +Inf and one for the sum
+        super().__init__(len(upper) + 2)
+        self._upper = upper
+
+    def observe(self, value: float) -> None:
+        shard = self.shard()
+        shard[bisect_left(self._upper, value)] += 1
+        shard[-1] += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        The Histogram class counts observations into buckets fixed at creation.
+
+        :param self: Represent the instance of the class
+        :param name: str: The metric name
+        :param documentation: str: The HELP text of the metric
+        :param labelnames: Sequence[str]: The names of the labels of the metric
+        :param buckets: Sequence[float]: The upper bounds of the buckets
+        :return: None
+        :doc-author: Trelent
+        """
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._children[()].observe(value)
+
+    def time(self):
+        return self._children[()].time()
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            totals = child.totals()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), totals):
+                cumulative += count
+                le = 'le="{}"'.format(_format_value(bound))
+                yield "_bucket", _format_labels(self.labelnames, values, le), cumulative
+            yield "_count", _format_labels(self.labelnames, values), cumulative
+            yield "_sum", _format_labels(self.labelnames, values), totals[-1]
+
+
+def render() -> str:
+    """
+    The render function returns every registered metric in the Prometheus text format.
+
+    :return: The exposition text
+    :doc-author: Trelent
+    """
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+def _pool_stats():
+    from src.database import db
+
+    pool = db.engine.pool if db.engine is not None else None
+    if pool is None or not hasattr(pool, "checkedout"):
+        return {}
+    return {
+        ("size",): pool.size(),
+        ("checked_out",): pool.checkedout(),
+        ("checked_in",): pool.checkedin(),
+        ("overflow",): pool.overflow(),
+    }
+
+
+HTTP_REQUESTS = Counter(
+    "http_requests", "HTTP requests by route and status code.", ("method", "route", "status")
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route.", ("method", "route")
+)
+ADMISSION = Counter(
+    "http_admission_requests", "Requests by admission class and outcome: admitted, queued, rejected or timeout.",
+    ("class", "outcome"),
+)
+DB_CANCELLATIONS = Counter(
+    "db_statement_cancellations", "Requests whose database work was cancelled, by route and reason: timeout or disconnect.",
+    ("route", "reason"),
+)
+DB_SESSIONS = Counter("db_request_sessions", "Request sessions by whether they touched the database.", ("usage",))
+HTTP_IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests being served.")
+DB_POOL = Gauge("db_pool_connections", "Connections of the database pool by state.", ("state",),
+                function=_pool_stats)
+REDIS_LATENCY = Histogram(
+    "redis_command_duration_seconds", "Redis command latency.", ("command",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+USER_CACHE = Counter("user_cache_requests", "User cache lookups by result.", ("result",))
+BCRYPT_LATENCY = Histogram(
+    "bcrypt_duration_seconds", "Time spent hashing and verifying passwords.", ("operation",),
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0),
+)
+EMAIL_QUEUE = Gauge("email_queue_depth", "Confirmation emails queued and not yet sent.")
+COMPRESSION_BYTES = Counter(
+    "http_compression_bytes", "Response bytes before and after compression.", ("encoding", "stage")
+)
+REVOCATION_CHECKS = Counter(
+    "token_revocation_checks", "Access token revocation checks by where they were answered.", ("path",)
+)
+USER_CACHE_INVALIDATIONS = Counter(
+    "user_cache_invalidations", "User cache invalidations by where the write happened.", ("origin",)
+)
+SINGLE_FLIGHT = Counter(
+    "single_flight_loads", "Single flight calls by flight and outcome: loaded, coalesced or waited.", ("flight", "outcome")
+)
+COMPRESSION_CACHE = Counter("http_compression_cache_requests", "Compressed body cache lookups by result.", ("result",))
+
+
+_route_paths: Dict[object, str] = {}
+
+
+def route_path(scope) -> str:
+    """
+    The route_path function returns the path template of the route that served the request.
+    Using the template rather than the URL keeps ids in the URL out of metric labels.
+
+    :param scope: The ASGI scope, after routing
+    :return: The path template, or "unmatched"
+    :doc-author: Trelent
+    """
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    path = _route_paths.get(endpoint)
+    if path is None:
+        path = next(
+            (route.path for route in scope["app"].routes if getattr(route, "endpoint", None) is endpoint),
+            "unmatched",
+        )
+        _route_paths[endpoint] = path
+    return path
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        """
+        The MetricsMiddleware records the count, latency and in-flight number of HTTP requests.
+        Requests are labelled with the path template of the route, so ids in the URL do not
+        create new series.
+
+        :param self: Represent the instance of the class
+        :param app: The ASGI application
+        :return: None
+        :doc-author: Trelent
+        """
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_PROGRESS.dec()
+            route = route_path(scope)
+            HTTP_REQUESTS.labels(scope["method"], route, str(status_code)).inc()
+            HTTP_LATENCY.labels(scope["method"], route).observe(elapsed)
@@ -0,0 +1,268 @@
+import hashlib
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Optional
+
+from src.conf.config import settings
+
+PROFILE_HEADER = b"x-profile"
+
+_config = settings
+
+
+def init_profiler(config=settings) -> None:
+    """
+    The init_profiler function selects the settings requests are profiled with:
+    the key of the profile tokens, the sampling interval and where profiles are stored.
+
+    :param config: The application settings
+    :return: None
+    :doc-author: Trelent
+    """
+    global _config
+    _config = config
+
+
+def sign_profile_token(path: str, ttl: int, secret: str = None) -> str:
+    """
+    The sign_profile_token function creates a token that allows profiling requests to path for ttl seconds.
+
+    :param path: str: The request path the token is valid for
+    :param ttl: int: How many seconds the token is valid
+    :param secret: str: The signing key, settings.secret_key by default
+    :return: The token
+    :doc-author: Trelent
+    """
+    expires = int(time.time()) + ttl
+    secret = secret or _config.secret_key
+    signature = hmac.new(secret.encode(), f"{path}:{expires}".encode(), hashlib.sha256).hexdigest()
+    return f"{expires}.{signature}"
+
+
+def verify_profile_token(token: str, path: str, secret: str = None) -> bool:
+    """
+    The verify_profile_token function checks that the token was signed for path and has not expired.
+
+    :param token: str: The value of the X-Profile header
+    :param path: str: The request path
+    :param secret: str: The signing key, settings.secret_key by default
+    :return: True if the request may be profiled
+    :doc-author: Trelent
+    """
+    expires, _, signature = token.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    secret = secret or _config.secret_key
+    expected = hmac.new(secret.encode(), f"{path}:{expires}".encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def fold(frame) -> tuple:
+    """
+    The fold function returns the code objects of a stack, outermost first.
+
+    :param frame: The innermost frame
+    :return: A tuple of code objects
+    :doc-author: Trelent
+    """
+    stack = []
+    while frame is not None:
+        stack.append(frame.f_code)
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+def render_folded(stacks: Counter) -> str:
+    """
+    The render_folded function writes stack counts in the folded format read by flamegraph.pl and speedscope.
+
+    :param stacks: Counter: Sample counts keyed by stacks of code objects
+    :return: One "frame;frame;frame count" line per stack
+    :doc-author: Trelent
+    """
+    return "".join(
+        ";".join(frame_label(code) for code in stack) + f" {count}\n"
+        for stack, count in stacks.most_common()
+    )
+
+
+class StackSampler:
+    def __init__(self, thread_id: int, interval: float):
+        """
+        The StackSampler samples the stack of one thread from a background thread.
+
+        :param self: Represent the instance of the class
+        :param thread_id: int: The thread to sample
+        :param interval: float: Seconds between samples
+        :return: None
+        :doc-author: Trelent
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def sample(self, frame) -> None:
+        self.stacks[fold(frame)] += 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.sample(frame)
+
+
+class ContinuousProfiler(StackSampler):
+    def __init__(self, thread_id: int, interval: float, app):
+        """
+        The ContinuousProfiler samples the event loop at a low rate for as long as the worker runs.
+        Each sample is attributed to the route whose endpoint is on the stack, or to "other" when
+        the loop is busy with something else (dependencies, serialization, the framework).
+
+        :param self: Represent the instance of the class
+        :param thread_id: int: The thread running the event loop
+        :param interval: float: Seconds between samples
+        :param app: The application, to map endpoints to routes
+        :return: None
+        :doc-author: Trelent
+        """
+        super().__init__(thread_id, interval)
+        self.app = app
+        self.by_route: Dict[str, Counter] = defaultdict(Counter)
+        self._endpoints = None
+
+    def endpoints(self) -> Dict[object, str]:
+        if self._endpoints is None:
+            self._endpoints = {}
+            for route in self.app.routes:
+                endpoint = getattr(route, "endpoint", None)
+                code = getattr(getattr(endpoint, "__wrapped__", endpoint), "__code__", None)
+                if code is not None:
+                    self._endpoints[code] = f"{','.join(sorted(route.methods or []))} {route.path}"
+        return self._endpoints
+
+    def sample(self, frame) -> None:
+        stack = fold(frame)
+        endpoints = self.endpoints()
+        route = next((endpoints[code] for code in stack if code in endpoints), "other")
+        self.by_route[route][stack] += 1
+
+    def report(self, route: Optional[str] = None) -> str:
+        """
+        The report function returns the aggregated samples of one route, or of every route.
+
+        :param self: Represent the instance of the class
+        :param route: Optional[str]: The route, as "METHOD /path"
+        :return: The folded stacks
+        :doc-author: Trelent
+        """
+        if route is not None:
+            return render_folded(self.by_route.get(route, Counter()))
+        merged = Counter()
+        for name, stacks in list(self.by_route.items()):
+            for stack, count in stacks.items():
+                merged[stack] += count
+        return render_folded(merged)
+
+
+_continuous: Optional[ContinuousProfiler] = None
+
+
+def start_continuous(app, interval: float) -> ContinuousProfiler:
+    """
+    The start_continuous function starts sampling the calling thread, which must run the event loop.
+
+    :param app: The application
+    :param interval: float: Seconds between samples
+    :return: The profiler
+    :doc-author: Trelent
+    """
+    global _continuous
+    _continuous = ContinuousProfiler(threading.get_ident(), interval, app).start()
+    return _continuous
+
+
+def stop_continuous() -> None:
+    global _continuous
+    if _continuous is not None:
+        _continuous.stop()
+        _continuous = None
+
+
+def get_continuous() -> Optional[ContinuousProfiler]:
+    return _continuous
+
+
+def profile_path(profile_id: str) -> Path:
+    """
+    The profile_path function returns where the profile of one request is stored.
+
+    :param profile_id: str: The id returned in the X-Profile-Id header
+    :return: The path of the folded stacks file
+    :doc-author: Trelent
+    """
+    return Path(_config.profile_dir) / f"{profile_id}.folded"
+
+
+class ProfilerMiddleware:
+    def __init__(self, app):
+        """
+        The ProfilerMiddleware profiles single requests that carry a valid signed X-Profile header.
+        The event loop thread is sampled while the request runs and the folded stacks are stored
+        under settings.profile_dir; the response names the profile in the X-Profile-Id header.
+        Other requests running concurrently on the loop show up in the profile as well.
+
+        :param self: Represent the instance of the class
+        :param app: The ASGI application
+        :return: None
+        :doc-author: Trelent
+        """
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = None
+        for key, value in scope["headers"]:
+            if key == PROFILE_HEADER:
+                token = value.decode("latin-1")
+                break
+        if token is None or not verify_profile_token(token, scope["path"]):
+            return await self.app(scope, receive, send)
+
+        profile_id = os.urandom(8).hex()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        sampler = StackSampler(threading.get_ident(), _config.profile_interval).start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            stacks = sampler.stop()
+            path = profile_path(profile_id)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(render_folded(stacks))
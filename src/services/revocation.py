@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import logging
+import math
+import time
+from typing import Dict, List, Optional
+
+from src.services.metrics import REDIS_LATENCY, REVOCATION_CHECKS
+
+logger = logging.getLogger(__name__)
+
+ACCESS_TTL = 15 * 60
+CHANNEL = "revoked"
+
+
+def revoked_key(identifier: str) -> str:
+    return f"revoked:{identifier}"
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        """
+        The BloomFilter is a set that may answer "present" for an item that was never added, but never the reverse.
+        It is sized for capacity items at the given false positive rate.
+
+        :param self: Represent the instance of the class
+        :param capacity: int: How many items it holds at error_rate
+        :param error_rate: float: The false positive rate at capacity
+        :return: None
+        :doc-author: Trelent
+        """
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, item: str) -> List[int]:
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str) -> None:
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def has(self, positions: List[int]) -> bool:
+        bits = self.bits
+        for position in positions:
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def __contains__(self, item: str) -> bool:
+        return self.has(self.positions(item))
+
+
+class RevocationList:
+    redis = None
+    capacity: int = 100000
+    _current: BloomFilter = BloomFilter(capacity)
+    _previous: BloomFilter = BloomFilter(capacity)
+    _rotated_at: float = time.monotonic()
+    _local: Dict[str, float] = {}
+    _listener: Optional[asyncio.Task] = None
+
+    @classmethod
+    async def init(cls, redis, capacity: int = 100000):
+        """
+        The init function loads the revoked ids from redis into the filter and subscribes to new revocations.
+
+        :param cls: Represent the class
+        :param redis: The async redis client
+        :param capacity: int: How many revocations one token lifetime may hold at a 1% false positive rate
+        :return: None
+        :doc-author: Trelent
+        """
+        cls.reset(capacity)
+        cls.redis = redis
+        cls._listener = asyncio.create_task(cls._listen())
+
+    @classmethod
+    async def close(cls):
+        if cls._listener is not None:
+            cls._listener.cancel()
+            try:
+                await cls._listener
+            except asyncio.CancelledError:
+                pass
+        cls.reset(cls.capacity)
+
+    @classmethod
+    def reset(cls, capacity: int = 100000):
+        """
+        The reset function drops redis and every revocation known to the worker.
+
+        :param cls: Represent the class
+        :param capacity: int: The capacity of the new filters
+        :return: None
+        :doc-author: Trelent
+        """
+        cls.redis = None
+        cls.capacity = capacity
+        cls._current, cls._previous = BloomFilter(capacity), BloomFilter(capacity)
+        cls._rotated_at = time.monotonic()
+        cls._local = {}
+        cls._listener = None
+
+    @classmethod
+    def _rotate(cls, now: float) -> None:
+        # A revocation outlives its token by at most one lifetime, so two generations of one
+        # lifetime each always cover it; older generations only hold expired ids.
+        if now - cls._rotated_at >= ACCESS_TTL:
+            cls._previous, cls._current = cls._current, BloomFilter(cls.capacity)
+            cls._rotated_at = now
+
+    @classmethod
+    def remember(cls, identifier: str) -> None:
+        cls._rotate(time.monotonic())
+        cls._current.add(identifier)
+
+    @classmethod
+    async def _load(cls) -> None:
+        async for key in cls.redis.scan_iter(match=revoked_key("*"), count=1000):
+            cls.remember(key[len(revoked_key("")):])
+
+    @classmethod
+    async def _listen(cls) -> None:
+        """
+        The _listen function keeps the filter of the worker in sync with the revocations of every worker.
+        The stored ids are loaded again after each (re)subscription, so none published while the
+        worker was disconnected are missed.
+
+        :param cls: Represent the class
+        :return: None
+        :doc-author: Trelent
+        """
+        delay = 1
+        while True:
+            try:
+                async with cls.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(CHANNEL)
+                    await cls._load()
+                    delay = 1
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            cls.remember(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Revocation listener reconnects in %ss: %s", delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    @classmethod
+    async def revoke(cls, identifier: str, ttl: int = ACCESS_TTL) -> None:
+        """
+        The revoke function denies the token id or session id until every token carrying it has expired.
+
+        :param cls: Represent the class
+        :param identifier: str: The jti of an access token, or the sid of a session
+        :param ttl: int: Seconds until the last token carrying identifier expires
+        :return: None
+        :doc-author: Trelent
+        """
+        ttl = max(1, int(ttl))
+        cls.remember(identifier)
+        if cls.redis is None:
+            cls._local[identifier] = time.time() + ttl
+            return
+        with REDIS_LATENCY.labels("revocation").time():
+            await cls.redis.set(revoked_key(identifier), 1, ex=ttl)
+            await cls.redis.publish(CHANNEL, identifier)
+
+    @classmethod
+    async def is_revoked(cls, *identifiers: Optional[str]) -> bool:
+        """
+        The is_revoked function tells whether any of the ids was revoked.
+        The filter answers the common case in memory; redis is asked only about ids the filter may hold.
+
+        :param cls: Represent the class
+        :param identifiers: Optional[str]: The jti and sid claims of a token, None for a missing claim
+        :return: True if the token must be rejected
+        :doc-author: Trelent
+        """
+        cls._rotate(time.monotonic())
+        candidates = []
+        for identifier in identifiers:
+            if identifier:
+                # both generations have the same size, so the positions are computed once
+                positions = cls._current.positions(identifier)
+                if cls._current.has(positions) or cls._previous.has(positions):
+                    candidates.append(identifier)
+        if not candidates:
+            REVOCATION_CHECKS.labels("filter").inc()
+            return False
+        REVOCATION_CHECKS.labels("store").inc()
+        if cls.redis is None:
+            now = time.time()
+            return any(cls._local.get(identifier, 0) > now for identifier in candidates)
+        with REDIS_LATENCY.labels("revocation").time():
+            return bool(await cls.redis.exists(*(revoked_key(identifier) for identifier in candidates)))
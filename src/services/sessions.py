@@ -0,0 +1,203 @@
+import time
+import uuid
+from typing import Dict, List, Optional, Set, Tuple
+
+from src.services.metrics import REDIS_LATENCY
+
+REFRESH_TTL = 7 * 24 * 3600
+
+ROTATED, UNKNOWN, REUSED = 1, 0, -1
+
+# Compare-and-rotate of a token family. Answers 1 when ARGV[1] was the current token and has been
+# replaced by ARGV[2], 0 when the family does not exist, and -1 when an older token of the family is
+# replayed: the family is then revoked, since either the client or a thief holds a stolen token.
+ROTATE_LUA = """
+local current = redis.call('HGET', KEYS[1], 'jti')
+if not current then
+    return 0
+end
+if current ~= ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    redis.call('SREM', KEYS[2], ARGV[3])
+    return -1
+end
+redis.call('HSET', KEYS[1], 'jti', ARGV[2], 'last_used', ARGV[4])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+return 1
+"""
+
+
+def family_key(sid: str) -> str:
+    return f"rt:family:{sid}"
+
+
+def user_key(email: str) -> str:
+    return f"rt:user:{email}"
+
+
+class RefreshTokenStore:
+    redis = None
+    script = None
+    _families: Dict[str, Dict] = {}
+    _users: Dict[str, Set[str]] = {}
+
+    @classmethod
+    def init(cls, redis):
+        """
+        The init function registers the redis client and the rotation script.
+        Without it the families are kept in process, which is only correct with a single worker.
+
+        :param cls: Represent the class
+        :param redis: The async redis client
+        :return: None
+        :doc-author: Trelent
+        """
+        cls.redis = redis
+        cls.script = redis.register_script(ROTATE_LUA)
+        cls._families = {}
+        cls._users = {}
+
+    @classmethod
+    def reset(cls):
+        cls.redis = None
+        cls.script = None
+        cls._families = {}
+        cls._users = {}
+
+    @classmethod
+    async def create(cls, email: str, device: str, ttl: int = REFRESH_TTL) -> Tuple[str, str]:
+        """
+        The create function opens the session of one device: a token family and its first token id.
+
+        :param cls: Represent the class
+        :param email: str: The owner of the session
+        :param device: str: A name of the device, shown when sessions are listed
+        :param ttl: int: Seconds the session lives without a refresh
+        :return: The session id and the id of its current refresh token
+        :doc-author: Trelent
+        """
+        sid, jti = uuid.uuid4().hex, uuid.uuid4().hex
+        now = int(time.time())
+        family = {"email": email, "jti": jti, "device": device, "created": now, "last_used": now}
+        if cls.redis is None:
+            family["expires"] = now + ttl
+            cls._families[sid] = family
+            cls._users.setdefault(email, set()).add(sid)
+            return sid, jti
+        with REDIS_LATENCY.labels("refresh_token").time():
+            async with cls.redis.pipeline(transaction=True) as pipe:
+                pipe.hset(family_key(sid), mapping=family)
+                pipe.expire(family_key(sid), ttl)
+                pipe.sadd(user_key(email), sid)
+                pipe.expire(user_key(email), ttl)
+                await pipe.execute()
+        return sid, jti
+
+    @classmethod
+    async def rotate(cls, email: str, sid: str, jti: str, ttl: int = REFRESH_TTL) -> Tuple[int, Optional[str]]:
+        """
+        The rotate function replaces the current refresh token of a session, atomically.
+        Of two concurrent refreshes with the same token exactly one succeeds; the other is a replay
+        and revokes the session.
+
+        :param cls: Represent the class
+        :param email: str: The owner of the session
+        :param sid: str: The session id
+        :param jti: str: The id of the presented refresh token
+        :param ttl: int: Seconds the session lives without a refresh
+        :return: ROTATED and the new token id, or UNKNOWN or REUSED and None
+        :doc-author: Trelent
+        """
+        new_jti = uuid.uuid4().hex
+        now = int(time.time())
+        if cls.redis is None:
+            family = cls._families.get(sid)
+            if family is None or family["expires"] < now:
+                return UNKNOWN, None
+            if family["jti"] != jti:
+                await cls.revoke(email, sid)
+                return REUSED, None
+            family.update(jti=new_jti, last_used=now, expires=now + ttl)
+            return ROTATED, new_jti
+        with REDIS_LATENCY.labels("refresh_token").time():
+            result = int(await cls.script(keys=[family_key(sid), user_key(email)], args=[jti, new_jti, sid, now, ttl]))
+        return result, new_jti if result == ROTATED else None
+
+    @classmethod
+    async def revoke(cls, email: str, sid: str) -> bool:
+        """
+        The revoke function ends one session; its refresh tokens stop working at once.
+
+        :param cls: Represent the class
+        :param email: str: The owner of the session
+        :param sid: str: The session id
+        :return: True if the session existed
+        :doc-author: Trelent
+        """
+        if cls.redis is None:
+            family = cls._families.get(sid)
+            if family is None or family["email"] != email:
+                return False
+            del cls._families[sid]
+            cls._users.get(email, set()).discard(sid)
+            return True
+        with REDIS_LATENCY.labels("refresh_token").time():
+            if await cls.redis.hget(family_key(sid), "email") != email:
+                return False
+            await cls.redis.delete(family_key(sid))
+            await cls.redis.srem(user_key(email), sid)
+        return True
+
+    @classmethod
+    async def revoke_all(cls, email: str) -> List[str]:
+        """
+        The revoke_all function ends every session of a user.
+
+        :param cls: Represent the class
+        :param email: str: The owner of the sessions
+        :return: The ids of the sessions ended
+        :doc-author: Trelent
+        """
+        if cls.redis is None:
+            sids = cls._users.pop(email, set())
+            for sid in sids:
+                cls._families.pop(sid, None)
+            return sorted(sids)
+        with REDIS_LATENCY.labels("refresh_token").time():
+            sids = await cls.redis.smembers(user_key(email))
+            if sids:
+                await cls.redis.delete(user_key(email), *(family_key(sid) for sid in sids))
+        return sorted(sids)
+
+    @classmethod
+    async def sessions(cls, email: str) -> List[Dict]:
+        """
+        The sessions function lists the open sessions of a user.
+
+        :param cls: Represent the class
+        :param email: str: The owner of the sessions
+        :return: The id, device, creation and last refresh time of each session
+        :doc-author: Trelent
+        """
+        if cls.redis is None:
+            now = int(time.time())
+            families = [
+                (sid, cls._families.get(sid)) for sid in sorted(cls._users.get(email, ()))
+            ]
+            families = [(sid, family) for sid, family in families if family and family["expires"] >= now]
+        else:
+            with REDIS_LATENCY.labels("refresh_token").time():
+                sids = sorted(await cls.redis.smembers(user_key(email)))
+                async with cls.redis.pipeline(transaction=False) as pipe:
+                    for sid in sids:
+                        pipe.hgetall(family_key(sid))
+                    families = list(zip(sids, await pipe.execute()))
+            stale = [sid for sid, family in families if not family]
+            if stale:
+                await cls.redis.srem(user_key(email), *stale)
+        return [
+            {"id": sid, "device": family["device"], "created": int(family["created"]),
+             "last_used": int(family["last_used"])}
+            for sid, family in families if family
+        ]
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from src.services.metrics import REDIS_LATENCY, SINGLE_FLIGHT
+
+logger = logging.getLogger(__name__)
+
+# Deletes the lock only if it is still ours, so a load that outlived its lock does not free the next one.
+RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def lock_key(name: str, key: Hashable) -> str:
+    return f"flight:{name}:{key}"
+
+
+class SingleFlight:
+    redis = None
+    script = None
+
+    def __init__(self, name: str, lock_ttl: float = 5.0, wait: float = 2.0, poll: float = 0.05):
+        """
+        The SingleFlight shares one in-flight load between the concurrent callers asking for the same key.
+        Within a worker the callers await the same task. Across workers, when redis is configured and
+        the caller can probe a shared cache, the worker that takes the lock loads while the others poll
+        the cache for the value it stores.
+
+        :param self: Represent the instance of the class
+        :param name: str: Names the metrics and the redis locks of this flight
+        :param lock_ttl: float: Seconds a redis lock lives, longer than any load
+        :param wait: float: Seconds a worker polls the shared cache before loading anyway
+        :param poll: float: Seconds between two polls
+        :return: None
+        :doc-author: Trelent
+        """
+        self.name = name
+        self.lock_ttl = lock_ttl
+        self.wait = wait
+        self.poll = poll
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    @classmethod
+    def init(cls, redis):
+        cls.redis = redis
+        cls.script = redis.register_script(RELEASE_LUA)
+
+    @classmethod
+    def reset(cls):
+        cls.redis = None
+        cls.script = None
+
+    async def do(
+        self,
+        key: Hashable,
+        load: Callable[[], Awaitable[Any]],
+        cached: Optional[Callable[[], Awaitable[Any]]] = None,
+    ) -> Any:
+        """
+        The do function returns the result of load, sharing it with every concurrent call for key.
+        A failed load fails every caller waiting on it; the next call loads again.
+
+        :param self: Represent the instance of the class
+        :param key: Hashable: Identifies the value
+        :param load: Callable[[], Awaitable[Any]]: Loads the value, and stores it in the shared cache if any
+        :param cached: Optional[Callable[[], Awaitable[Any]]]: Reads the shared cache, None on a miss
+        :return: The value
+        :doc-author: Trelent
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            SINGLE_FLIGHT.labels(self.name, "coalesced").inc()
+        else:
+            # The load runs in its own task, so a caller that goes away does not cancel it for the others.
+            task = asyncio.ensure_future(self._load(key, load, cached))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Every caller may have gone away; retrieving the exception keeps asyncio from logging it.
+            task.exception()
+
+    async def _load(self, key: Hashable, load, cached) -> Any:
+        if self.redis is not None and cached is not None:
+            return await self._load_locked(key, load, cached)
+        SINGLE_FLIGHT.labels(self.name, "loaded").inc()
+        return await load()
+
+    async def _load_locked(self, key: Hashable, load, cached) -> Any:
+        token = uuid.uuid4().hex
+        name = lock_key(self.name, key)
+        try:
+            with REDIS_LATENCY.labels("flight").time():
+                acquired = await self.redis.set(name, token, nx=True, px=int(self.lock_ttl * 1000))
+        except Exception as e:
+            logger.warning("Single flight lock %s was not taken: %s", name, e)
+            SINGLE_FLIGHT.labels(self.name, "loaded").inc()
+            return await load()
+        if acquired:
+            SINGLE_FLIGHT.labels(self.name, "loaded").inc()
+            try:
+                return await load()
+            finally:
+                try:
+                    await self.script(keys=[name], args=[token])
+                except Exception as e:
+                    logger.warning("Single flight lock %s was not released: %s", name, e)
+        deadline = time.monotonic() + self.wait
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.poll)
+            value = await cached()
+            if value is not None:
+                SINGLE_FLIGHT.labels(self.name, "waited").inc()
+                return value
+        # The holder is slow or died; loading is better than failing the request.
+        SINGLE_FLIGHT.labels(self.name, "loaded").inc()
+        return await load()
@@ -0,0 +1,186 @@
+import asyncio
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from src.conf.config import settings
+from src.services.tracing import span
+
+
+class StorageBackend:
+    """
+    Base class for avatar storage backends.
+
+    Backends implement a blocking ``upload`` method; callers go through
+    :func:`upload_avatar`, which runs it off the event loop.
+    """
+
+    def upload(self, file: BinaryIO, public_id: str, fmt: str) -> str:
+        """
+        The upload function stores the file under public_id and returns the public URL of the avatar.
+
+        :param self: Represent the instance of the class
+        :param file: BinaryIO: The file object to store
+        :param public_id: str: The identifier of the stored file
+        :param fmt: str: The image format of the file
+        :return: The URL of the uploaded avatar
+        :doc-author: Trelent
+        """
+        raise NotImplementedError
+
+
+class CloudinaryStorage(StorageBackend):
+    def __init__(self, cloud_name: str, api_key, api_secret: str):
+        """
+        The __init__ function keeps the cloudinary credentials of the backend.
+        The cloudinary client is imported and configured once, by the first upload of the worker.
+
+        :param self: Represent the instance of the class
+        :param cloud_name: str: The cloudinary cloud name
+        :param api_key: The cloudinary api key
+        :param api_secret: str: The cloudinary api secret
+        :return: None
+        :doc-author: Trelent
+        """
+        self.credentials = dict(cloud_name=cloud_name, api_key=api_key, api_secret=api_secret)
+        self._uploader = None
+
+    def uploader(self):
+        """
+        The uploader function returns the cloudinary uploader module, configuring cloudinary on first use.
+
+        :param self: Represent the instance of the class
+        :return: The cloudinary.uploader module
+        :doc-author: Trelent
+        """
+        if self._uploader is None:
+            import cloudinary
+            import cloudinary.uploader
+
+            cloudinary.config(**self.credentials, secure=True)
+            self._uploader = cloudinary.uploader
+        return self._uploader
+
+    def upload(self, file: BinaryIO, public_id: str, fmt: str) -> str:
+        """
+        The upload function sends the already resized file to cloudinary and returns its URL.
+
+        :param self: Represent the instance of the class
+        :param file: BinaryIO: The file object to upload
+        :param public_id: str: The cloudinary public id
+        :param fmt: str: The image format of the file
+        :return: The URL of the uploaded avatar
+        :doc-author: Trelent
+        """
+        r = self.uploader().upload(file, public_id=public_id, format=fmt, overwrite=True)
+        return r["secure_url"]
+
+
+class LocalStorage(StorageBackend):
+    def __init__(self, root: str | Path, base_url: str):
+        """
+        The __init__ function sets up a local-filesystem stand-in for cloudinary.
+
+        :param self: Represent the instance of the class
+        :param root: str | Path: The directory the files are written to
+        :param base_url: str: The URL prefix the directory is served under
+        :return: None
+        :doc-author: Trelent
+        """
+        self.root = Path(root).resolve()
+        self.base_url = base_url.rstrip("/")
+
+    def upload(self, file: BinaryIO, public_id: str, fmt: str) -> str:
+        """
+        The upload function copies the file under the storage root and returns its URL.
+
+        :param self: Represent the instance of the class
+        :param file: BinaryIO: The file object to store
+        :param public_id: str: The relative path of the stored file
+        :param fmt: str: The image format, used as the file extension
+        :return: The URL of the stored avatar
+        :raises ValueError: When public_id would leave the storage root
+        :doc-author: Trelent
+        """
+        public_id = f"{public_id}.{fmt}"
+        # public_id holds the username, which may contain "..": the served directory must not be left.
+        path = (self.root / public_id).resolve()
+        if not path.is_relative_to(self.root):
+            raise ValueError(f"Avatar path {public_id} is outside the storage root")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as fh:
+            while chunk := file.read(64 * 1024):
+                fh.write(chunk)
+        return f"{self.base_url}/{public_id}"
+
+
+_storage: Optional[StorageBackend] = None
+_upload_slots: Optional[asyncio.Semaphore] = None
+
+
+def init_storage(config=settings) -> StorageBackend:
+    """
+    The init_storage function builds the storage backend selected in the settings.
+    It is called once at startup, so the backend is never reconfigured per request.
+
+    :param config: The application settings
+    :return: The configured storage backend
+    :doc-author: Trelent
+    """
+    global _upload_slots
+    if config.avatar_storage == "local":
+        backend = LocalStorage(config.avatar_local_dir, config.avatar_local_url)
+    else:
+        backend = CloudinaryStorage(
+            config.cloudinary_name,
+            config.cloudinary_api_key,
+            config.cloudinary_api_secret,
+        )
+    _upload_slots = asyncio.Semaphore(config.avatar_upload_concurrency)
+    set_storage(backend)
+    return backend
+
+
+def set_storage(backend: StorageBackend) -> None:
+    """
+    The set_storage function replaces the active storage backend, e.g. with LocalStorage in tests.
+
+    :param backend: StorageBackend: The backend to use
+    :return: None
+    :doc-author: Trelent
+    """
+    global _storage
+    _storage = backend
+
+
+def get_storage() -> StorageBackend:
+    """
+    The get_storage function returns the active storage backend, building it on first use.
+
+    :return: The active storage backend
+    :doc-author: Trelent
+    """
+    if _storage is None:
+        init_storage()
+    return _storage
+
+
+async def upload_avatar(file: BinaryIO, public_id: str, fmt: str) -> str:
+    """
+    The upload_avatar function uploads an avatar in the thread pool.
+    The number of concurrent uploads per worker is bounded by settings.avatar_upload_concurrency.
+
+    :param file: BinaryIO: The file object to upload
+    :param public_id: str: The identifier of the stored file
+    :param fmt: str: The image format of the file
+    :return: The URL of the uploaded avatar
+    :doc-author: Trelent
+    """
+    global _upload_slots
+    storage = get_storage()
+    if _upload_slots is None:
+        _upload_slots = asyncio.Semaphore(settings.avatar_upload_concurrency)
+    async with _upload_slots:
+        with span("storage.upload", backend=type(storage).__name__, public_id=public_id):
+            return await run_in_threadpool(storage.upload, file, public_id, fmt)
@@ -0,0 +1,332 @@
+import functools
+import inspect
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from src.conf.config import settings
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "root")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict, root: bool = False):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        # The span of the request itself, a server span even when it continues an upstream trace.
+        self.root = root
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def to_otlp(self) -> Dict:
+        """
+        The to_otlp function returns the span in the OTLP/JSON encoding.
+
+        :param self: Represent the instance of the class
+        :return: The span as a dict
+        :doc-author: Trelent
+        """
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 2 if self.root else 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()
+            ],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Trace:
+    __slots__ = ("trace_id", "spans")
+
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or os.urandom(16).hex()
+        self.spans: List[Span] = []
+
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class JsonFileExporter:
+    def __init__(self, path: str, service_name: str = "m2-h14"):
+        """
+        The JsonFileExporter appends finished traces to a file, one OTLP/JSON export request per line.
+        This is the format of the OpenTelemetry collector file exporter, so the file can be
+        replayed into a collector later. Writing happens on a background thread.
+
+        :param self: Represent the instance of the class
+        :param path: str: The file the traces are appended to
+        :param service_name: str: The service.name resource attribute
+        :return: None
+        :doc-author: Trelent
+        """
+        self.path = path
+        self.resource = {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]}
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, trace: Trace) -> None:
+        self._queue.put(trace)
+
+    def encode(self, trace: Trace) -> str:
+        return json.dumps({
+            "resourceSpans": [{
+                "resource": self.resource,
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [span.to_otlp() for span in trace.spans],
+                }],
+            }]
+        })
+
+    def _run(self) -> None:
+        while True:
+            traces = [self._queue.get()]
+            while not self._queue.empty():
+                traces.append(self._queue.get_nowait())
+            with open(self.path, "a", encoding="utf-8") as fh:
+                for trace in traces:
+                    fh.write(self.encode(trace) + "\n")
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+_exporter = None
+_config = settings
+
+
+def init_tracing(config=settings) -> None:
+    """
+    The init_tracing function selects the settings traces are sampled and exported with.
+    The file exporter of other settings is replaced on first use; an exporter set with set_exporter is kept.
+
+    :param config: The application settings
+    :return: None
+    :doc-author: Trelent
+    """
+    global _config, _exporter
+    if config is not _config and isinstance(_exporter, JsonFileExporter):
+        _exporter = None
+    _config = config
+
+
+def get_exporter():
+    """
+    The get_exporter function returns the exporter of finished traces, creating it on first use.
+
+    :return: The trace exporter
+    :doc-author: Trelent
+    """
+    global _exporter
+    if _exporter is None:
+        _exporter = JsonFileExporter(_config.trace_export_path)
+    return _exporter
+
+
+def set_exporter(exporter) -> None:
+    """
+    The set_exporter function replaces the exporter of finished traces.
+
+    :param exporter: An object with an export(trace) method
+    :return: None
+    :doc-author: Trelent
+    """
+    global _exporter
+    _exporter = exporter
+
+
+def current_span() -> Optional[Span]:
+    """
+    The current_span function returns the active span, or None when the request is not sampled.
+
+    :return: The active span
+    :doc-author: Trelent
+    """
+    return _current.get()
+
+
+# version-trace_id-parent_id-flags, lowercase hex; later versions may append fields.
+TRACEPARENT = re.compile(r"([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-.*)?")
+
+
+def parse_traceparent(header: Optional[str]):
+    """
+    The parse_traceparent function reads a W3C traceparent header.
+    An invalid header is ignored, so the request starts a fresh trace, as W3C Trace Context requires.
+
+    :param header: Optional[str]: The header value
+    :return: The trace id, parent span id and sampled flag, or None if the header is invalid
+    :doc-author: Trelent
+    """
+    match = TRACEPARENT.fullmatch(header.strip()) if header else None
+    if match is None:
+        return None
+    version, trace_id, parent_id, flags, rest = match.groups()
+    if version == "ff" or (version == "00" and rest) or trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id, parent_id, int(flags, 16) & 1 == 1
+
+
+@contextmanager
+def start_trace(name: str, traceparent: Optional[str] = None, sample_rate: Optional[float] = None,
+                trust_upstream: Optional[bool] = None, **attributes):
+    """
+    The start_trace function opens the root span of a request.
+    The sampling decision is taken here, once per trace. An incoming traceparent header always
+    continues its trace, but its sampled flag only decides for us when settings.trace_trust_upstream
+    says the header comes from our own proxies; otherwise the request is sampled with probability
+    settings.trace_sample_rate, so clients cannot force their requests to be traced.
+    Nothing is recorded for requests that are sampled out.
+
+    :param name: str: The span name
+    :param traceparent: Optional[str]: The W3C traceparent header of the request
+    :param sample_rate: Optional[float]: Override settings.trace_sample_rate
+    :param trust_upstream: Optional[bool]: Override settings.trace_trust_upstream
+    :param attributes: The span attributes
+    :return: The root span, or None if the trace is not sampled
+    :doc-author: Trelent
+    """
+    trace_id, parent_id, sampled = parse_traceparent(traceparent) or (None, None, None)
+    if trust_upstream is None:
+        trust_upstream = _config.trace_trust_upstream
+    if sampled is None or not trust_upstream:
+        rate = _config.trace_sample_rate if sample_rate is None else sample_rate
+        sampled = rate > 0 and random.random() < rate
+    if not sampled:
+        yield None
+        return
+
+    span = Span(Trace(trace_id), name, parent_id, attributes, root=True)
+    token = _current.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        span.end_ns = time.time_ns()
+        span.trace.spans.append(span)
+        get_exporter().export(span.trace)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    The span function opens a child span of the active span.
+    It does nothing when there is no active span, i.e. outside a sampled trace.
+
+    :param name: str: The span name
+    :param attributes: The span attributes
+    :return: The span, or None if the trace is not sampled
+    :doc-author: Trelent
+    """
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+
+    child = Span(parent.trace, name, parent.span_id, attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        child.end_ns = time.time_ns()
+        parent.trace.spans.append(child)
+
+
+def traced(name: Optional[str] = None):
+    """
+    The traced decorator runs every call of the function in a span named after it.
+    When the trace is sampled out the function is called directly after a single context lookup.
+
+    :param name: Optional[str]: The span name, module.function by default
+    :return: The decorator
+    :doc-author: Trelent
+    """
+    def decorator(fn):
+        span_name = name or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                if _current.get() is None:
+                    return await fn(*args, **kwargs)
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if _current.get() is None:
+                    return fn(*args, **kwargs)
+                with span(span_name):
+                    return fn(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+class TracingMiddleware:
+    def __init__(self, app):
+        """
+        The TracingMiddleware opens the root span of every HTTP request.
+
+        :param self: Represent the instance of the class
+        :param app: The ASGI application
+        :return: None
+        :doc-author: Trelent
+        """
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        traceparent = None
+        for key, value in scope["headers"]:
+            if key == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+
+        with start_trace(f"{scope['method']} {scope['path']}", traceparent) as root:
+            if root is None:
+                return await self.app(scope, receive, send)
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    root.set_attribute("http.status_code", message["status"])
+                await send(message)
+
+            root.set_attribute("http.method", scope["method"])
+            root.set_attribute("http.target", scope["path"])
+            await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from src.services.metrics import REDIS_LATENCY, USER_CACHE_INVALIDATIONS
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "user-invalidate"
+
+# Stores the user only if no write bumped its version since the fill read it, so a worker that read
+# the user before a write cannot put it back into redis after the write deleted it.
+STORE_LUA = """
+if (redis.call('GET', KEYS[2]) or '0') == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+# Seconds a version outlives the last write of its user. One that expired reads as 0: a fill that read
+# it before fails its check, and an invalidation after it creates it again, so expiry never lets a stale
+# user in.
+VERSION_TTL = 3600
+
+
+def user_key(email: str) -> str:
+    return f"user:{email}"
+
+
+def version_key(email: str) -> str:
+    return f"user-version:{email}"
+
+
+class UserCache:
+    redis = None
+    ttl: float = 60
+    size: int = 10000
+    epoch: int = 0
+    _versions: Dict[str, int] = {}
+    _entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+    _listener: Optional[asyncio.Task] = None
+
+    @classmethod
+    async def init(cls, redis, ttl: float = 60, size: int = 10000):
+        """
+        The init function subscribes the worker to the invalidations published by every worker.
+
+        :param cls: Represent the class
+        :param redis: The async redis client
+        :param ttl: float: Seconds a user stays in the local tier, 0 disables it
+        :param size: int: How many users the local tier holds
+        :return: None
+        :doc-author: Trelent
+        """
+        cls.reset(ttl, size)
+        cls.redis = redis
+        cls._listener = asyncio.create_task(cls._listen())
+
+    @classmethod
+    async def close(cls):
+        if cls._listener is not None:
+            cls._listener.cancel()
+            try:
+                await cls._listener
+            except asyncio.CancelledError:
+                pass
+        cls.reset(cls.ttl, cls.size)
+
+    @classmethod
+    def reset(cls, ttl: float = 60, size: int = 10000):
+        cls.redis = None
+        cls.ttl = ttl
+        cls.size = size
+        cls.epoch += 1
+        cls._versions = {}
+        cls._entries = OrderedDict()
+        cls._listener = None
+
+    @classmethod
+    def version(cls, email: str) -> Tuple[int, int]:
+        """
+        The version function returns the version of a user in the local tier, to read before loading the user.
+        It changes when the user is invalidated, or when the whole tier is.
+
+        :param cls: Represent the class
+        :param email: str: The email of the user
+        :return: The version to pass to put
+        :doc-author: Trelent
+        """
+        return cls.epoch, cls._versions.get(email, 0)
+
+    @classmethod
+    def get(cls, email: str) -> Optional[bytes]:
+        """
+        The get function returns the pickled user from the local tier of the worker.
+
+        :param cls: Represent the class
+        :param email: str: The email of the user
+        :return: The pickled user, or None if it is not cached or has expired
+        :doc-author: Trelent
+        """
+        entry = cls._entries.get(email)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            cls._entries.pop(email, None)
+            return None
+        cls._entries.move_to_end(email)
+        return entry[1]
+
+    @classmethod
+    def put(cls, email: str, payload: bytes, version: Tuple[int, int]) -> bool:
+        """
+        The put function stores the pickled user in the local tier.
+        A user read from the database before an invalidation may already be stale, so it is only
+        stored if no invalidation of this user arrived since the read started.
+
+        :param cls: Represent the class
+        :param email: str: The email of the user
+        :param payload: bytes: The pickled user
+        :param version: Tuple[int, int]: The version read before the user was loaded
+        :return: True if the user was stored
+        :doc-author: Trelent
+        """
+        if version != cls.version(email):
+            return False
+        if cls.ttl > 0:
+            cls._entries[email] = (time.monotonic() + cls.ttl, payload)
+            cls._entries.move_to_end(email)
+            while len(cls._entries) > cls.size:
+                cls._entries.popitem(last=False)
+        return True
+
+    @classmethod
+    def evict(cls, email: Optional[str] = None) -> None:
+        """
+        The evict function drops a user, or every user, from the local tier, and stales the fills in flight for them.
+
+        :param cls: Represent the class
+        :param email: Optional[str]: The email of the user, None for every user
+        :return: None
+        :doc-author: Trelent
+        """
+        if email is None or len(cls._versions) >= cls.size:
+            # The versions are bounded like the entries; past that, every fill in flight is staled at once.
+            cls.epoch += 1
+            cls._versions = {}
+        if email is None:
+            cls._entries.clear()
+        else:
+            cls._versions[email] = cls._versions.get(email, 0) + 1
+            cls._entries.pop(email, None)
+
+    @classmethod
+    async def _listen(cls) -> None:
+        """
+        The _listen function evicts the users that any worker invalidates.
+        Messages published while the worker was disconnected are lost, so the whole local tier
+        is dropped after each (re)subscription.
+
+        :param cls: Represent the class
+        :return: None
+        :doc-author: Trelent
+        """
+        delay = 1
+        while True:
+            try:
+                async with cls.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(CHANNEL)
+                    cls.evict()
+                    delay = 1
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            USER_CACHE_INVALIDATIONS.labels("remote").inc()
+                            cls.evict(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("User cache listener reconnects in %ss: %s", delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    @classmethod
+    async def invalidate(cls, email: str) -> None:
+        """
+        The invalidate function drops a user from every cache tier, after a write to the user.
+        The shared entry is deleted here, and its version bumped so that a fill which read the user
+        before the write does not store it again; the local tiers of the other workers are evicted
+        when they receive the published email.
+
+        :param cls: Represent the class
+        :param email: str: The email of the written user
+        :return: None
+        :doc-author: Trelent
+        """
+        USER_CACHE_INVALIDATIONS.labels("local").inc()
+        cls.evict(email)
+        if cls.redis is None:
+            return
+        try:
+            with REDIS_LATENCY.labels("invalidate").time():
+                async with cls.redis.pipeline(transaction=True) as pipe:
+                    pipe.incr(version_key(email))
+                    pipe.expire(version_key(email), VERSION_TTL)
+                    pipe.delete(user_key(email))
+                    await pipe.execute()
+                await cls.redis.publish(CHANNEL, email)
+        except Exception as e:
+            # The write is committed already; the entries expire with their TTL.
+            logger.warning("User cache invalidation of %s failed: %s", email, e)
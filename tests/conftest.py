@@ -6,6 +6,7 @@ from sqlalchemy.orm import sessionmaker
 
 from main import app
 from src.database.models import Base
+from src.database import loader
 from src.database.db import get_db
 
 
@@ -36,9 +37,11 @@ def client(session):
     # Dependency override
 
     def override_get_db():
+        loader.attach(session)
         try:
             yield session
         finally:
+            loader.detach(session)
             session.close()
 
     app.dependency_overrides[get_db] = override_get_db
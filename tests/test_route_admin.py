@@ -0,0 +1,68 @@
+import pytest
+
+from main import app
+from src.database.models import User
+from src.services.auth import auth_service
+
+retained = []
+
+
+@pytest.fixture()
+def admin(monkeypatch):
+    """
+    The admin function authenticates the requests as a user listed in settings.admin_emails.
+
+    :param monkeypatch: Set the admin emails
+    :return: The admin user
+    :doc-author: Trelent
+    """
+    user = User(id=1, username="admin", email="admin@example.com")
+    monkeypatch.setattr("src.routes.admin.settings.admin_emails", "root@example.com, admin@example.com")
+    app.dependency_overrides[auth_service.get_principal] = lambda: user
+    yield user
+    app.dependency_overrides.pop(auth_service.get_principal, None)
+
+
+def test_admin_requires_listed_email(client, admin, monkeypatch):
+    """
+    The test_admin_requires_listed_email function tests that users not listed in settings.admin_emails get a 403.
+
+    :param client: Make requests to the api
+    :param admin: The authenticated user
+    :param monkeypatch: Set the admin emails
+    :return: None
+    :doc-author: Trelent
+    """
+    monkeypatch.setattr("src.routes.admin.settings.admin_emails", "root@example.com")
+    response = client.get("/api/admin/memory")
+    assert response.status_code == 403, response.text
+
+
+def test_memory_snapshot_diff(client, admin):
+    """
+    The test_memory_snapshot_diff function tests tracing, snapshots and their diff through the admin endpoints.
+
+    :param client: Make requests to the api
+    :param admin: The authenticated user
+    :return: None
+    :doc-author: Trelent
+    """
+    assert client.post("/api/admin/memory/snapshots").status_code == 409
+    assert client.post("/api/admin/memory/start", params={"frames": 5}).json()["tracing"] is True
+    try:
+        old = client.post("/api/admin/memory/snapshots").json()["id"]
+        retained.append([object() for _ in range(20000)])
+        new = client.post("/api/admin/memory/snapshots").json()["id"]
+
+        response = client.get(f"/api/admin/memory/snapshots/{old}/diff/{new}", params={"limit": 50})
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert any(s["file"].endswith("test_route_admin.py") and s["size_diff"] > 0 for s in data["stats"])
+        assert set(data["components"]) >= {"user_cache", "orm_identity_map", "serialization", "other"}
+
+        routes = client.get("/api/admin/memory").json()["routes"]
+        assert "POST /api/admin/memory/snapshots" in routes
+        assert client.get(f"/api/admin/memory/snapshots/{old}/diff/999").status_code == 404
+    finally:
+        assert client.post("/api/admin/memory/stop").json()["tracing"] is False
+        retained.clear()
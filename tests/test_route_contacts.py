@@ -0,0 +1,213 @@
+import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from main import app
+from src.database.db import LazySession, get_db
+from src.database.models import Contact, User
+from src.repository.contacts import only_fields
+from src.routes import contacts as contacts_routes
+
+
+@pytest.fixture(scope="module")
+def current_user(session):
+    """
+    The current_user function creates a user with two contacts and makes it the authenticated user.
+
+    :param session: Access the database
+    :return: The authenticated user
+    :doc-author: Trelent
+    """
+    user = User(username="contacts", email="contacts@example.com", password="secret")
+    session.add(user)
+    session.commit()
+    for name in ("Ann", "Bob"):
+        session.add(Contact(name=name, surname="Lee", email=f"{name.lower()}@example.com", phone_number="123",
+                            birthday=datetime.date(1990, 1, 1), additional_data="", user_id=user.id))
+    session.commit()
+    session.refresh(user)
+    app.dependency_overrides[contacts_routes.get_current_user] = lambda: user
+    yield user
+    app.dependency_overrides.pop(contacts_routes.get_current_user, None)
+
+
+def contact_body(name):
+    return {"name": name, "surname": "Lee", "email": "ann@example.com", "phone_number": "123",
+            "birthday": "1990-01-01", "additional_data": ""}
+
+
+def test_get_contacts_not_modified(client, current_user):
+    response = client.get("/api/contacts/")
+    assert response.status_code == 200, response.text
+    etag = response.headers["etag"]
+    assert etag.startswith('W/"')
+    assert response.headers["cache-control"] == "private, no-cache"
+
+    response = client.get("/api/contacts/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+    response = client.get("/api/contacts/?limit=1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+
+def test_get_contacts_needs_one_connection(client, current_user):
+    engine = create_engine("sqlite:///./test.db", connect_args={"check_same_thread": False}, poolclass=QueuePool,
+                           pool_size=1, max_overflow=0, pool_timeout=1)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def single_connection_db():
+        db = LazySession(factory)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    override = app.dependency_overrides[get_db]
+    app.dependency_overrides[get_db] = single_connection_db
+    try:
+        response = client.get("/api/contacts/?limit=2")
+    finally:
+        app.dependency_overrides[get_db] = override
+        engine.dispose()
+    assert response.status_code == 200, response.text
+    assert len(response.json()) == 2
+
+
+def test_get_contact_not_modified(client, current_user, session):
+    contact_id = session.query(Contact.id).filter(Contact.user_id == current_user.id).first()[0]
+    response = client.get(f"/api/contacts/{contact_id}")
+    assert response.status_code == 200, response.text
+    etag = response.headers["etag"]
+    assert etag.startswith('"c')
+
+    response = client.get(f"/api/contacts/{contact_id}", headers={"If-None-Match": f'"other", {etag}'})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    response = client.get("/api/contacts/999999", headers={"If-None-Match": etag})
+    assert response.status_code == 404
+
+
+def test_write_changes_etags(client, current_user, session):
+    contact_id = session.query(Contact.id).filter(Contact.user_id == current_user.id).first()[0]
+    list_etag = client.get("/api/contacts/").headers["etag"]
+    contact_etag = client.get(f"/api/contacts/{contact_id}").headers["etag"]
+
+    response = client.put(f"/api/contacts/{contact_id}", json=contact_body("Anna"))
+    assert response.status_code == 200, response.text
+    assert response.headers["etag"] != contact_etag
+
+    response = client.get(f"/api/contacts/{contact_id}", headers={"If-None-Match": contact_etag})
+    assert response.status_code == 200
+    assert response.json()["name"] == "Anna"
+    response = client.get("/api/contacts/", headers={"If-None-Match": list_etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != list_etag
+
+
+def test_changes_since_token(client, current_user, session):
+    response = client.get("/api/contacts/changes")
+    assert response.status_code == 200, response.text
+    initial = response.json()
+    assert len(initial["changed"]) == 2
+    assert initial["deleted"] == []
+
+    updated_id, deleted_id = sorted(contact["id"] for contact in initial["changed"])
+    assert client.put(f"/api/contacts/{updated_id}", json=contact_body("Annie")).status_code == 200
+    assert client.delete(f"/api/contacts/{deleted_id}").status_code == 200
+
+    response = client.get("/api/contacts/changes", params={"since": initial["token"]})
+    assert response.status_code == 200, response.text
+    changes = response.json()
+    assert [contact["name"] for contact in changes["changed"]] == ["Annie"]
+    assert changes["deleted"] == [deleted_id]
+    assert int(changes["token"]) > int(initial["token"])
+
+    response = client.get("/api/contacts/changes", params={"since": changes["token"]})
+    assert response.json() == {"changed": [], "deleted": [], "token": changes["token"]}
+
+
+def test_changes_invalid_token(client, current_user):
+    response = client.get("/api/contacts/changes", params={"since": "yesterday"})
+    assert response.status_code == 400
+
+
+def test_sparse_fieldset(client, current_user, session):
+    response = client.get("/api/contacts/", params={"fields": "name,surname"})
+    assert response.status_code == 200, response.text
+    assert response.json() and all(set(contact) == {"id", "name", "surname"} for contact in response.json())
+    etag = response.headers["etag"]
+    assert etag != client.get("/api/contacts/").headers["etag"]
+    assert client.get("/api/contacts/", params={"fields": "name,surname"},
+                      headers={"If-None-Match": etag}).status_code == 304
+
+    contact_id = response.json()[0]["id"]
+    response = client.get(f"/api/contacts/{contact_id}", params={"fields": "email"})
+    assert response.json() == {"id": contact_id, "email": session.get(Contact, contact_id).email}
+    assert client.get(f"/api/contacts/{contact_id}", params={"fields": "email"},
+                      headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+
+
+def test_sparse_fieldset_unknown_field(client, current_user):
+    response = client.get("/api/contacts/", params={"fields": "name,password"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Unknown fields: password"
+
+
+def test_sparse_fieldset_selects_only_requested_columns(session):
+    query = only_fields(session.query(Contact), ["id", "name"])
+    sql = str(query.statement.compile())
+    assert "contacts.name" in sql
+    assert "additional_data" not in sql
+
+
+def test_batch_get(client, current_user, session):
+    ids = [contact_id for contact_id, in session.query(Contact.id).filter(Contact.user_id == current_user.id)]
+    requested = list(reversed(ids)) + [999999, ids[-1]]
+    response = client.post("/api/contacts/batch-get", json={"ids": requested})
+    assert response.status_code == 200, response.text
+    assert [contact["id"] for contact in response.json()["contacts"]] == list(reversed(ids))
+    assert response.json()["missing"] == [999999]
+
+    response = client.post("/api/contacts/batch-get", params={"fields": "name"}, json={"ids": ids})
+    assert all(set(contact) == {"id", "name"} for contact in response.json()["contacts"])
+
+
+def test_batch_get_limit(client, current_user):
+    assert client.post("/api/contacts/batch-get", json={"ids": list(range(101))}).status_code == 422
+    assert client.post("/api/contacts/batch-get", json={"ids": []}).status_code == 422
+
+
+def test_batch_operations(client, current_user, session):
+    existing = [contact_id for contact_id, in session.query(Contact.id).filter(Contact.user_id == current_user.id)]
+    token = client.get("/api/contacts/changes").json()["token"]
+    operations = [
+        {"op": "create", "data": contact_body("Cid")},
+        {"op": "update", "id": existing[0], "data": contact_body("First")},
+        {"op": "create", "data": contact_body("Dan")},
+        {"op": "update", "id": existing[0], "data": contact_body("Second")},
+        {"op": "delete", "id": 999999},
+        {"op": "delete", "id": existing[0]},
+        {"op": "update", "id": existing[0], "data": contact_body("Third")},
+    ]
+    response = client.post("/api/contacts/batch", json={"operations": operations})
+    assert response.status_code == 200, response.text
+    results = response.json()["results"]
+    assert [result["status"] for result in results] == [201, 200, 201, 200, 404, 200, 404]
+    created = [results[0]["id"], results[2]["id"]]
+    assert all(created) and created[0] < created[1]
+
+    changes = client.get("/api/contacts/changes", params={"since": token}).json()
+    assert sorted(contact["name"] for contact in changes["changed"]) == ["Cid", "Dan"]
+    assert changes["deleted"] == [existing[0]]
+    assert changes["token"] == response.json()["token"]
+
+
+def test_batch_operations_validation(client, current_user):
+    response = client.post("/api/contacts/batch", json={"operations": [{"op": "update", "data": contact_body("X")}]})
+    assert response.status_code == 422
@@ -0,0 +1,34 @@
+def test_metrics_endpoint(client):
+    """
+    The test_metrics_endpoint function tests that served requests show up on /metrics under their route template.
+
+    :param client: Make requests to the api
+    :return: None
+    :doc-author: Trelent
+    """
+    client.get("/")
+    response = client.get("/metrics")
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'http_requests_total{method="GET",route="/",status="200"}' in response.text
+    assert "# TYPE http_request_duration_seconds histogram" in response.text
+
+
+def test_signed_profile_header(client, tmp_path, monkeypatch):
+    """
+    The test_signed_profile_header function tests that a request with a valid X-Profile token is profiled and stored.
+
+    :param client: Make requests to the api
+    :param tmp_path: The profile directory
+    :param monkeypatch: Point the profile directory at tmp_path
+    :return: None
+    :doc-author: Trelent
+    """
+    from src.services.profiler import sign_profile_token
+
+    monkeypatch.setattr("src.services.profiler.settings.profile_dir", str(tmp_path))
+    response = client.get("/", headers={"X-Profile": sign_profile_token("/metrics", 60)})
+    assert "x-profile-id" not in response.headers
+    response = client.get("/", headers={"X-Profile": sign_profile_token("/", 60)})
+    assert response.status_code == 200
+    assert (tmp_path / f"{response.headers['x-profile-id']}.folded").exists()
@@ -0,0 +1,188 @@
+import asyncio
+
+import pytest
+
+from main import app
+from src.database.models import User
+from src.repository import users as repository_users
+from src.services.auth import Principal, auth_service
+from src.services.limiter import LimiterBackend
+from src.services.revocation import RevocationList
+from src.services.sessions import RefreshTokenStore
+from src.services.user_cache import UserCache
+
+
+@pytest.fixture(scope="module")
+def account(session):
+    """
+    The account function creates a confirmed user that can log in.
+
+    :param session: Access the database
+    :return: The email and password of the user
+    :doc-author: Trelent
+    """
+    user = User(username="sessions", email="sessions@example.com",
+                password=auth_service.get_password_hash("secret1"), confirmed=True, avatar="")
+    session.add(user)
+    session.commit()
+    return {"username": user.email, "password": "secret1"}
+
+
+class DictCache:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def expire(self, key, seconds):
+        pass
+
+    def register_script(self, script):
+        def store(keys, args):
+            user, version = keys
+            if (self.data.get(version) or b"0") == args[0]:
+                self.data[user] = args[1]
+        return store
+
+
+@pytest.fixture(autouse=True)
+def signing(monkeypatch):
+    monkeypatch.setattr(auth_service, "ALGORITHM", "HS256")
+    monkeypatch.setattr(auth_service, "r", DictCache())
+    RefreshTokenStore.reset()
+    RevocationList.reset()
+    UserCache.reset()
+    LimiterBackend.reset()
+
+
+def refresh(client, token):
+    return client.get("/api/auth/refresh_token", headers={"Authorization": f"Bearer {token}"})
+
+
+def test_refresh_rotates(client, account):
+    login = client.post("/api/auth/login", data=account, headers={"X-Device-Name": "phone"})
+    assert login.status_code == 200, login.text
+    first = login.json()["refresh_token"]
+
+    response = refresh(client, first)
+    assert response.status_code == 200, response.text
+    second = response.json()["refresh_token"]
+    assert second != first
+
+    response = refresh(client, first)
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Refresh token reused, session revoked"
+    assert refresh(client, second).status_code == 401
+
+
+def test_reuse_revokes_access_tokens(client, account):
+    login = client.post("/api/auth/login", data=account).json()
+    rotated = refresh(client, login["refresh_token"]).json()
+    headers = {"Authorization": f"Bearer {rotated['access_token']}"}
+    assert client.get("/api/users/me/", headers=headers).status_code == 200
+
+    assert refresh(client, login["refresh_token"]).status_code == 401
+    assert client.get("/api/users/me/", headers=headers).status_code == 401
+    login_headers = {"Authorization": f"Bearer {login['access_token']}"}
+    assert client.get("/api/users/me/", headers=login_headers).status_code == 401
+
+
+def test_sessions_per_device(client, session, account):
+    phone = client.post("/api/auth/login", data=account, headers={"X-Device-Name": "phone"}).json()
+    client.post("/api/auth/login", data=account, headers={"X-Device-Name": "laptop"})
+    user = session.query(User).filter(User.email == account["username"]).first()
+    app.dependency_overrides[auth_service.get_principal] = lambda: user
+    try:
+        sessions = client.get("/api/auth/sessions").json()
+        assert sorted(s["device"] for s in sessions) == ["laptop", "phone"]
+
+        phone_sid = next(s["id"] for s in sessions if s["device"] == "phone")
+        assert client.delete(f"/api/auth/sessions/{phone_sid}").status_code == 204
+        assert refresh(client, phone["refresh_token"]).status_code == 401
+        assert [s["device"] for s in client.get("/api/auth/sessions").json()] == ["laptop"]
+        assert client.delete(f"/api/auth/sessions/{phone_sid}").status_code == 404
+
+        assert client.delete("/api/auth/sessions").status_code == 204
+        assert client.get("/api/auth/sessions").json() == []
+    finally:
+        app.dependency_overrides.pop(auth_service.get_principal, None)
+
+
+def test_logout_revokes_access_token(client, account):
+    tokens = client.post("/api/auth/login", data=account).json()
+    other = client.post("/api/auth/login", data=account).json()
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    assert client.get("/api/users/me/", headers=headers).status_code == 200
+
+    assert client.post("/api/auth/logout", headers=headers).status_code == 204
+    assert client.get("/api/users/me/", headers=headers).status_code == 401
+    assert refresh(client, tokens["refresh_token"]).status_code == 401
+
+    other_headers = {"Authorization": f"Bearer {other['access_token']}"}
+    assert client.get("/api/users/me/", headers=other_headers).status_code == 200
+
+
+def test_identity_claims_skip_user_lookup(client, account, monkeypatch):
+    monkeypatch.setattr("src.services.auth.settings.access_token_claims", True)
+    tokens = client.post("/api/auth/login", data=account).json()
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+
+    response = client.get("/api/contacts/", headers=headers)
+    assert response.status_code == 200, response.text
+    assert auth_service.r.data == {}
+
+    tokens = refresh(client, tokens["refresh_token"]).json()
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    assert client.get("/api/auth/sessions", headers=headers).status_code == 200
+    assert auth_service.r.data == {}
+
+    assert client.get("/api/users/me/", headers=headers).json()["email"] == account["username"]
+    assert list(auth_service.r.data) == [f"user:{account['username']}"]
+
+
+def test_principal_loads_user_lazily(session, account):
+    user = session.query(User).filter(User.email == account["username"]).first()
+    principal = Principal(user.id, user.email, True, session)
+    assert principal._user is None
+    assert principal.username == "sessions"
+    assert principal._user is user
+
+
+def test_asymmetric_signing(client, account, monkeypatch):
+    from tests.test_unit_services_keys import make_pem
+    from src.services.keys import KeySet
+
+    assert client.get("/api/auth/jwks.json").status_code == 404
+    monkeypatch.setattr(auth_service, "key_set", KeySet.from_pem("ES256", [("k1", make_pem())]))
+    response = client.get("/api/auth/jwks.json")
+    assert response.headers["cache-control"] == "public, max-age=300"
+    verifier = KeySet.from_jwks(response.json())
+
+    tokens = client.post("/api/auth/login", data=account).json()
+    assert verifier.decode(tokens["access_token"])["sub"] == account["username"]
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    assert client.get("/api/users/me/", headers=headers).status_code == 200
+    assert refresh(client, tokens["refresh_token"]).status_code == 200
+
+
+def test_fill_does_not_store_a_user_written_meanwhile(session, account, monkeypatch):
+    email = account["username"]
+    get_user_by_email = repository_users.get_user_by_email
+
+    async def written_during_read(email, db):
+        user = await get_user_by_email(email, db)
+        # another worker commits a write and bumps the version before this fill stores the user
+        auth_service.r.data[f"user-version:{email}"] = b"1"
+        return user
+
+    monkeypatch.setattr(repository_users, "get_user_by_email", written_during_read)
+    asyncio.run(auth_service._fill_user(email, session, UserCache.version(email)))
+    assert f"user:{email}" not in auth_service.r.data
+
+    monkeypatch.setattr(repository_users, "get_user_by_email", get_user_by_email)
+    asyncio.run(auth_service._fill_user(email, session, UserCache.version(email)))
+    assert f"user:{email}" in auth_service.r.data
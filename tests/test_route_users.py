@@ -0,0 +1,188 @@
+import io
+import shutil
+import warnings
+
+import pytest
+from PIL import Image
+
+from main import app
+from src.database.models import User
+from src.services import storage
+from src.services.auth import auth_service
+from src.services.limiter import LimiterBackend
+from src.services.storage import LocalStorage
+
+
+def make_png(width=400, height=300):
+    """
+    The make_png function renders a solid colour png of the given size.
+
+    :param width: The width of the image
+    :param height: The height of the image
+    :return: The encoded png
+    :doc-author: Trelent
+    """
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 30, 30)).save(out, format="PNG")
+    return out.getvalue()
+
+
+@pytest.fixture(scope="module")
+def current_user(session):
+    """
+    The current_user function creates a user in the test database and makes it the authenticated user.
+
+    :param session: Access the database
+    :return: The authenticated user
+    :doc-author: Trelent
+    """
+    user = User(username="avatar", email="avatar@example.com", password="secret", avatar="")
+    session.add(user)
+    session.commit()
+    session.refresh(user)
+    app.dependency_overrides[auth_service.get_current_user] = lambda: user
+    yield user
+    app.dependency_overrides.pop(auth_service.get_current_user, None)
+
+
+@pytest.fixture()
+def local_storage(tmp_path, monkeypatch):
+    """
+    The local_storage function swaps cloudinary for the local filesystem backend for one test.
+    The rate limits are reset too, so each test may upload as much as it needs.
+
+    :param tmp_path: The storage root
+    :param monkeypatch: Restore the previous backend afterwards
+    :return: The storage root
+    :doc-author: Trelent
+    """
+    monkeypatch.setattr(storage, "_storage", LocalStorage(tmp_path, "/static/avatars"))
+    LimiterBackend.reset()
+    return tmp_path
+
+
+def test_update_avatar_local_storage(client, current_user, local_storage):
+    """
+    The test_update_avatar_local_storage function tests the /api/users/avatar endpoint with the local storage backend.
+    Every standard size should be written as webp and the 250px URL saved on the user.
+
+    :param client: Make requests to the api
+    :param current_user: The authenticated user
+    :param local_storage: The storage root
+    :return: None
+    :doc-author: Trelent
+    """
+    response = client.patch(
+        "/api/users/avatar",
+        files={"file": ("avatar.png", make_png(), "image/png")},
+    )
+    assert response.status_code == 200, response.text
+    avatar = response.json()["avatar"]
+    assert avatar.startswith("/static/avatars/NotesApp/avatar/")
+    assert avatar.endswith("_250.webp")
+    files = sorted(p.name for p in (local_storage / "NotesApp" / "avatar").iterdir())
+    assert [name.split("_")[1] for name in files] == ["250.webp", "64.webp"]
+    with Image.open(local_storage / "NotesApp" / "avatar" / files[0]) as img:
+        assert img.size == (250, 250)
+
+
+def test_update_avatar_same_content_skips_upload(client, current_user, local_storage):
+    """
+    The test_update_avatar_same_content_skips_upload function tests that re-uploading the current avatar stores nothing.
+
+    :param client: Make requests to the api
+    :param current_user: The authenticated user
+    :param local_storage: The storage root
+    :return: None
+    :doc-author: Trelent
+    """
+    response = client.patch(
+        "/api/users/avatar",
+        files={"file": ("avatar.png", make_png(), "image/png")},
+    )
+    assert response.status_code == 200, response.text
+    shutil.rmtree(local_storage / "NotesApp", ignore_errors=True)
+    response = client.patch(
+        "/api/users/avatar",
+        files={"file": ("avatar.png", make_png(), "image/png")},
+    )
+    assert response.status_code == 200, response.text
+    assert response.json()["avatar"] == current_user.avatar
+    assert not any(local_storage.iterdir())
+
+
+def test_local_storage_stays_under_root(tmp_path):
+    """
+    The test_local_storage_stays_under_root function tests that a username with .. cannot write outside the storage root.
+
+    :param tmp_path: The parent of the storage root
+    :return: None
+    :doc-author: Trelent
+    """
+    backend = LocalStorage(tmp_path / "avatars", "/static/avatars")
+    with pytest.raises(ValueError):
+        backend.upload(io.BytesIO(b"x"), "NotesApp/../../x/digest_250", "webp")
+    assert list(tmp_path.iterdir()) == []
+    assert backend.upload(io.BytesIO(b"x"), "NotesApp/user/digest_250", "webp") == \
+        "/static/avatars/NotesApp/user/digest_250.webp"
+
+
+def test_update_avatar_invalid_image(client, current_user, local_storage):
+    """
+    The test_update_avatar_invalid_image function tests that a file which is not an image is rejected.
+
+    :param client: Make requests to the api
+    :param current_user: The authenticated user
+    :param local_storage: The storage root
+    :return: None
+    :doc-author: Trelent
+    """
+    response = client.patch(
+        "/api/users/avatar",
+        files={"file": ("avatar.png", b"not really a png", "image/png")},
+    )
+    assert response.status_code == 400, response.text
+    assert response.json()["detail"] == "Invalid image"
+
+
+def test_update_avatar_too_many_pixels(client, current_user, local_storage, monkeypatch):
+    """
+    The test_update_avatar_too_many_pixels function tests that images above the pixel limit are rejected before decoding.
+
+    :param client: Make requests to the api
+    :param current_user: The authenticated user
+    :param local_storage: The storage root
+    :param monkeypatch: Lower the pixel limit
+    :return: None
+    :doc-author: Trelent
+    """
+    monkeypatch.setattr("src.services.images.settings.avatar_max_pixels", 100 * 100)
+    response = client.patch(
+        "/api/users/avatar",
+        files={"file": ("avatar.png", make_png(200, 200), "image/png")},
+    )
+    assert response.status_code == 413, response.text
+
+
+@pytest.mark.parametrize("action", ["default", "error"])
+def test_update_avatar_decompression_bomb(client, current_user, local_storage, monkeypatch, action):
+    """
+    The test_update_avatar_decompression_bomb function tests that images Pillow refuses to open as bombs are rejected with 413.
+
+    :param client: Make requests to the api
+    :param current_user: The authenticated user
+    :param local_storage: The storage root
+    :param monkeypatch: Lower the pixel limit of Pillow
+    :param action: The warnings filter, "error" turns the bomb warning into an exception
+    :return: None
+    :doc-author: Trelent
+    """
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 150 * 150)
+    with warnings.catch_warnings():
+        warnings.simplefilter(action, Image.DecompressionBombWarning)
+        response = client.patch(
+            "/api/users/avatar",
+            files={"file": ("avatar.png", make_png(200 if action == "error" else 400, 200), "image/png")},
+        )
+    assert response.status_code == 413, response.text
+    assert response.json()["detail"] == "Avatar dimensions are too large"
@@ -0,0 +1,69 @@
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_import_main_defers_integrations():
+    """
+    The test_import_main_defers_integrations function tests that importing main creates no engine or clients.
+    It imports main in a fresh interpreter and checks that the rarely used integrations were not loaded.
+
+    :return: None
+    :doc-author: Trelent
+    """
+    code = (
+        "import sys, main\n"
+        "from src.database import db\n"
+        "deferred = ('cloudinary', 'fastapi_mail', 'passlib', 'PIL', 'redis', 'psycopg2')\n"
+        "print(db.engine is None, sorted(m for m in deferred if m in sys.modules))\n"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", code], cwd=ROOT, capture_output=True, text=True
+    )
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.strip() == "True []"
+
+
+def test_create_app_builds_independent_apps():
+    """
+    The test_create_app_builds_independent_apps function tests that the factory returns a new application per call.
+
+    :return: None
+    :doc-author: Trelent
+    """
+    from main import create_app
+    from src.conf.config import Settings
+
+    first, second = create_app(Settings()), create_app(Settings())
+    assert first is not second
+    assert {route.path for route in first.routes} == {route.path for route in second.routes}
+
+
+def test_config_reaches_the_services(tmp_path):
+    """
+    The test_config_reaches_the_services function tests that the settings given to the app replace the environment ones.
+
+    :return: None
+    :doc-author: Trelent
+    """
+    from src.conf.config import Settings, settings
+    from src.database import db
+    from src.services import images, profiler, tracing
+
+    config = Settings(sqlalchemy_database_url=f"sqlite:///{tmp_path / 'app.db'}",
+                      trace_export_path=str(tmp_path / "traces.jsonl"), profile_dir=str(tmp_path))
+    exporter = tracing._exporter
+    tracing.set_exporter(None)
+    try:
+        for init in (db.init_engine, images.init_images, tracing.init_tracing, profiler.init_profiler):
+            init(config)
+        assert db.get_engine().url.database == str(tmp_path / "app.db")
+        assert tracing.get_exporter().path == str(tmp_path / "traces.jsonl")
+        assert profiler.profile_path("p") == tmp_path / "p.folded"
+        assert images._config is config
+    finally:
+        for init in (db.init_engine, images.init_images, tracing.init_tracing, profiler.init_profiler):
+            init(settings)
+        tracing.set_exporter(exporter)
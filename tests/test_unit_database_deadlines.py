@@ -0,0 +1,123 @@
+import asyncio
+from unittest.mock import MagicMock
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import OperationalError
+
+from src.database.deadlines import (Deadline, DeadlineMiddleware, SCOPE_KEY, apply_statement_timeout,
+                                    parse_route_timeouts, route_timeout)
+from src.services.metrics import DB_CANCELLATIONS
+
+
+class QueryCanceled(Exception):
+    pgcode = "57014"
+
+
+def test_route_timeout():
+    timeouts = parse_route_timeouts("/api/contacts=5000, /api/contacts/search/=30000")
+    assert timeouts == {"/api/contacts": 5000, "/api/contacts/search": 30000}
+    assert route_timeout("/api/contacts/search/", timeouts, 1000) == 30000
+    assert route_timeout("/api/contacts/1", timeouts, 1000) == 5000
+    assert route_timeout("/api/users/me/", timeouts, 1000) == 1000
+
+
+def test_statement_timeout_is_set_on_postgres_only():
+    session = MagicMock(info={"statement_timeout_ms": 30000})
+    connection = MagicMock()
+    connection.dialect.name = "postgresql"
+    apply_statement_timeout(session, None, connection)
+    connection.exec_driver_sql.assert_called_once_with("SET LOCAL statement_timeout = 30000")
+    connection = MagicMock()
+    connection.dialect.name = "sqlite"
+    apply_statement_timeout(session, None, connection)
+    connection.exec_driver_sql.assert_not_called()
+
+
+def test_timeout_is_answered_504():
+    async def app(scope, receive, send):
+        raise OperationalError("SELECT", {}, QueryCanceled("canceling statement due to statement timeout"))
+
+    before = DB_CANCELLATIONS.labels("unmatched", "timeout").value()
+    client = TestClient(DeadlineMiddleware(app, 5000))
+    response = client.get("/api/contacts/search/")
+    assert response.status_code == 504
+    assert response.json() == {"detail": "Database query timed out"}
+    assert DB_CANCELLATIONS.labels("unmatched", "timeout").value() == before + 1
+
+
+def test_other_errors_are_raised():
+    async def app(scope, receive, send):
+        raise OperationalError("SELECT", {}, Exception("server closed the connection"))
+
+    client = TestClient(DeadlineMiddleware(app, 5000))
+    with pytest.raises(OperationalError):
+        client.get("/")
+
+
+def test_route_timeout_reaches_the_request():
+    app = FastAPI()
+
+    @app.get("/api/contacts/search/")
+    async def search(request: Request):
+        return {"timeout": request.scope[SCOPE_KEY].timeout_ms}
+
+    client = TestClient(DeadlineMiddleware(app, 5000, {"/api/contacts/search": 30000}))
+    assert client.get("/api/contacts/search/").json() == {"timeout": 30000}
+
+
+def test_disconnect_cancels_the_request():
+    asyncio.run(disconnect_cancels_the_request())
+
+
+async def disconnect_cancels_the_request():
+    started = asyncio.Event()
+    cancelled = []
+
+    async def app(scope, receive, send):
+        await receive()
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await started.wait()
+        return {"type": "http.disconnect"}
+
+    scope = {"type": "http", "method": "GET", "path": "/api/contacts/search/"}
+    await asyncio.wait_for(DeadlineMiddleware(app, 5000)(scope, receive, MagicMock()), 1)
+    assert cancelled == [True]
+    assert isinstance(scope[SCOPE_KEY], Deadline) and scope[SCOPE_KEY].disconnected
+
+
+def test_body_is_not_read_ahead():
+    asyncio.run(body_is_not_read_ahead())
+
+
+async def body_is_not_read_ahead():
+    chunks = [{"type": "http.request", "body": b"x", "more_body": True} for _ in range(3)]
+    chunks.append({"type": "http.request", "body": b"x", "more_body": False})
+    read = []
+
+    async def receive():
+        if len(read) < len(chunks):
+            read.append(chunks[len(read)])
+            return read[-1]
+        await asyncio.sleep(10)
+
+    async def app(scope, receive, send):
+        for expected in range(1, len(chunks) + 1):
+            await receive()
+            await asyncio.sleep(0.01)
+            assert len(read) == expected
+
+    scope = {"type": "http", "method": "POST", "path": "/api/users/avatar", "headers": [(b"content-length", b"4")]}
+    await asyncio.wait_for(DeadlineMiddleware(app, 5000)(scope, receive, MagicMock()), 1)
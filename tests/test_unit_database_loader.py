@@ -0,0 +1,89 @@
+import asyncio
+from datetime import date
+
+import pytest
+from sqlalchemy import event
+
+from src.database import loader
+from src.database.models import Contact, User
+from src.repository import contacts as repository_contacts
+from src.repository import users as repository_users
+
+
+@pytest.fixture()
+def queries(session):
+    """
+    The queries function attaches loaders to the session, as get_db does, and records its SELECTs.
+
+    :param session: The test database session
+    :return: The list of executed SELECT statements
+    :doc-author: Trelent
+    """
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", record)
+    loader.attach(session)
+    yield statements
+    loader.detach(session)
+    event.remove(engine, "before_cursor_execute", record)
+
+
+@pytest.fixture(scope="module")
+def owners(session):
+    first = User(username="first", email="first@example.com", password="x")
+    second = User(username="second", email="second@example.com", password="x")
+    session.add_all([first, second])
+    session.commit()
+    for name, owner in [("Ann", first), ("Bob", first), ("Cid", first), ("Dan", second)]:
+        session.add(Contact(name=name, surname="Lee", email=f"{name.lower()}@loader.example.com", phone_number="123",
+                            birthday=date(1990, 1, 1), additional_data="", user_id=owner.id))
+    session.commit()
+    return first, second
+
+
+def test_users_are_memoized_and_batched(session, owners, queries):
+    async def run():
+        users = await asyncio.gather(
+            repository_users.get_user_by_email("first@example.com", session),
+            repository_users.get_user_by_email("second@example.com", session),
+            repository_users.get_user_by_email("first@example.com", session),
+        )
+        again = await repository_users.get_user_by_email("first@example.com", session)
+        missing = await repository_users.get_user_by_email("nobody@example.com", session)
+        return users, again, missing
+
+    users, again, missing = asyncio.run(run())
+    assert [user.username for user in users] == ["first", "second", "first"]
+    assert again is users[0]
+    assert missing is None
+    assert len(queries) == 2
+
+
+def test_contacts_fan_out_is_one_query(session, owners, queries):
+    first, second = owners
+    other = session.query(Contact).filter(Contact.user_id == second.id).one().id
+    ids = [contact.id for contact in session.query(Contact).filter(Contact.user_id == first.id)]
+    queries.clear()
+
+    async def run():
+        found = await repository_contacts.get_contacts_by_ids(ids + [other], first, session)
+        single = await repository_contacts.get_contact(ids[0], first, session)
+        foreign = await repository_contacts.get_contact(other, first, session)
+        return found, single, foreign
+
+    found, single, foreign = asyncio.run(run())
+    assert sorted(contact.id for contact in found) == ids
+    assert single.id == ids[0]
+    assert foreign is None
+    assert len(queries) == 1
+
+
+def test_plain_session_queries_directly(session, owners):
+    assert loader.loaders(session) is None
+    user = asyncio.run(repository_users.get_user_by_email("first@example.com", session))
+    assert user.username == "first"
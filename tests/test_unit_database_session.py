@@ -0,0 +1,78 @@
+from fastapi import APIRouter, Depends, FastAPI, HTTPException
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+from src.database import db as db_module
+from src.database.db import LazySession, SessionRoute
+from src.database.models import User
+from tests.conftest import TestingSessionLocal, engine
+
+
+def test_unused_session_is_never_built():
+    built = []
+    session = LazySession(lambda: built.append(1))
+    assert session.info == {}
+    session.release()
+    session.close()
+    assert built == [] and not session.materialized
+
+
+def test_release_returns_the_connection_and_keeps_rows(session):
+    session.add(User(username="lazy", email="lazy@example.com", password="x"))
+    session.commit()
+    db = LazySession(TestingSessionLocal)
+    user = db.query(User).filter(User.email == "lazy@example.com").one()
+    assert engine.pool.checkedout() == 1
+    db.release()
+    assert engine.pool.checkedout() == 0
+    assert user.username == "lazy"
+    assert engine.pool.checkedout() == 0
+    db.close()
+
+
+def test_session_route_releases_before_serialization(session):
+    checked_out = []
+
+    class RecordingResponse(JSONResponse):
+        def render(self, content):
+            checked_out.append(engine.pool.checkedout())
+            return super().render(content)
+
+    async def get_test_db():
+        db = LazySession(TestingSessionLocal)
+        db_module.current_session.set(db)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    router = APIRouter(route_class=SessionRoute)
+
+    @router.get("/users/{email}", response_class=RecordingResponse)
+    async def read_user(email: str, db=Depends(get_test_db)):
+        user = db.query(User).filter(User.email == email).first()
+        if user is None:
+            raise HTTPException(status_code=404, detail="Not found")
+        return {"username": user.username}
+
+    app = FastAPI()
+    app.include_router(router)
+    client = TestClient(app)
+    session.add(User(username="route", email="route@example.com", password="x"))
+    session.commit()
+
+    assert client.get("/users/route@example.com").json() == {"username": "route"}
+    assert checked_out == [0]
+    assert client.get("/users/nobody@example.com").status_code == 404
+    assert engine.pool.checkedout() == 0
+
+
+def test_detached_session_outlives_the_request_session(session):
+    db = LazySession(TestingSessionLocal, statement_timeout_ms=5000)
+    with db_module.detached_session(db) as shared:
+        assert shared.factory is TestingSessionLocal and shared.statement_timeout_ms == 5000
+        assert shared.query(User).count() >= 0
+        db.close()
+        assert shared.query(User).count() >= 0
+    assert not shared.session.in_transaction()
+    assert engine.pool.checkedout() == 0
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import time
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from src.database import slow_queries
+from src.database.models import Base, User
+from src.repository.contacts import get_contacts
+
+
+class TestSlowQueries(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        """
+        The setUp function is called before each test function.
+        It logs every statement of a fresh sqlite database as slow.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        self.tmp = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.tmp.name, 'slow.db')}")
+        Base.metadata.create_all(bind=self.engine)
+        slow_queries.slow_queries.clear()
+        slow_queries.install(self.engine, threshold_ms=0)
+        self.db = sessionmaker(bind=self.engine)()
+
+    def tearDown(self):
+        self.db.close()
+        self.engine.dispose()
+        self.tmp.cleanup()
+
+    def test_redact(self):
+        self.assertEqual(slow_queries.redact({"email": "a@b.c", "id": 1}), {"email": "<str>", "id": "<int>"})
+        self.assertEqual(slow_queries.redact(("secret", 2)), ["<str>", "<int>"])
+        self.assertEqual(slow_queries.redact([("a",), ("b",)]), {"executemany": 2, "first": ["<str>"]})
+
+    async def test_records_repository_and_plan(self):
+        user = User(id=1)
+        await get_contacts(skip=0, limit=10, user=user, db=self.db)
+
+        record = slow_queries.recent(1)[0]
+        self.assertIn("FROM contacts", record["statement"])
+        self.assertEqual(record["repository"], "src.repository.contacts.get_contacts")
+        self.assertEqual(record["parameters"], ["<int>", "<int>", "<int>"])
+        self.assertIsNone(record["route"])
+        for _ in range(100):
+            if "plan" in record or "plan_error" in record:
+                break
+            time.sleep(0.01)
+        self.assertIn("plan", record)
+        self.assertTrue(any("contacts" in line for line in record["plan"]))
+
+    def test_explain_does_not_mute_the_connection(self):
+        engine = create_engine(f"sqlite:///{os.path.join(self.tmp.name, 'pool.db')}", poolclass=QueuePool,
+                               pool_size=1, max_overflow=0)
+        slow_queries.install(engine, threshold_ms=0)
+        with engine.connect() as conn:
+            conn.exec_driver_sql("SELECT 1").fetchall()
+        for _ in range(100):
+            if "plan" in slow_queries.recent(1)[0] or "plan_error" in slow_queries.recent(1)[0]:
+                break
+            time.sleep(0.01)
+        with engine.connect() as conn:
+            conn.exec_driver_sql("SELECT 2").fetchall()
+        self.assertEqual([record["statement"] for record in slow_queries.recent()], ["SELECT 2", "SELECT 1"])
+
+    def test_threshold(self):
+        engine = create_engine("sqlite://")
+        slow_queries.install(engine, threshold_ms=10_000)
+        with engine.connect() as conn:
+            conn.exec_driver_sql("SELECT 1").fetchall()
+        self.assertEqual(slow_queries.recent(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import asyncio
+import unittest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.services.admission import (
+    EXPENSIVE, READ, WRITE, AdmissionController, AdmissionMiddleware, Rejected, classify, parse_route_classes,
+)
+
+CLASSES = parse_route_classes("/api/contacts/search=expensive, /api/contacts/batch=expensive")
+
+
+class TestClassify(unittest.TestCase):
+
+    def test_classify(self):
+        self.assertEqual(classify("GET", "/api/contacts/", CLASSES), READ)
+        self.assertEqual(classify("POST", "/api/contacts/", CLASSES), WRITE)
+        self.assertEqual(classify("GET", "/api/contacts/search/", CLASSES), EXPENSIVE)
+        self.assertEqual(classify("POST", "/api/contacts/batch", CLASSES), EXPENSIVE)
+        self.assertEqual(classify("POST", "/api/contacts/batch-get", CLASSES), WRITE)
+        self.assertIsNone(classify("GET", "/metrics", CLASSES))
+
+    def test_unknown_class(self):
+        with self.assertRaises(ValueError):
+            parse_route_classes("/api/contacts/=cheap")
+
+
+class TestAdmissionController(unittest.IsolatedAsyncioTestCase):
+
+    async def test_reads_go_before_expensive_work(self):
+        controller = AdmissionController(capacity=4, queue_size=10, max_wait=1.0)
+        for _ in range(4):
+            await controller.acquire(READ)
+        order = []
+
+        async def wait(kind):
+            await controller.acquire(kind)
+            order.append(kind)
+
+        tasks = [asyncio.ensure_future(wait(EXPENSIVE)), asyncio.ensure_future(wait(READ))]
+        await asyncio.sleep(0)
+        controller.release(READ, 0.01)
+        controller.release(READ, 0.01)
+        await asyncio.gather(*tasks)
+        self.assertEqual(order, [READ, EXPENSIVE])
+        self.assertEqual(controller.running, 4)
+
+    async def test_class_share(self):
+        controller = AdmissionController(capacity=4, queue_size=0, max_wait=1.0)
+        await controller.acquire(EXPENSIVE)
+        with self.assertRaises(Rejected):
+            await controller.acquire(EXPENSIVE)
+        await controller.acquire(READ)
+
+    async def test_full_queue_rejects_at_once(self):
+        controller = AdmissionController(capacity=1, queue_size=1, max_wait=10.0)
+        await controller.acquire(READ)
+        waiter = asyncio.ensure_future(controller.acquire(READ))
+        await asyncio.sleep(0)
+        with self.assertRaises(Rejected) as rejected:
+            await controller.acquire(READ)
+        self.assertGreater(rejected.exception.retry_after, 0)
+        controller.release(READ, 0.01)
+        await waiter
+
+    async def test_deadline(self):
+        controller = AdmissionController(capacity=1, queue_size=10, max_wait=0.05)
+        controller.service_time[READ] = 1.0
+        await controller.acquire(READ)
+        with self.assertRaises(Rejected):
+            await controller.acquire(READ)
+        controller.service_time[READ] = 0.01
+        with self.assertRaises(Rejected):
+            await controller.acquire(READ)
+        self.assertEqual(controller.waiting(), 0)
+        controller.release(READ, 0.01)
+        self.assertEqual(controller.running, 0)
+
+
+def test_middleware_answers_503():
+    app = FastAPI()
+
+    @app.get("/api/contacts/")
+    async def contacts():
+        return []
+
+    app.add_middleware(AdmissionMiddleware, capacity=1, queue_size=0)
+    client = TestClient(app)
+    assert client.get("/api/contacts/").status_code == 200
+
+    middleware = app.middleware_stack
+    while not isinstance(middleware, AdmissionMiddleware):
+        middleware = middleware.app
+    middleware.controller.running = 1
+    middleware.controller.active[READ] = 1
+    response = client.get("/api/contacts/")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert client.get("/metrics").status_code == 404
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import gzip
+
+import pytest
+
+from fastapi import FastAPI, Response
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from src.services.compression import CompressedCache, CompressionMiddleware, choose_encoding, parse_route_levels
+
+PAYLOAD = [{"name": f"Contact {i}", "email": f"contact{i}@example.com"} for i in range(100)]
+
+
+def make_client(**options):
+    """
+    The make_client function builds a small application behind the CompressionMiddleware.
+
+    :param options: The options of the middleware
+    :return: The test client and the middleware
+    :doc-author: Trelent
+    """
+    app = FastAPI()
+
+    @app.get("/contacts")
+    def contacts(response: Response):
+        response.headers["ETag"] = '"v1"'
+        return PAYLOAD
+
+    @app.get("/small")
+    def small():
+        return {"ok": True}
+
+    @app.get("/stream")
+    def stream():
+        return StreamingResponse((b"line %d\n" % i for i in range(2000)), media_type="text/plain")
+
+    app.add_middleware(CompressionMiddleware, **options)
+    client = TestClient(app)
+    client.get("/small")
+    middleware = app.middleware_stack
+    while not isinstance(middleware, CompressionMiddleware):
+        middleware = middleware.app
+    return client, middleware
+
+
+def test_choose_encoding():
+    assert choose_encoding("gzip, deflate") == "gzip"
+    assert choose_encoding("gzip;q=0, deflate") is None
+    assert choose_encoding("identity") is None
+
+
+def test_parse_route_levels():
+    assert parse_route_levels("/api/contacts/=9, /api/contacts/changes=4") == {
+        "/api/contacts/": 9, "/api/contacts/changes": 4
+    }
+    assert parse_route_levels("") == {}
+
+
+def test_compresses_large_json():
+    client, _ = make_client()
+    response = client.get("/contacts", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["etag"] == 'W/"v1"'
+    assert response.json() == PAYLOAD
+    assert int(response.headers["content-length"]) < len(response.content)
+
+
+def test_prefers_brotli():
+    pytest.importorskip("brotli")
+    client, _ = make_client()
+    response = client.get("/contacts", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["content-encoding"] == "br"
+    assert response.json() == PAYLOAD
+
+
+def test_skips_small_and_unaccepted():
+    client, _ = make_client()
+    assert "content-encoding" not in client.get("/small", headers={"Accept-Encoding": "gzip"}).headers
+    assert "content-encoding" not in client.get("/contacts", headers={"Accept-Encoding": "identity"}).headers
+
+
+def test_cache_hit_skips_compression():
+    client, middleware = make_client(level=5)
+    first = client.get("/contacts", headers={"Accept-Encoding": "gzip"})
+    assert middleware.cache.size > 0
+    key = ("GET", "/contacts", b"", '"v1"', "gzip", 5)
+    middleware.cache._entries[key] = gzip.compress(b'["cached"]')
+    second = client.get("/contacts", headers={"Accept-Encoding": "gzip"})
+    assert first.json() == PAYLOAD
+    assert second.json() == ["cached"]
+
+
+def test_route_level():
+    client, middleware = make_client(route_levels={"/contacts": 1})
+    client.get("/contacts", headers={"Accept-Encoding": "gzip"})
+    assert [key[-1] for key in middleware.cache._entries] == [1]
+
+
+def test_streaming_response():
+    client, _ = make_client()
+    response = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert response.text.splitlines()[-1] == "line 1999"
+
+
+def test_cache_eviction():
+    cache = CompressedCache(10)
+    cache.put("a", b"12345")
+    cache.put("b", b"12345")
+    cache.get("a")
+    cache.put("c", b"12345")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"12345"
+    assert cache.size == 10
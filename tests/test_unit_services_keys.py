@@ -0,0 +1,64 @@
+import unittest
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from jose import JWTError
+
+from src.services.keys import KeySet, parse_key_files
+
+
+def make_pem() -> bytes:
+    key = ec.generate_private_key(ec.SECP256R1())
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                             serialization.NoEncryption())
+
+
+class TestKeySet(unittest.TestCase):
+
+    def setUp(self):
+        """
+        The setUp function is called before each test function.
+        It builds a key set with a current key and a retired one.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        self.old = KeySet.from_pem("ES256", [("old", make_pem())])
+        self.keys = KeySet.from_pem("ES256", [("new", make_pem()), ("old", self.old.private_key.to_pem())])
+
+    def test_parse_key_files(self):
+        self.assertEqual(parse_key_files("a=keys/a.pem, b=keys/b.pem"), [("a", "keys/a.pem"), ("b", "keys/b.pem")])
+        self.assertEqual(parse_key_files(""), [])
+
+    def test_sign_and_verify(self):
+        token = self.keys.encode({"sub": "a@example.com"})
+        self.assertEqual(self.keys.decode(token), {"sub": "a@example.com"})
+
+    def test_retired_key_still_verifies(self):
+        token = self.old.encode({"sub": "a@example.com"})
+        self.assertEqual(self.keys.decode(token)["sub"], "a@example.com")
+
+    def test_verifier_from_jwks(self):
+        document = self.keys.jwks()
+        self.assertEqual(sorted(key["kid"] for key in document["keys"]), ["new", "old"])
+        self.assertTrue(all("d" not in key for key in document["keys"]))
+        verifier = KeySet.from_jwks(document)
+        self.assertEqual(verifier.decode(self.keys.encode({"sub": "a"})), {"sub": "a"})
+        with self.assertRaises(ValueError):
+            verifier.encode({"sub": "a"})
+
+    def test_unknown_key(self):
+        other = KeySet.from_pem("ES256", [("new", make_pem())])
+        with self.assertRaises(JWTError):
+            self.keys.decode(other.encode({"sub": "a"}))
+        with self.assertRaises(JWTError):
+            self.keys.decode("not a token")
+
+    def test_rejects_hmac(self):
+        with self.assertRaises(ValueError):
+            KeySet("HS256")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from src.services import limiter as limiter_module
+from src.services.auth import auth_service
+from src.services.keys import KeySet
+from src.services.limiter import LimiterBackend, RateLimiter
+from tests.test_unit_services_keys import make_pem
+
+
+class SlidingWindow:
+    def __init__(self):
+        """
+        The SlidingWindow emulates the sliding window script on a simulated clock.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        self.now = 0.0
+        self.members = {}
+
+    async def __call__(self, keys, args):
+        window, limit, requested, lease_id, returned, first, last = args
+        for i in range(int(first), int(last) + 1):
+            self.members.pop(f"{returned}:{i}", None)
+        now_ms = self.now * 1000
+        self.members = {member: at for member, at in self.members.items() if at > now_ms - window}
+        granted = min(requested, limit - len(self.members))
+        if granted > 0:
+            for i in range(1, granted + 1):
+                self.members[f"{lease_id}:{i}"] = now_ms
+            return [granted, 0]
+        return [0, min(self.members.values()) + window - now_ms]
+
+
+class TestRateLimiter(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        """
+        The setUp function is called before each test function.
+        It clears every counter of the limiter backend.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        LimiterBackend.reset()
+
+    def tearDown(self):
+        """
+        The tearDown function is called after each test function.
+        It leaves the limiter backend without redis for the other tests.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        LimiterBackend.reset()
+
+    async def init_redis(self, granted):
+        """
+        The init_redis function installs a redis mock whose script grants the given number of requests.
+
+        :param self: Represent the instance of the class
+        :param granted: The answers of the sliding window script
+        :return: The mocked script
+        :doc-author: Trelent
+        """
+        script = AsyncMock(side_effect=granted)
+        redis = MagicMock()
+        redis.register_script.return_value = script
+        await LimiterBackend.init(redis, sync_interval=60)
+        return script
+
+    async def test_local_window_blocks_after_limit(self):
+        """
+        The test_local_window_blocks_after_limit function tests the in-process limiter used without redis.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        limiter = RateLimiter(times=3, seconds=60)
+        results = [await limiter.acquire("key") for _ in range(4)]
+        self.assertEqual(results[:3], [0, 0, 0])
+        self.assertGreater(results[3], 0)
+        self.assertEqual(await limiter.acquire("other"), 0)
+
+    async def test_lease_is_spent_locally(self):
+        """
+        The test_lease_is_spent_locally function tests that one redis call grants a batch of requests.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        script = await self.init_redis([[10, 0], [0, 5000]])
+        limiter = RateLimiter(times=100, seconds=60)
+        results = [await limiter.acquire("key") for _ in range(11)]
+        self.assertEqual(results[:10], [0] * 10)
+        self.assertAlmostEqual(results[10], 5, places=1)
+        self.assertEqual(script.await_count, 2)
+
+    async def test_unused_lease_is_given_back(self):
+        """
+        The test_unused_lease_is_given_back function tests that a client slower than the sync interval
+        is not charged for the requests its expired leases did not spend.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        window = SlidingWindow()
+        redis = MagicMock()
+        redis.register_script.return_value = window
+        await LimiterBackend.init(redis, sync_interval=1)
+        limiter = RateLimiter(times=100, seconds=60)
+        with patch.object(limiter_module.time, "monotonic", lambda: window.now):
+            for i in range(30):
+                window.now = i * 2.0
+                self.assertEqual(await limiter.acquire("key"), 0)
+        self.assertEqual(len(window.members), 30 + limiter.lease_size - 1)
+
+    async def test_blocked_key_is_not_rechecked(self):
+        """
+        The test_blocked_key_is_not_rechecked function tests that a rejected key is answered locally until retry time.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        script = await self.init_redis([[0, 30000]])
+        limiter = RateLimiter(times=1, seconds=60)
+        self.assertGreater(await limiter.acquire("key"), 0)
+        self.assertGreater(await limiter.acquire("key"), 0)
+        self.assertEqual(script.await_count, 1)
+
+    async def test_redis_error_falls_back_to_local(self):
+        """
+        The test_redis_error_falls_back_to_local function tests that redis failures do not fail requests.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        await self.init_redis(ConnectionError("redis is down"))
+        limiter = RateLimiter(times=1, seconds=60)
+        self.assertEqual(await limiter.acquire("key"), 0)
+        self.assertGreater(await limiter.acquire("key"), 0)
+
+    def test_identify_by_ip(self):
+        """
+        The test_identify_by_ip function tests that requests without a token are keyed by the forwarded ip.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        request = MagicMock()
+        request.headers = {"X-Forwarded-For": "10.0.0.1, 10.0.0.2"}
+        self.assertEqual(RateLimiter(times=1, seconds=1).identify(request), "ip:10.0.0.1")
+
+
+    async def test_identify_by_access_token(self):
+        """
+        The test_identify_by_access_token function tests that only access tokens verified by the auth service key the limit by user.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        limiter = RateLimiter(times=1, seconds=1)
+        request = MagicMock()
+        auth_service.key_set = KeySet.from_pem("ES256", [("k1", make_pem())])
+        try:
+            for create, identity in ((auth_service.create_access_token, "user:a@example.com"),
+                                     (auth_service.create_refresh_token, "ip:10.0.0.1")):
+                token = await create(data={"sub": "a@example.com"})
+                request.headers = {"Authorization": f"Bearer {token}", "X-Forwarded-For": "10.0.0.1"}
+                self.assertEqual(limiter.identify(request), identity)
+        finally:
+            auth_service.key_set = None
+
+    async def test_token_is_decoded_once(self):
+        """
+        The test_token_is_decoded_once function tests that authentication reuses the claims the limiter decoded.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        request = MagicMock()
+        request.state = SimpleNamespace()
+        auth_service.key_set = KeySet.from_pem("ES256", [("k1", make_pem())])
+        try:
+            token = await auth_service.create_access_token(data={"sub": "a@example.com"})
+            request.headers = {"Authorization": f"Bearer {token}"}
+            with patch.object(auth_service, "decode", wraps=auth_service.decode) as decode:
+                self.assertEqual(RateLimiter(times=1, seconds=1).identify(request), "user:a@example.com")
+                payload = await auth_service.verify_access_token(token, request.state)
+            self.assertEqual(payload["sub"], "a@example.com")
+            decode.assert_called_once_with(token)
+        finally:
+            auth_service.key_set = None
+
+    async def test_many_keys_do_not_reset_limits(self):
+        """
+        The test_many_keys_do_not_reset_limits function tests that a flood of new keys evicts idle windows, not every window.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        limiter = RateLimiter(times=1, seconds=60)
+        await limiter.acquire("login")
+        for i in range(limiter_module.MAX_TRACKED_KEYS * 2):
+            if i % 1000 == 0:
+                self.assertGreater(await limiter.acquire("login"), 0)
+            await limiter.acquire(f"flood:{i}")
+        self.assertLess(len(LimiterBackend._windows), limiter_module.MAX_TRACKED_KEYS)
+        self.assertGreater(await limiter.acquire("login"), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
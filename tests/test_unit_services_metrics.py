@@ -0,0 +1,66 @@
+import threading
+import unittest
+
+from src.services import metrics
+from src.services.metrics import Counter, Gauge, Histogram
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counter_sums_threads(self):
+        """
+        The test_counter_sums_threads function tests that increments from several threads are all counted.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        counter = Counter("test_threads", "Test counter.", ("kind",))
+
+        def work():
+            for _ in range(10000):
+                counter.labels("a").inc()
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.labels("a").value(), 40000)
+        self.assertIn('test_threads_total{kind="a"} 40000', counter.render())
+        self.assertIn("# TYPE test_threads_total counter", counter.render())
+        self.assertIn("# HELP test_threads_total ", counter.render())
+
+    def test_histogram_buckets_are_cumulative(self):
+        """
+        The test_histogram_buckets_are_cumulative function tests the exposition of a histogram.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        histogram = Histogram("test_latency", "Test histogram.", buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        text = histogram.render()
+        self.assertIn('test_latency_bucket{le="0.1"} 2', text)
+        self.assertIn('test_latency_bucket{le="1"} 3', text)
+        self.assertIn('test_latency_bucket{le="+Inf"} 4', text)
+        self.assertIn("test_latency_count 4", text)
+        self.assertIn("test_latency_sum 3.65", text)
+
+    def test_gauge_function_and_label_escaping(self):
+        """
+        The test_gauge_function_and_label_escaping function tests callback gauges and quoting of label values.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        gauge = Gauge("test_pool", "Test gauge.", ("state",), function=lambda: {('say "hi"',): 3})
+        self.assertIn('test_pool{state="say \\"hi\\""} 3', gauge.render())
+        self.assertIn("# TYPE test_pool gauge", metrics.render())
+
+
+if __name__ == '__main__':
+    unittest.main()
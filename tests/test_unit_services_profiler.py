@@ -0,0 +1,75 @@
+import threading
+import time
+import unittest
+
+from src.services.profiler import (
+    ContinuousProfiler,
+    StackSampler,
+    render_folded,
+    sign_profile_token,
+    verify_profile_token,
+)
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class TestProfiler(unittest.TestCase):
+
+    def test_profile_token_is_bound_to_path_and_expiry(self):
+        """
+        The test_profile_token_is_bound_to_path_and_expiry function tests the signed X-Profile tokens.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        token = sign_profile_token("/api/contacts/", 60, secret="secret")
+        self.assertTrue(verify_profile_token(token, "/api/contacts/", secret="secret"))
+        self.assertFalse(verify_profile_token(token, "/api/users/me/", secret="secret"))
+        self.assertFalse(verify_profile_token(token, "/api/contacts/", secret="other"))
+        self.assertFalse(verify_profile_token(sign_profile_token("/", -1, secret="secret"), "/", secret="secret"))
+        self.assertFalse(verify_profile_token("garbage", "/", secret="secret"))
+
+    def test_sampler_records_folded_stacks(self):
+        """
+        The test_sampler_records_folded_stacks function tests that a busy function shows up in the sampled stacks.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        sampler = StackSampler(threading.get_ident(), 0.001).start()
+        busy(0.05)
+        folded = render_folded(sampler.stop())
+        self.assertIn("busy (test_unit_services_profiler.py:", folded)
+        self.assertTrue(all(line.rsplit(" ", 1)[1].isdigit() for line in folded.splitlines()))
+
+    def test_continuous_profiler_groups_by_route(self):
+        """
+        The test_continuous_profiler_groups_by_route function tests that samples are attributed to the endpoint on the stack.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        class Route:
+            endpoint = staticmethod(busy)
+            methods = {"GET"}
+            path = "/busy"
+
+        class App:
+            routes = [Route()]
+
+        profiler = ContinuousProfiler(threading.get_ident(), 0.001, App()).start()
+        busy(0.05)
+        profiler.stop()
+        self.assertIn("GET /busy", profiler.by_route)
+        self.assertIn("busy (", profiler.report("GET /busy"))
+
+
+if __name__ == '__main__':
+    unittest.main()
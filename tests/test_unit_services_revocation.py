@@ -0,0 +1,62 @@
+import time
+import unittest
+from unittest.mock import patch
+
+from src.services import revocation
+from src.services.revocation import BloomFilter, RevocationList
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000)
+        items = [f"jti-{i}" for i in range(1000)]
+        for item in items:
+            bloom.add(item)
+        self.assertTrue(all(item in bloom for item in items))
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"jti-{i}")
+        false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class TestRevocationList(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        """
+        The setUp function is called before each test function.
+        It uses the in-process denylist, as when redis is not configured.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        RevocationList.reset(1000)
+
+    async def test_revoke(self):
+        self.assertFalse(await RevocationList.is_revoked("a", None))
+        await RevocationList.revoke("a", 60)
+        self.assertTrue(await RevocationList.is_revoked("a", None))
+        self.assertTrue(await RevocationList.is_revoked("b", "a"))
+        self.assertFalse(await RevocationList.is_revoked("b", None))
+
+    async def test_expired_revocation(self):
+        await RevocationList.revoke("a", 1)
+        with patch.object(revocation.time, "time", return_value=time.time() + 2):
+            self.assertFalse(await RevocationList.is_revoked("a"))
+
+    async def test_generations(self):
+        await RevocationList.revoke("a", 60)
+        start = time.monotonic()
+        with patch.object(revocation.time, "monotonic", return_value=start + revocation.ACCESS_TTL):
+            self.assertTrue(await RevocationList.is_revoked("a"))
+        with patch.object(revocation.time, "monotonic", return_value=start + 2 * revocation.ACCESS_TTL + 1):
+            self.assertFalse(await RevocationList.is_revoked("a"))
+            self.assertNotIn("a", RevocationList._previous)
+
+
+if __name__ == '__main__':
+    unittest.main()
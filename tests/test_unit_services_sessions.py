@@ -0,0 +1,49 @@
+import unittest
+
+from src.services.sessions import REUSED, ROTATED, UNKNOWN, RefreshTokenStore
+
+
+class TestRefreshTokenStore(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        """
+        The setUp function is called before each test function.
+        It uses the in-process store, as when redis is not configured.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        RefreshTokenStore.reset()
+
+    async def test_rotate(self):
+        sid, jti = await RefreshTokenStore.create("a@example.com", "phone")
+        result, new_jti = await RefreshTokenStore.rotate("a@example.com", sid, jti)
+        self.assertEqual(result, ROTATED)
+        self.assertNotEqual(new_jti, jti)
+        result, _ = await RefreshTokenStore.rotate("a@example.com", sid, new_jti)
+        self.assertEqual(result, ROTATED)
+
+    async def test_reuse_revokes_session(self):
+        sid, jti = await RefreshTokenStore.create("a@example.com", "phone")
+        _, new_jti = await RefreshTokenStore.rotate("a@example.com", sid, jti)
+        self.assertEqual((await RefreshTokenStore.rotate("a@example.com", sid, jti))[0], REUSED)
+        self.assertEqual((await RefreshTokenStore.rotate("a@example.com", sid, new_jti))[0], UNKNOWN)
+        self.assertEqual(await RefreshTokenStore.sessions("a@example.com"), [])
+
+    async def test_sessions_and_revoke(self):
+        phone, _ = await RefreshTokenStore.create("a@example.com", "phone")
+        laptop, _ = await RefreshTokenStore.create("a@example.com", "laptop")
+        other, _ = await RefreshTokenStore.create("b@example.com", "phone")
+        devices = {session["device"] for session in await RefreshTokenStore.sessions("a@example.com")}
+        self.assertEqual(devices, {"phone", "laptop"})
+
+        self.assertFalse(await RefreshTokenStore.revoke("a@example.com", other))
+        self.assertTrue(await RefreshTokenStore.revoke("a@example.com", phone))
+        self.assertEqual([s["id"] for s in await RefreshTokenStore.sessions("a@example.com")], [laptop])
+        self.assertEqual(await RefreshTokenStore.revoke_all("a@example.com"), [laptop])
+        self.assertEqual(len(await RefreshTokenStore.sessions("b@example.com")), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+from src.services.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        """
+        The setUp function is called before each test function.
+        It builds a flight without redis, as when redis is not configured.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        SingleFlight.reset()
+        self.flight = SingleFlight("test", wait=0.2, poll=0.01)
+        self.loads = 0
+
+    async def load(self):
+        self.loads += 1
+        result = self.loads
+        await asyncio.sleep(0.01)
+        return result
+
+    async def test_coalesces_concurrent_calls(self):
+        results = await asyncio.gather(*(self.flight.do("a", self.load) for _ in range(10)))
+        self.assertEqual(results, [1] * 10)
+        self.assertEqual(self.flight._calls, {})
+        self.assertEqual(await self.flight.do("a", self.load), 2)
+
+    async def test_keys_are_independent(self):
+        results = await asyncio.gather(self.flight.do("a", self.load), self.flight.do("b", self.load))
+        self.assertEqual(sorted(results), [1, 2])
+
+    async def test_failure_reaches_every_caller(self):
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("down")
+
+        results = await asyncio.gather(*(self.flight.do("a", fail) for _ in range(3)), return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertEqual(await self.flight.do("a", self.load), 1)
+
+    async def test_cancelled_caller_does_not_cancel_load(self):
+        first = asyncio.ensure_future(self.flight.do("a", self.load))
+        second = asyncio.ensure_future(self.flight.do("a", self.load))
+        await asyncio.sleep(0)
+        first.cancel()
+        self.assertEqual(await second, 1)
+
+    async def test_waits_for_the_lock_holder(self):
+        SingleFlight.redis = MagicMock(set=AsyncMock(return_value=None))
+        cached = AsyncMock(side_effect=[None, "filled"])
+        self.assertEqual(await self.flight.do("a", self.load, cached), "filled")
+        self.assertEqual(self.loads, 0)
+
+    async def test_loads_when_the_holder_is_slow(self):
+        SingleFlight.redis = MagicMock(set=AsyncMock(return_value=None))
+        self.assertEqual(await self.flight.do("a", self.load, AsyncMock(return_value=None)), 1)
+
+    async def test_lock_holder_loads_and_releases(self):
+        SingleFlight.redis = MagicMock(set=AsyncMock(return_value=True))
+        SingleFlight.script = AsyncMock()
+        self.assertEqual(await self.flight.do("a", self.load, AsyncMock()), 1)
+        SingleFlight.script.assert_awaited_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
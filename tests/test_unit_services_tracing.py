@@ -0,0 +1,147 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from src.services import tracing
+from src.services.tracing import JsonFileExporter, parse_traceparent, span, start_trace, traced
+
+
+class MemoryExporter:
+    def __init__(self):
+        self.traces = []
+
+    def export(self, trace):
+        self.traces.append(trace)
+
+
+@traced()
+async def load(value):
+    with span("inner", value=value):
+        return value
+
+
+class TestTracing(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        """
+        The setUp function is called before each test function.
+        It collects the finished traces in memory.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        self.exporter = MemoryExporter()
+        tracing.set_exporter(self.exporter)
+
+    def tearDown(self):
+        tracing.set_exporter(None)
+
+    async def test_sampled_trace_records_nested_spans(self):
+        """
+        The test_sampled_trace_records_nested_spans function tests that spans of a sampled trace are linked to their parents.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        with start_trace("GET /", sample_rate=1.0) as root:
+            self.assertEqual(await load(5), 5)
+        self.assertIsNone(tracing.current_span())
+        [trace] = self.exporter.traces
+        spans = {s.name: s for s in trace.spans}
+        self.assertEqual(set(spans), {"GET /", "test_unit_services_tracing.load", "inner"})
+        self.assertEqual(spans["inner"].parent_id, spans["test_unit_services_tracing.load"].span_id)
+        self.assertEqual(spans["test_unit_services_tracing.load"].parent_id, root.span_id)
+        self.assertEqual(spans["inner"].attributes, {"value": 5})
+
+    async def test_sampled_out_trace_records_nothing(self):
+        """
+        The test_sampled_out_trace_records_nothing function tests that nothing is recorded for unsampled requests.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        with start_trace("GET /", sample_rate=0.0) as root:
+            self.assertIsNone(root)
+            self.assertEqual(await load(1), 1)
+        self.assertEqual(self.exporter.traces, [])
+
+    async def test_traceparent_decides_sampling(self):
+        """
+        The test_traceparent_decides_sampling function tests that an incoming W3C traceparent continues its trace,
+        and that its sampled flag only decides when the upstream is trusted.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        header = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+        with start_trace("GET /", header, sample_rate=0.0, trust_upstream=True) as root:
+            self.assertEqual(root.trace.trace_id, "0af7651916cd43dd8448eb211c80319c")
+            self.assertEqual(root.parent_id, "b7ad6b7169203331")
+            self.assertEqual(root.to_otlp()["kind"], 2)
+            with span("child") as child:
+                self.assertEqual(child.to_otlp()["kind"], 1)
+        with start_trace("GET /", header[:-1] + "0", sample_rate=1.0, trust_upstream=True) as root:
+            self.assertIsNone(root)
+
+        with start_trace("GET /", header, sample_rate=0.0) as root:
+            self.assertIsNone(root)
+        with start_trace("GET /", header[:-1] + "0", sample_rate=1.0) as root:
+            self.assertEqual(root.trace.trace_id, "0af7651916cd43dd8448eb211c80319c")
+
+    def test_invalid_traceparent_is_ignored(self):
+        """
+        The test_invalid_traceparent_is_ignored function tests that malformed traceparent headers start a fresh trace.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        trace_id, span_id = "0af7651916cd43dd8448eb211c80319c", "b7ad6b7169203331"
+        self.assertEqual(parse_traceparent(f"00-{trace_id}-{span_id}-01"), (trace_id, span_id, True))
+        self.assertEqual(parse_traceparent(f"01-{trace_id}-{span_id}-00-later"), (trace_id, span_id, False))
+        for header in (
+            f"00-{trace_id}-{span_id}-zz",
+            f"00-{trace_id.upper()}-{span_id}-01",
+            f"0x-{trace_id}-{span_id}-01",
+            f"ff-{trace_id}-{span_id}-01",
+            f"00-{trace_id}-{span_id}-01-extra",
+            f"00-{'0' * 32}-{span_id}-01",
+            f"00-{trace_id}-{'0' * 16}-01",
+            f"00-{trace_id}-{span_id}-1",
+        ):
+            self.assertIsNone(parse_traceparent(header), header)
+        with start_trace("GET /", f"00-{trace_id}-{span_id}-zz", sample_rate=1.0) as root:
+            self.assertNotEqual(root.trace.trace_id, trace_id)
+
+    async def test_file_exporter_writes_otlp_json(self):
+        """
+        The test_file_exporter_writes_otlp_json function tests the OTLP/JSON lines written by the file exporter.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "traces.jsonl")
+            tracing.set_exporter(JsonFileExporter(path))
+            with start_trace("GET /", sample_rate=1.0, user=1):
+                pass
+            for _ in range(100):
+                if os.path.exists(path) and os.path.getsize(path):
+                    break
+                time.sleep(0.01)
+            with open(path) as fh:
+                line = json.loads(fh.readline())
+        [otlp_span] = line["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        self.assertEqual(otlp_span["name"], "GET /")
+        self.assertEqual(otlp_span["attributes"], [{"key": "user", "value": {"intValue": "1"}}])
+
+
+if __name__ == '__main__':
+    unittest.main()
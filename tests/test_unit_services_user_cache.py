@@ -0,0 +1,83 @@
+import pickle
+import time
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from src.database.models import User
+from src.repository.users import confirmed_email
+from src.services import user_cache
+from src.services.user_cache import UserCache
+
+
+class TestUserCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        """
+        The setUp function is called before each test function.
+        It uses the local tier alone, as when redis is not configured.
+
+        :param self: Represent the instance of the class
+        :return: None
+        :doc-author: Trelent
+        """
+        UserCache.reset(ttl=60, size=2)
+
+    def test_get_put(self):
+        version = UserCache.version("a@example.com")
+        self.assertIsNone(UserCache.get("a@example.com"))
+        self.assertTrue(UserCache.put("a@example.com", b"a", version))
+        self.assertEqual(UserCache.get("a@example.com"), b"a")
+
+    def test_expiry(self):
+        UserCache.put("a@example.com", b"a", UserCache.version("a@example.com"))
+        with patch.object(user_cache.time, "monotonic", return_value=time.monotonic() + 61):
+            self.assertIsNone(UserCache.get("a@example.com"))
+
+    def test_eviction(self):
+        for email in ("a@example.com", "b@example.com", "c@example.com"):
+            UserCache.put(email, email.encode(), UserCache.version(email))
+        self.assertIsNone(UserCache.get("a@example.com"))
+        self.assertEqual(UserCache.get("c@example.com"), b"c@example.com")
+
+    async def test_stale_read_is_not_stored(self):
+        version = UserCache.version("a@example.com")
+        other = UserCache.version("b@example.com")
+        await UserCache.invalidate("a@example.com")
+        self.assertFalse(UserCache.put("a@example.com", b"stale", version))
+        self.assertIsNone(UserCache.get("a@example.com"))
+        # Only the fills of the invalidated user are dropped.
+        self.assertTrue(UserCache.put("b@example.com", b"b", other))
+
+    def test_versions_are_bounded(self):
+        version = UserCache.version("c@example.com")
+        for email in ("a@example.com", "b@example.com", "d@example.com"):
+            UserCache.evict(email)
+        self.assertLessEqual(len(UserCache._versions), UserCache.size)
+        self.assertFalse(UserCache.put("c@example.com", b"c", version))
+
+    async def test_invalidate_publishes(self):
+        UserCache.put("a@example.com", b"a", UserCache.version("a@example.com"))
+        pipe = MagicMock(execute=AsyncMock())
+        pipe.__aenter__ = AsyncMock(return_value=pipe)
+        pipe.__aexit__ = AsyncMock(return_value=False)
+        UserCache.redis = MagicMock(publish=AsyncMock())
+        UserCache.redis.pipeline.return_value = pipe
+        await UserCache.invalidate("a@example.com")
+        self.assertIsNone(UserCache.get("a@example.com"))
+        pipe.incr.assert_called_once_with("user-version:a@example.com")
+        pipe.delete.assert_called_once_with("user:a@example.com")
+        pipe.execute.assert_awaited_once()
+        UserCache.redis.publish.assert_awaited_once_with(user_cache.CHANNEL, "a@example.com")
+
+    async def test_write_path_invalidates(self):
+        email = "a@example.com"
+        user = User(email=email, confirmed=False)
+        UserCache.put(email, pickle.dumps(user), UserCache.version(email))
+        db = MagicMock()
+        db.query().filter().first.return_value = user
+        await confirmed_email(email, db=db)
+        self.assertIsNone(UserCache.get(email))
+
+
+if __name__ == '__main__':
+    unittest.main()